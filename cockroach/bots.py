@@ -0,0 +1,125 @@
+'''
+Computer players for live Cockroach Poker tables.
+
+Automated seats are played by the turn scheduler (see `games.scheduler`),
+which asks the engine's model policy for each move afresh.
+
+A `TableBot`, on the other hand, joins a game through `game_logic.join`, like anyone else,
+and from then on `act` makes its move whenever it is its turn: it loads
+the game, decides with one of the engine's policies (see
+`cockroach.engine`) and plays through the game logic, then tells the
+table, as a move from the game page would.
+
+The bot keeps its policy between turns, so its opponent model learns from
+each card turned over that it gets to see: any call made since it last
+looked at the table is worked out from the last claim and whose tricks
+grew.
+'''
+import random
+from games.loader import in_turn_order
+from games.aio import announced
+from games.scheduler import Autoplay, Plan, scheduler
+from .models import Game
+from . import engine
+from . import game_logic as GM
+from . import views
+
+
+class TableBot:
+    def __init__ ( self, tag, nickname, policy='model', token=None, rng=None ):
+        self.tag = tag
+        self.nickname = nickname
+        self.spec = policy
+        self.token = token
+        self.rng = rng or random.Random()
+        self.policy = None
+        self.last = None
+
+    def join ( self, house_rules=False ):
+        '''
+        Take a seat at the table (creating the game if need be).
+        '''
+        token, msg, notify = announced(Game, GM.join, views.send_notification)(self.tag, self.nickname, house_rules=house_rules)
+        if token is not None:
+            self.token = token
+        return token, msg, notify
+
+    def watch ( self, table ):
+        '''
+        Learn from a card turned over since the last look, if there was one.
+        '''
+        last, self.last = self.last, table
+        if (last is None) or (last.stage != engine.PLAYING):
+            return
+
+        grew = [ (seat, suit) for seat in range(len(table.tricks)) for suit in range(engine.SUITS)
+                 if table.tricks[seat][suit] > last.tricks[seat][suit] ]
+        if len(grew) != 1:
+            return
+
+        loser, card = grew[0]
+        caller = last.next_player
+        nominator = last.nominator[caller]
+        claim = last.claim[nominator]
+        # the caller was right if the card went back to whoever passed it
+        verdict = (claim == card) == (loser == nominator)
+        self.policy.observe(nominator, claim, card, caller, verdict)
+
+    def act ( self ):
+        '''
+        Move if it is the bot's turn. Returns the move's (message, success),
+        or None if there was nothing to do.
+        '''
+        game, player, err = GM.get_game_and_player(self.tag, self.token)
+        if err is not None:
+            return None
+
+        players = in_turn_order(game)
+        table = engine.Table.from_game(game, players)
+        if self.policy is None:
+            self.policy = engine.make_policy(self.spec, len(players), self.rng)
+        self.watch(table)
+
+        seat = player.turn_order
+        if not table.moves(seat):
+            return None
+
+        move, kwargs = self.policy.choose(table, seat)
+        if move == 'play':
+            suit = kwargs.pop('suit')
+            kwargs['card_idx'] = sum(table.hands[seat][:suit])
+
+        return announced(Game, getattr(GM, move), views.send_notification)(self.tag, self.token, **kwargs)
+
+
+class CockroachAutoplay(Autoplay):
+    Game = Game
+    logic = GM
+    notify = staticmethod(views.send_notification)
+
+    # the engine policy bots play with
+    policy = 'model'
+
+    def waiting ( self, game, players ):
+        if game.stage in (Game.Stage.STARTING, Game.Stage.PLAYING):
+            return [ players[game.next_player] ]
+        return []
+
+    def plan ( self, game, players, player ):
+        table = engine.Table.from_game(game, players)
+        seat = player.turn_order
+        hand = list(table.hands[seat])
+
+        def finish ( choice ):
+            move, kwargs = choice
+            if move == 'play':
+                kwargs = dict(kwargs)
+                kwargs['card_idx'] = sum(hand[:kwargs.pop('suit')])
+            return move, kwargs
+
+        rng = random.Random()
+        fallback = finish(engine.make_policy('random', len(players), rng).choose(table, seat))
+        return Plan(engine.decide, (table, seat, self.policy, rng.getrandbits(64)), finish, fallback)
+
+
+scheduler.register(CockroachAutoplay())
@@ -0,0 +1,6 @@
+from games.consumers import GameConsumer
+from . import views
+
+
+class CockroachConsumer(GameConsumer):
+    pages = views.pages
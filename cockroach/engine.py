@@ -0,0 +1,455 @@
+'''
+Headless Cockroach Poker, bluffing bots, and batch simulation.
+
+    python -m cockroach.engine --games 2000 --players 3 4 5 6 7 8 --policy model --policy random
+
+A `Table` plays the rules of `cockroach.game_logic` without the database:
+hands and tricks are per-suit count vectors (as `SuitCounts` holds them),
+so a stored game converts straight across and card counting is a matter
+of subtracting vectors.
+
+Policies choose what each seat does when it is their turn:
+
+ * random: play and pass at random, call at random
+ * model[:B]: keep an `OpponentModel` of how often each player tells the
+   truth when they claim and says "true" when they call, learned from
+   every card turned over. It plays the card that hurts its target most,
+   tells the truth or lies to make that target's usual call wrong (and
+   bluffs at random B% of the time, 20 by default), calls when it is
+   confident, and otherwise looks at the card and passes it on.
+
+`simulate` plays many games across a process pool, with the policies
+shuffled into new seats every game, and reports how often each policy
+lost and won. Bots for live tables are in `cockroach.bots`.
+'''
+import argparse, os, random, time
+from concurrent.futures import ProcessPoolExecutor
+from .rules import MIN_PLAYERS, MAX_PLAYERS, SUITS, CARDS_PER_SUIT, LOSE_COUNT, deal
+
+# game stages, numbered as cockroach.models.Game.Stage
+GATHERING, STARTING, PLAYING, GAME_OVER = range(4)
+
+# player statuses, numbered as cockroach.models.Player.Status
+WAITING, ACTING, WATCHING, LOST, WON = range(5)
+
+# what taking a card that finishes a player off costs them
+FATAL = 100.0
+
+
+def counts ( cards ):
+    '''
+    A per-suit count vector from a container or list of suits.
+    '''
+    vector = [0] * SUITS
+    for suit in cards:
+        vector[suit] += 1
+    return vector
+
+
+class Table:
+    '''
+    One game of Cockroach Poker, seats numbered in turn order.
+    '''
+    __slots__ = ('stage', 'next_player', 'card', 'house_rules', 'hands', 'tricks',
+                 'seen', 'claim', 'target', 'nominator', 'status')
+
+    def __init__ ( self, players, house_rules=False, rng=random ):
+        self.house_rules = house_rules
+        self.hands = [ counts(hand) for hand in deal(players, rng) ]
+        self.tricks = [ [0] * SUITS for ii in range(players) ]
+        self.seen = [False] * players
+        self.claim = [-1] * players
+        self.target = [-1] * players
+        self.nominator = [-1] * players
+        self.status = [WAITING] * players
+        self.round_start(0)
+
+    @classmethod
+    def from_game ( cls, game, players ):
+        '''
+        A table as a stored game stands, with its players in turn order.
+        '''
+        table = cls.__new__(cls)
+        table.stage = game.stage
+        table.next_player = game.next_player
+        table.card = game.card
+        table.house_rules = game.house_rules
+        table.hands = [ counts(pp.hand) for pp in players ]
+        table.tricks = [ counts(pp.tricks) for pp in players ]
+        for name in ('seen', 'claim', 'target', 'nominator', 'status'):
+            setattr(table, name, [ getattr(pp, name) for pp in players ])
+        return table
+
+    def key ( self ):
+        '''
+        Everything about the table as a tuple, for comparing tables.
+        '''
+        return (self.stage, self.next_player, self.card, self.house_rules,
+                tuple(map(tuple, self.hands)), tuple(map(tuple, self.tricks)),
+                tuple(self.seen), tuple(self.claim), tuple(self.target), tuple(self.nominator), tuple(self.status))
+
+    def round_start ( self, next_player ):
+        self.stage = STARTING
+        self.next_player = next_player
+        self.card = -1
+        for seat in range(len(self.hands)):
+            self.claim[seat] = -1
+            self.seen[seat] = False
+            self.target[seat] = -1
+            self.nominator[seat] = seat if seat == next_player else -1
+            self.status[seat] = ACTING if seat == next_player else WATCHING
+
+    def available ( self ):
+        '''
+        Seats that haven't had the card in play this round.
+        '''
+        return [ seat for seat, nominator in enumerate(self.nominator) if nominator == -1 ]
+
+    def moves ( self, seat ):
+        '''
+        The moves open to a seat, as the game page offers them.
+        '''
+        if seat != self.next_player:
+            return []
+        if self.stage == STARTING:
+            return ['play']
+        if self.stage == PLAYING:
+            if self.seen[seat]:
+                return ['refer']
+            return ['peek', 'refer', 'call'] if self.available() else ['call']
+        return []
+
+    def play ( self, seat, move, **kwargs ):
+        return getattr(self, 'move_' + move)(seat, **kwargs)
+
+    def pass_card ( self, seat, target, claim ):
+        if (target == seat) or (target not in self.available()):
+            raise ValueError('seat %i cannot pass to %i' % (seat, target))
+        if not (0 <= claim < SUITS):
+            raise ValueError('claimed suit is out of range (%i)' % claim)
+        self.next_player = target
+        self.target[seat] = target
+        self.claim[seat] = claim
+        self.status[seat] = WATCHING
+        self.nominator[target] = seat
+        self.status[target] = ACTING
+
+    def move_play ( self, seat, suit, target, claim ):
+        if not self.hands[seat][suit]:
+            raise ValueError('seat %i has no card of suit %i' % (seat, suit))
+        self.pass_card(seat, target, claim)
+        self.hands[seat][suit] -= 1
+        self.stage = PLAYING
+        self.card = suit
+        self.seen[seat] = True
+
+    def move_peek ( self, seat ):
+        if not self.available():
+            raise ValueError('there is no-one left to pass to')
+        self.seen[seat] = True
+
+    def move_refer ( self, seat, target, claim ):
+        self.pass_card(seat, target, claim)
+
+    def move_call ( self, seat, verdict ):
+        '''
+        Call the claim made to `seat` true or false. Returns the seat that
+        takes the card.
+        '''
+        if self.seen[seat]:
+            raise ValueError('seat %i has seen the card so cannot call' % seat)
+        nominator = self.nominator[seat]
+        loser = nominator if verdict == (self.claim[nominator] == self.card) else seat
+
+        tricks = self.tricks[loser]
+        tricks[self.card] += 1
+
+        over = False
+        if tricks[self.card] == LOSE_COUNT:
+            over, loser_status, other_status = True, LOST, WON
+        elif self.house_rules and all(tricks):
+            over, loser_status, other_status = True, WON, LOST
+        elif not sum(self.hands[loser]):
+            over, loser_status, other_status = True, LOST, WON
+
+        if over:
+            self.status = [ loser_status if seat == loser else other_status for seat in range(len(self.hands)) ]
+            self.stage = GAME_OVER
+            self.next_player = -1
+            self.card = -1
+        else:
+            self.round_start(loser)
+        return loser
+
+
+class OpponentModel:
+    '''
+    What one seat has learned about the others: for each, how many of
+    their claims turned out true, and how many of their calls were "true",
+    out of those seen.
+    '''
+    def __init__ ( self, players ):
+        self.truths = [0] * players
+        self.claims = [0] * players
+        self.true_calls = [0] * players
+        self.calls = [0] * players
+
+    def observe ( self, nominator, claim, card, caller, verdict ):
+        '''
+        Learn from a card turned over by a call.
+        '''
+        self.claims[nominator] += 1
+        self.truths[nominator] += claim == card
+        self.calls[caller] += 1
+        self.true_calls[caller] += bool(verdict)
+
+    def honesty ( self, seat ):
+        '''
+        How likely a claim by `seat` is to be true.
+        '''
+        return (self.truths[seat] + 1) / (self.claims[seat] + 2)
+
+    def credulity ( self, seat ):
+        '''
+        How likely `seat` is to call a claim true.
+        '''
+        return (self.true_calls[seat] + 1) / (self.calls[seat] + 2)
+
+    def unseen ( self, table, seat ):
+        '''
+        Per-suit counts of the cards `seat` can't account for: the deck,
+        less its own hand and everyone's tricks.
+        '''
+        vector = [CARDS_PER_SUIT] * SUITS
+        for suit in range(SUITS):
+            vector[suit] -= table.hands[seat][suit]
+            for tricks in table.tricks:
+                vector[suit] -= tricks[suit]
+        return vector
+
+    def claim_true ( self, table, seat ):
+        '''
+        How likely the claim made to `seat` is to be true. A claim of a
+        suit with no card left unaccounted for can't be.
+        '''
+        nominator = table.nominator[seat]
+        claim = table.claim[nominator]
+        if not self.unseen(table, seat)[claim]:
+            return 0.0
+        return self.honesty(nominator)
+
+
+def cost ( table, seat, suit ):
+    '''
+    How bad taking a card of `suit` would be for `seat`.
+    '''
+    taken = table.tricks[seat][suit] + 1
+    if taken >= LOSE_COUNT:
+        return FATAL
+    if table.house_rules and all([ count or (ss == suit) for ss, count in enumerate(table.tricks[seat]) ]):
+        return -FATAL
+    if not sum(table.hands[seat]):
+        return FATAL
+    return taken * taken
+
+
+class Policy:
+    '''
+    Decides what a seat does on its turn: `choose` returns a move name and
+    its arguments for `Table.play`.
+    '''
+    name = None
+
+    def __init__ ( self, players, rng ):
+        self.rng = rng
+
+    def observe ( self, nominator, claim, card, caller, verdict ):
+        pass
+
+    def choose ( self, table, seat ):
+        raise NotImplementedError
+
+
+class RandomPolicy(Policy):
+    name = 'random'
+
+    def choose ( self, table, seat ):
+        moves = table.moves(seat)
+        targets = [ tt for tt in table.available() if tt != seat ]
+        if 'play' in moves:
+            suit = self.rng.choice([ ss for ss, count in enumerate(table.hands[seat]) if count ])
+            return 'play', { 'suit' : suit, 'target' : self.rng.choice(targets), 'claim' : self.rng.randrange(SUITS) }
+        if ('refer' in moves) and (table.seen[seat] or (self.rng.random() < 0.5)):
+            return 'refer', { 'target' : self.rng.choice(targets), 'claim' : table.claim[table.nominator[seat]] }
+        return 'call', { 'verdict' : self.rng.random() < 0.5 }
+
+
+class ModelPolicy(Policy):
+    '''
+    Plays against an `OpponentModel`; see the module docstring.
+    '''
+    name = 'model'
+
+    # call rather than pass when at most this likely to be wrong
+    CONFIDENCE = 0.3
+
+    def __init__ ( self, players, rng, bluff=20 ):
+        super().__init__(players, rng)
+        self.model = OpponentModel(players)
+        self.bluff = bluff / 100
+
+    def observe ( self, *args ):
+        self.model.observe(*args)
+
+    def claim_for ( self, target, suit ):
+        '''
+        Claim the truth if the target tends to call claims false, else lie.
+        '''
+        truthful = self.model.credulity(target) < 0.5
+        if self.rng.random() < self.bluff:
+            truthful = self.rng.random() < 0.5
+        if truthful:
+            return suit
+        return self.rng.choice([ ss for ss in range(SUITS) if ss != suit ])
+
+    def pass_to ( self, table, seat, suits ):
+        '''
+        The target and card (of those in `suits`) that would hurt the most.
+        '''
+        targets = [ tt for tt in table.available() if tt != seat ]
+        scored = [ (cost(table, tt, ss) + self.rng.random(), tt, ss) for tt in targets for ss in suits ]
+        _, target, suit = max(scored)
+        return target, suit
+
+    def choose ( self, table, seat ):
+        moves = table.moves(seat)
+        if 'play' in moves:
+            target, suit = self.pass_to(table, seat, [ ss for ss, count in enumerate(table.hands[seat]) if count ])
+            return 'play', { 'suit' : suit, 'target' : target, 'claim' : self.claim_for(target, suit) }
+
+        if table.seen[seat]:
+            target, _ = self.pass_to(table, seat, [table.card])
+            return 'refer', { 'target' : target, 'claim' : self.claim_for(target, table.card) }
+
+        likely = self.model.claim_true(table, seat)
+        verdict = likely >= 0.5
+        if ('peek' in moves) and (min(likely, 1 - likely) > self.CONFIDENCE):
+            return 'peek', {}
+        return 'call', { 'verdict' : verdict }
+
+
+POLICIES = { pp.name : pp for pp in (RandomPolicy, ModelPolicy) }
+
+
+def make_policy ( spec, players, rng ):
+    '''
+    A policy for a seat from a spec such as 'random' or 'model:10'.
+    '''
+    name, _, args = spec.partition(':')
+    if name not in POLICIES:
+        raise ValueError('unknown policy %r (choose from %s)' % (name, ', '.join(sorted(POLICIES))))
+    return POLICIES[name](players, rng, *[ int(aa) for aa in args.split(',') if aa ])
+
+
+def decide ( table, seat, spec='model', seed=None ):
+    '''
+    What a fresh policy would do for a seat: a move name and its arguments.
+    '''
+    return make_policy(spec, len(table.hands), random.Random(seed)).choose(table, seat)
+
+
+def play_game ( table, policies ):
+    '''
+    Play a game out, one policy per seat, telling every policy about each
+    card turned over. Returns the finished table.
+    '''
+    while table.stage != GAME_OVER:
+        seat = table.next_player
+        move, kwargs = policies[seat].choose(table, seat)
+        if move == 'call':
+            nominator = table.nominator[seat]
+            claim, card = table.claim[nominator], table.card
+            table.play(seat, move, **kwargs)
+            for policy in policies:
+                policy.observe(nominator, claim, card, seat, kwargs['verdict'])
+        else:
+            table.play(seat, move, **kwargs)
+    return table
+
+
+def run_batch ( specs, games, house_rules, seed ):
+    '''
+    Play a batch of games in this process, with the policies in `specs`
+    shuffled into new seats every game. Returns how many games each
+    spec's place in the list lost and won.
+    '''
+    rng = random.Random(seed)
+    players = len(specs)
+    lost = [0] * players
+    won = [0] * players
+    seating = list(range(players))
+
+    for ii in range(games):
+        rng.shuffle(seating)
+        policies = [ make_policy(specs[pp], players, rng) for pp in seating ]
+        table = play_game(Table(players, house_rules=house_rules, rng=rng), policies)
+        for seat, pp in enumerate(seating):
+            lost[pp] += table.status[seat] == LOST
+            won[pp] += table.status[seat] == WON
+
+    return lost, won
+
+
+def simulate ( specs, games, house_rules=False, seed=None, workers=None, batch=500 ):
+    '''
+    Play `games` games between the policies in `specs` (one per seat),
+    split into batches across a pool of `workers` processes (all CPUs by
+    default; 1 plays them here). Returns a list of (spec, loss rate, win
+    rate) in the order of `specs`.
+    '''
+    if not (MIN_PLAYERS <= len(specs) <= MAX_PLAYERS):
+        raise ValueError('need %i to %i policies, one per seat' % (MIN_PLAYERS, MAX_PLAYERS))
+
+    seeder = random.Random(seed)
+    sizes = [ min(batch, games - start) for start in range(0, games, batch) ]
+    jobs = [ (specs, size, house_rules, seeder.getrandbits(64)) for size in sizes ]
+
+    workers = workers or os.cpu_count() or 1
+    if (workers == 1) or (len(jobs) == 1):
+        results = [ run_batch(*job) for job in jobs ]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_batch, *zip(*jobs)))
+
+    lost = [ sum(ll) for ll in zip(*[ rr[0] for rr in results ]) ]
+    won = [ sum(ww) for ww in zip(*[ rr[1] for rr in results ]) ]
+    return [ (spec, ll / games, ww / games) for spec, ll, ww in zip(specs, lost, won) ]
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='Simulate games of Cockroach Poker between bots.')
+    parser.add_argument('--games', type=int, default=2000, help='games to play at each table size')
+    parser.add_argument('--players', type=int, nargs='+', default=[4], help='table sizes to play at, from %i to %i' % (MIN_PLAYERS, MAX_PLAYERS))
+    parser.add_argument('--policy', action='append', help='policy for a seat, e.g. random, model, model:0 (repeatable, cycled to fill the seats)')
+    parser.add_argument('--house-rules', action='store_true', help='a player with every suit in their tricks wins')
+    parser.add_argument('--workers', type=int, default=0, help='processes to use (default all CPUs)')
+    parser.add_argument('--seed', type=int, default=None, help='seed for deals, seating and bots')
+    args = parser.parse_args()
+
+    policies = args.policy or ['model', 'random']
+    for players in args.players:
+        if not (MIN_PLAYERS <= players <= MAX_PLAYERS):
+            parser.error('tables must have %i to %i players' % (MIN_PLAYERS, MAX_PLAYERS))
+        specs = [ policies[ii % len(policies)] for ii in range(players) ]
+
+        started = time.monotonic()
+        results = simulate(specs, args.games, house_rules=args.house_rules, seed=args.seed, workers=args.workers or None)
+        elapsed = time.monotonic() - started
+
+        print('%i games of %i players in %.1fs%s' % (args.games, players, elapsed, ', house rules' if args.house_rules else ''))
+        for spec, loss_rate, win_rate in results:
+            print('  %-10s lost %5.1f%%  won %5.1f%%' % (spec, 100 * loss_rate, 100 * win_rate))
+
+
+if __name__ == '__main__':
+    main()
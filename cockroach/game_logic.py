@@ -1,153 +1,51 @@
 # -*- coding: utf-8 -*-
 from .models import Game, Player
-import random, math, uuid, collections
-
-MIN_PLAYERS = 3
-MAX_PLAYERS = 8
-SUITS = 8
-CARDS_PER_SUIT = 8
-DECK_SIZE = SUITS * CARDS_PER_SUIT
-SUIT_NAMES = [ 'cockroach', 'stinkbug', 'spider', 'scorpion',
-               'bat', 'rat', 'fly', 'toad' ]
-SUIT_PLURALS = [ 'cockroaches', 'stinkbugs', 'spiders', 'scorpions',
-                 'bats', 'rats', 'flies', 'toads' ]
-LOSE_COUNT = 4
+from games.core import Rules, Engine
+from games.loader import find_player, player_at, in_turn_order
+from games.store import store, save_all
+from games import aio
+from .rules import (MIN_PLAYERS, MAX_PLAYERS, SUITS, SUIT_NAMES, SUIT_PLURALS,
+                    LOSE_COUNT, deal)
 
 EMOJIS = { 'NEXT' : '▶️', 'WINNER' : '🏆', 'LOSER' : '🤮',
            'AVAIL' : '', 'UNAVAIL' : '♻️', 'STARTER' : '🔰' }
 
-def deal ( num_players ):
-    '''
-    Create the initial hands of cards.
-    '''
-    deck = list(range(SUITS)) * CARDS_PER_SUIT
-    random.shuffle(deck)
-    
-    hand_sizes = [math.floor(DECK_SIZE / num_players)] * num_players
-    
-    # first player gets an extra card if there is one
-    if DECK_SIZE % num_players:
-        hand_sizes[0] += 1
-    
-    hands = []
-    for hh in hand_sizes:
-        hand, deck = deck[:hh], deck[hh:]
-        hands.append(sorted(hand))
-        
-    return hands
-    
-def encode_cards ( cards ):
-    '''
-    Convert cards (list of int) to a comma-delimited string for storage.
-    '''
-    return ','.join([str(x) for x in cards])
+class CockroachRules(Rules):
+    Game = Game
+    min_players = MIN_PLAYERS
+    max_players = MAX_PLAYERS
+    over = Game.Stage.GAME_OVER
 
-def decode_cards ( card_str ):
-    '''
-    Convert an encoded card string into a list of ints.
-    '''
-    if not card_str:
-        return []
-    
-    try:
-        return [ int(x) for x in card_str.split(',') ]
-    except Exception:
-        return []
+    def deal ( self, game, players, seats ):
+        hands = deal(len(players))
+        for pp, seat in zip(players, seats):
+            pp.reset(turn_order=seat, hand=hands[seat], save=False)
+            pp.round_start(save=False)
+        game.round_start(save=False)
 
+    def started ( self, game, players ):
+        return 'Started game %s, %s to start' % (game.tag, player_at(game, 0).nickname)
 
-def join ( tag, nickname, house_rules=False ):
-    '''
-    Attempt to add a player to a game. If the game is in progress, this fails.
-    If the game already has a player with the same nickname, reconnects that player.
-    If the game doesn't exist, it is created and the player becomes its owner.
-    '''
-    try:
-        game = Game.objects.get(pk=tag)
+    def created ( self, game, owner ):
+        return 'Game %s created, owned by %s. Waiting for at least %i more players.' % (game.tag, owner.nickname, MIN_PLAYERS - 1)
 
-        try:
-            existing = game.player_set.get(nickname=nickname)
-            return str(existing.token), 'Rejoining game %s as existing player %s' % (tag, nickname), False
-        except Player.DoesNotExist:
-            pass
-
-        if game.stage != Game.Stage.GATHERING:
-            return None, 'Game %s already in progress' % tag, False
-        
-        player_count = len(game.player_set.all())
-        
-        if player_count >= MAX_PLAYERS:
-            return None, 'Game %s already has the maximum number of players (%i)' % (tag, MAX_PLAYERS), False
-            
-        game.player_set.create(nickname=nickname)
-        token = str(game.player_set.get(nickname=nickname).token)
-        player_count += 1
-        
-        if player_count < MIN_PLAYERS:
-            needed = MIN_PLAYERS - player_count
+    def joined ( self, game, player, count ):
+        if count < MIN_PLAYERS:
+            needed = MIN_PLAYERS - count
             sub_msg = "Waiting for at least %i more player%s" % (needed, 's' if (needed > 1) else '')
         else:
             sub_msg = "Game is ready to begin"
-        return token, 'Player %s joined game %s. %s.' % (nickname, tag, sub_msg), True
-        
-    except Game.DoesNotExist:
-        game = Game.create(tag, nickname, house_rules=house_rules)
-        token = str(game.player_set.get(nickname=nickname).token)
-        return token, 'Game %s created, owned by %s. Waiting for at least %i more players.' % (tag, nickname, MIN_PLAYERS - 1), True
+        return 'Player %s joined game %s. %s.' % (player.nickname, game.tag, sub_msg)
 
 
-def get_game_and_player ( tag, token ):
-    '''
-    Map game and player PKs to their model objects, if possible.
-    '''
-    try:
-        game = Game.objects.get(pk=tag)
-        
-        try:
-            valid = uuid.UUID(token)
-        except Exception:
-            return game, None, 'Invalid player token %s' % token
-        
-        player = Player.objects.get(pk=token)
-        
-        if player.game != game:
-            return game, player, 'Player %s is not in game %s' % (player.nickname, tag)
-        
-        return game, player, None
-        
-    except Game.DoesNotExist:
-        return None, None, 'Game %s does not exist' % tag
-    except Player.DoesNotExist:
-        return game, None, 'Player %s does not exist' % token
+# joining, starting and destroying are the same for every game (see games.core)
+engine = Engine(CockroachRules())
+move, view = engine.move, engine.view
+join, start, destroy, purge = engine.join, engine.start, engine.destroy, engine.purge
+get_game_and_player = engine.get_game_and_player
 
 
-def start ( tag, token ):
-    '''
-    Attempt to launch a game.
-    '''
-    game, player, err = get_game_and_player( tag, token )
-    if err is not None:
-        return err, False
-    
-    if game.stage not in (Game.Stage.GATHERING, Game.Stage.GAME_OVER):
-        return 'Game %s is already in progress' % tag, False
-    
-    players = game.player_set.all()
-    count = len(players)
-    if count < MIN_PLAYERS:
-        return 'Not enough players to start game %s (%i)' % (tag, count), False
-            
-    seq = random.sample(range(count), count)
-    hands = deal(len(players))
-    for ii in range(count):
-        players[ii].reset(turn_order=seq[ii], hand=encode_cards(hands[seq[ii]]))
-        players[ii].round_start()
-        
-    game.round_start()
-    
-    first = game.player_set.get(turn_order=0)
-    return 'Started game %s, %s to start' % (tag, first.nickname), True
-    
-
+@move
 def play ( tag, token, card_idx, target, claim ):
     '''
     Choose a card from your hand and pass it to another player
@@ -163,7 +61,7 @@ def play ( tag, token, card_idx, target, claim ):
     if game.next_player != player.turn_order:
         return "It is not %s's turn to play" % player.nickname, False
     
-    hand = decode_cards(player.hand)
+    hand = player.hand
     if (card_idx < 0) or (card_idx >= len(hand)):
         return "Chosen card is out of range of player %s's hand (%i)" % (player.nickname, card_idx), False
     
@@ -171,7 +69,7 @@ def play ( tag, token, card_idx, target, claim ):
         return "Player cannot play a card to themself", False
     
     try:
-        victim = game.player_set.get(turn_order=target)
+        victim = player_at(game, target)
     except Exception:
         return "Target player not found (%i)" % target, False
     
@@ -187,7 +85,6 @@ def play ( tag, token, card_idx, target, claim ):
     
     player.target = target
     player.claim = claim
-    player.hand = encode_cards(hand)
     player.seen = True
     player.status = Player.Status.WATCHING
     player.save()
@@ -201,6 +98,7 @@ def play ( tag, token, card_idx, target, claim ):
                                                                                   SUIT_NAMES[claim],
                                                                                   victim.nickname), True
 
+@move
 def peek ( tag, token ):
     '''
     Look at the passed card, limiting subsequent action to refer.
@@ -215,7 +113,7 @@ def peek ( tag, token ):
     if game.next_player != player.turn_order:
         return "It is not %s's turn" % player.nickname, False
     
-    if len(game.player_set.all().filter(nominator=-1)) == 0:
+    if len([ pp for pp in game.player_set.all() if pp.nominator == -1 ]) == 0:
         return 'Cannot look at the card when there is no-one left to pass to', False
     
     player.seen = True
@@ -224,6 +122,7 @@ def peek ( tag, token ):
     return '%s looks at the passed card' % player.nickname, True
 
 
+@move
 def refer ( tag, token, target, claim ):
     '''
     Nominate another player to receive the card in play, with an updated (or not) claim.
@@ -242,7 +141,7 @@ def refer ( tag, token, target, claim ):
         return "Player cannot play a card to themself", False
     
     try:
-        victim = game.player_set.get(turn_order=target)
+        victim = player_at(game, target)
     except Exception:
         return "Target player not found (%i)" % target, False
     
@@ -261,7 +160,7 @@ def refer ( tag, token, target, claim ):
     victim.status = Player.Status.PLAYING
     victim.save()
     
-    avail = game.player_set.all().filter(nominator=-1)
+    avail = [ pp for pp in game.player_set.all() if pp.nominator == -1 ]
     acts = 'pass or call' if len(avail) else 'call'
     seen = '' if player.seen else ' (unseen)'
     
@@ -273,6 +172,7 @@ def refer ( tag, token, target, claim ):
                                                                              acts), True
 
     
+@move
 def call ( tag, token, verdict ):
     '''
     Declare whether the nominator's claim is correct.
@@ -290,7 +190,7 @@ def call ( tag, token, verdict ):
     if player.seen:
         return 'Calling is not an option once the card has been seen, %s must pass.' % player.nickname, False
     
-    nominator = game.player_set.get(turn_order=player.nominator)
+    nominator = player_at(game, player.nominator)
     
     if verdict == (nominator.claim == game.card):
         msg = '%s calls correctly, the card is a %s' % (player.nickname, SUIT_NAMES[game.card])
@@ -299,16 +199,14 @@ def call ( tag, token, verdict ):
         msg = '%s calls incorrectly, the card is a %s' % (player.nickname, SUIT_NAMES[game.card])
         loser = player
     
-    tricks = decode_cards(loser.tricks)
-    tricks.append(game.card)
-    loser.tricks = encode_cards(sorted(tricks))
-    loser.save()
+    tricks = loser.tricks
+    tricks.add(game.card)
     
     over = False
     loser_status = Player.Status.PLAYING
     other_status = Player.Status.WATCHING
     
-    if collections.Counter(tricks)[game.card] == LOSE_COUNT:
+    if tricks.count(game.card) == LOSE_COUNT:
         # player loses, everyone else wins
         over = True
         loser_status = Player.Status.LOST
@@ -328,8 +226,7 @@ def call ( tag, token, verdict ):
             msg = '%s. %s takes the card and wins the game by having all the suits.' % (msg, loser.nickname)
     
     if not over:
-        hand = decode_cards(loser.hand)
-        if len(hand) == 0:
+        if len(loser.hand) == 0:
             msg = '%s. %s takes the card and has no cards left, so loses the game.' % (msg, loser.nickname)
             over = True
             loser_status = Player.Status.LOST
@@ -340,40 +237,40 @@ def call ( tag, token, verdict ):
     if over:
         for pp in players:
             pp.status = loser_status if (pp.turn_order == loser.turn_order) else other_status
-            pp.save()
-        game.end_game()
+        game.end_game(save=False)
 
     else:
         for pp in players:
-            pp.round_start(next_player=loser.turn_order)
+            pp.round_start(next_player=loser.turn_order, save=False)
         msg = '%s. %s takes the card and starts the next round.' % ( msg, loser.nickname )
-        game.round_start(next_player=loser.turn_order)
+        game.round_start(next_player=loser.turn_order, save=False)
+    
+    # the loser's trick and everyone's reset go together
+    save_all([ game ] + list(players))
+    store.checkpoint(game)
     
     return msg, True
 
 
-def destroy ( tag, token ):
-    '''
-    Delete a game and all its players.
-    '''
-    game, player, err = get_game_and_player( tag, token )
-    if err is not None:
-        return False, err
-        
-    game.delete()
-    return True, 'game %s deleted' % tag
-
-
-def visible_state ( tag, token, emojify=True ):
+@view
+def visible_state ( tag, token, emojify=True, game=None ):
     '''
     Return a dict defining the game state as visible to the specified
     player. (Unrecognised players see only public state.)
+    An already loaded `game` may be passed in to build several players'
+    views from the same snapshot.
     '''
-    game, player, err = get_game_and_player( tag, token )
+    if game is None:
+        game, player, err = get_game_and_player( tag, token )
+    else:
+        player, err = find_player( game, token )
+    
     if game is None:
         return { 'tag' : tag, 'token' : token, 'err' : err }
     
     result = { 'tag' : tag, 'token' : token, 'card' : '-1', 'suits' : SUIT_NAMES }
+    players = in_turn_order(game)
+    avail = [ pp for pp in players if pp.nominator == -1 ]
     
     # stage seems to come out as an int, failing comparisons
     stage = Game.Stage(game.stage)
@@ -381,11 +278,9 @@ def visible_state ( tag, token, emojify=True ):
     if player:
         result['nickname'] = player.nickname
         if (stage==Game.Stage.STARTING) and (player.turn_order == game.next_player):
-            avail = game.player_set.all().filter(nominator=-1)
             result['referrable'] = [pp.turn_order for pp in avail]
             result['actions'] = ['play']
         elif (stage==Game.Stage.PLAYING) and (player.turn_order == game.next_player):
-            avail = game.player_set.all().filter(nominator=-1)
             result['referrable'] = [pp.turn_order for pp in avail]
             
             if player.seen:
@@ -397,7 +292,7 @@ def visible_state ( tag, token, emojify=True ):
         
         elif (stage == Game.Stage.GAME_OVER):
             result['actions'] = ['start', 'destroy']            
-        elif (stage == Game.Stage.GATHERING) and (len(game.player_set.all()) >= MIN_PLAYERS):
+        elif (stage == Game.Stage.GATHERING) and (len(players) >= MIN_PLAYERS):
             result['actions'] = ['start']            
         else:
             result['actions'] = []
@@ -410,6 +305,7 @@ def visible_state ( tag, token, emojify=True ):
     result['stage'] = stage.label
     result['next_player'] = game.next_player
     result['status'] = game.status
+    result['version'] = game.version
 
     # these will be overwritten later for real players
     result['your_hand'] = []
@@ -418,11 +314,11 @@ def visible_state ( tag, token, emojify=True ):
     
     result['players'] = []
         
-    for pp in game.player_set.all().order_by('turn_order'):
+    for pp in players:
         desc = { 'nickname' : pp.nickname, 
                  'you' : (token == str(pp.token)),
-                 'hand_size' : len(decode_cards(pp.hand)),
-                 'tricks' : decode_cards(pp.tricks),
+                 'hand_size' : len(pp.hand),
+                 'tricks' : list(pp.tricks),
                  'is_next' : (game.next_player != -1) and (pp.turn_order == game.next_player),
                  'owner' : pp.owner,
                  'turn_order' : pp.turn_order,
@@ -446,8 +342,8 @@ def visible_state ( tag, token, emojify=True ):
         if token == str(pp.token):
             result['your_turn_order'] = pp.turn_order
             result['your_nickname'] = pp.nickname
-            result['your_hand'] = decode_cards(pp.hand)
-            result['your_tricks'] = decode_cards(pp.tricks)
+            result['your_hand'] = list(pp.hand)
+            result['your_tricks'] = list(pp.tricks)
             
             if desc['is_next']:
                 result['card'] = SUIT_NAMES[game.card] if pp.seen else 'back'
@@ -457,11 +353,13 @@ def visible_state ( tag, token, emojify=True ):
     return result
     
 
-def purge ():
-    '''
-    Destroy all games. For testing only, not to be exposed to outside world!
-    '''
-    Game.objects.all().delete()
-
+# async versions of the entry points for the async views (see games.aio):
+# joining and destroying always touch the database, the rest can run
+# straight on the event loop when the game is resident in memory
+async_join, async_start, async_destroy = engine.async_join, engine.async_start, engine.async_destroy
+async_play = aio.move(Game, play)
+async_peek = aio.move(Game, peek)
+async_refer = aio.move(Game, refer)
+async_call = aio.move(Game, call)
+async_visible_state = aio.entry(Game, visible_state)
 
-    
@@ -0,0 +1,65 @@
+from django.db import migrations
+import games.cards
+from games.cards import SuitCounts
+
+
+def split_cards ( card_str ):
+    return [ int(x) for x in card_str.split(',') ] if card_str else []
+
+def pack_cards ( apps, schema_editor ):
+    '''
+    Convert comma-delimited suit lists to per-suit counts.
+    '''
+    Player = apps.get_model('cockroach', 'Player')
+    
+    for player in Player.objects.all():
+        player.hand_packed = SuitCounts(split_cards(player.hand))
+        player.tricks_packed = SuitCounts(split_cards(player.tricks))
+        player.save(update_fields=['hand_packed', 'tricks_packed'])
+
+def unpack_cards ( apps, schema_editor ):
+    Player = apps.get_model('cockroach', 'Player')
+    
+    for player in Player.objects.all():
+        player.hand = ','.join([ str(x) for x in player.hand_packed ])
+        player.tricks = ','.join([ str(x) for x in player.tricks_packed ])
+        player.save(update_fields=['hand', 'tricks'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cockroach', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='hand_packed',
+            field=games.cards.SuitCountsField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='tricks_packed',
+            field=games.cards.SuitCountsField(default=0),
+        ),
+        migrations.RunPython(pack_cards, unpack_cards),
+        migrations.RemoveField(
+            model_name='player',
+            name='hand',
+        ),
+        migrations.RemoveField(
+            model_name='player',
+            name='tricks',
+        ),
+        migrations.RenameField(
+            model_name='player',
+            old_name='hand_packed',
+            new_name='hand',
+        ),
+        migrations.RenameField(
+            model_name='player',
+            old_name='tricks_packed',
+            new_name='tricks',
+        ),
+    ]
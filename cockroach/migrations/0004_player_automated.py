@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cockroach', '0003_game_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='automated',
+            field=models.BooleanField(default=False),
+        ),
+    ]
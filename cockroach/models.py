@@ -1,7 +1,10 @@
 import uuid
 from django.db import models
+from games.store import WriteBehindMixin
+from games.journal import JournalEntry
+from games.cards import SuitCounts, SuitCountsField
 
-class Game(models.Model):
+class Game(WriteBehindMixin, models.Model):
     # games are identified by a user-specified tag, as with Codenames
     tag = models.CharField(max_length=32, primary_key=True)
     
@@ -11,6 +14,9 @@ class Game(models.Model):
     
     # the most recent game state notification message
     status = models.CharField(max_length=200, default='')
+    
+    # bumped whenever the game's visible state changes, to key cached views of it
+    version = models.PositiveIntegerField(default=0)
         
     # game phase
     class Stage(models.IntegerChoices):
@@ -36,29 +42,31 @@ class Game(models.Model):
     house_rules = models.BooleanField(default=False)
     
     @classmethod
-    def create(cls, tag, owner_nickname, house_rules):
+    def create(cls, tag, owner_nickname, house_rules=False):
         game = cls(tag=tag, house_rules=house_rules)
         game.save()
-        game.player_set.create(game=game, nickname=owner_nickname, owner=True)
-        return game
+        owner = game.player_set.create(game=game, nickname=owner_nickname, owner=True)
+        return game, owner
     
-    def round_start (self, next_player=0):
+    def round_start (self, next_player=0, save=True):
         self.stage = Game.Stage.STARTING
         self.next_player = next_player
         self.card = -1
-        self.save()
+        if save:
+            self.save()
     
-    def end_game (self):
+    def end_game (self, save=True):
         self.stage = Game.Stage.GAME_OVER
         self.next_player = -1
         self.card = -1
-        self.save()
+        if save:
+            self.save()
         
     def __str__(self):
         return self.tag
     
 
-class Player(models.Model):
+class Player(WriteBehindMixin, models.Model):
     # each player has a unique token which is passed when moving
     # in order to validate their move
     token = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -69,14 +77,13 @@ class Player(models.Model):
     # players supply their own nickname when joining a game
     nickname = models.CharField(max_length=32)
     
-    # using strings for this kinda sucks, but it's easier than trying
-    # to do proper data structures in DB tables, and the structs are very simple
+    # cards are packed as per-suit counts
     
     # hidden cards from which player may choose
-    hand = models.CharField(max_length = 100, default='')
+    hand = SuitCountsField(default=0)
     
     # face up cards player has had to take
-    tricks = models.CharField(max_length = 100, default='')
+    tricks = SuitCountsField(default=0)
     
     # allocated on game start
     # -- in this game there isn't a fixed turn order, but we'll keep a
@@ -86,6 +93,9 @@ class Player(models.Model):
     # first player to join a game gets to start it
     owner = models.BooleanField(default=False)
     
+    # moves for this seat are made by the turn scheduler (see games.scheduler)
+    automated = models.BooleanField(default=False)
+    
     # has this player seen the current card?
     seen = models.BooleanField(default=False)
     
@@ -121,13 +131,14 @@ class Player(models.Model):
     def __str__(self):
         return self.nickname
     
-    def reset (self, turn_order=-1, hand=''):
+    def reset (self, turn_order=-1, hand=(), save=True):
         self.turn_order = turn_order
-        self.hand = hand
-        self.tricks = ''
-        self.save()
+        self.hand = SuitCounts(hand)
+        self.tricks = SuitCounts()
+        if save:
+            self.save()
     
-    def round_start (self, next_player=0):
+    def round_start (self, next_player=0, save=True):
         self.claim = -1
         self.seen = False
         self.target = -1
@@ -138,10 +149,10 @@ class Player(models.Model):
             self.nominator = -1
             self.status = Player.Status.WATCHING
             
-        self.save()
-    
-    
-        
-    
-    
-    
\ No newline at end of file
+        if save:
+            self.save()
+
+
+class Move(JournalEntry):
+    # the game's append-only move journal (see games.journal)
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
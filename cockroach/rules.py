@@ -0,0 +1,36 @@
+'''
+Cockroach Poker rules that don't need the database, shared by the game
+logic and the headless engine (see `cockroach.engine`).
+'''
+import random, math
+
+MIN_PLAYERS = 3
+MAX_PLAYERS = 8
+SUITS = 8
+CARDS_PER_SUIT = 8
+DECK_SIZE = SUITS * CARDS_PER_SUIT
+SUIT_NAMES = [ 'cockroach', 'stinkbug', 'spider', 'scorpion',
+               'bat', 'rat', 'fly', 'toad' ]
+SUIT_PLURALS = [ 'cockroaches', 'stinkbugs', 'spiders', 'scorpions',
+                 'bats', 'rats', 'flies', 'toads' ]
+LOSE_COUNT = 4
+
+def deal ( num_players, rng=random ):
+    '''
+    Create the initial hands of cards.
+    '''
+    deck = list(range(SUITS)) * CARDS_PER_SUIT
+    rng.shuffle(deck)
+    
+    hand_sizes = [math.floor(DECK_SIZE / num_players)] * num_players
+    
+    # first player gets an extra card if there is one
+    if DECK_SIZE % num_players:
+        hand_sizes[0] += 1
+    
+    hands = []
+    for hh in hand_sizes:
+        hand, deck = deck[:hh], deck[hh:]
+        hands.append(sorted(hand))
+        
+    return hands
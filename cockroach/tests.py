@@ -1,3 +1,106 @@
-from django.test import TestCase
+import random
+from unittest import mock
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from games.loader import in_turn_order
+from . import game_logic as GM
+from . import engine
+from .bots import TableBot, CockroachAutoplay
+
+
+class PackedCardsTests(TestCase):
+    '''
+    Hands and tricks survive a round trip through the database, and
+    indexes still pick cards out of the sorted hand.
+    '''
+    def test_round_trip ( self ):
+        tokens = [ GM.join('c', 'p%i' % ii)[0] for ii in range(3) ]
+        game, player, _ = GM.get_game_and_player('c', tokens[0])
+        
+        player.hand = [ 5, 0, 7, 0 ]
+        player.tricks.add(2)
+        player.save()
+        
+        _, player, _ = GM.get_game_and_player('c', tokens[0])
+        self.assertEqual(list(player.hand), [ 0, 0, 5, 7 ])
+        self.assertEqual(list(player.tricks), [ 2 ])
+        self.assertEqual(player.hand.pop(2), 5)
+        self.assertEqual(list(player.hand), [ 0, 0, 7 ])
+
+
+class EngineTests(TestCase):
+    '''
+    The headless engine follows the game logic move for move, and bots
+    can play a whole game at a live table.
+    '''
+    def test_follows_game_logic ( self ):
+        tokens = [ GM.join('e', 'p%i' % ii)[0] for ii in range(5) ]
+        GM.start('e', tokens[0])
+        rng = random.Random(3)
+        policy = engine.make_policy('random', 5, rng)
+        
+        for ii in range(1000):
+            game, _, _ = GM.get_game_and_player('e', None)
+            players = in_turn_order(game)
+            table = engine.Table.from_game(game, players)
+            if table.stage == engine.GAME_OVER:
+                break
+            
+            seat = table.next_player
+            move, kwargs = policy.choose(table, seat)
+            table.play(seat, move, **dict(kwargs))
+            if move == 'play':
+                kwargs['card_idx'] = sum(players[seat].hand.counts[:kwargs.pop('suit')])
+            msg, ok = getattr(GM, move)('e', str(players[seat].token), **kwargs)
+            self.assertTrue(ok, msg)
+            
+            game, _, _ = GM.get_game_and_player('e', None)
+            self.assertEqual(engine.Table.from_game(game, in_turn_order(game)).key(), table.key())
+        
+        self.assertEqual(table.stage, engine.GAME_OVER)
+        self.assertEqual(table.status.count(engine.LOST), 1)
+    
+    def test_simulate ( self ):
+        for players in (engine.MIN_PLAYERS, engine.MAX_PLAYERS):
+            specs = [ 'model', 'random' ] * (players // 2) + [ 'model:0' ] * (players % 2)
+            results = engine.simulate(specs, 20, seed=1, workers=1)
+            self.assertAlmostEqual(sum([ lost for _, lost, _ in results ]), 1.0)
+    
+    @override_settings(GAME_EVENT_COALESCE=0)
+    def test_table_bots ( self ):
+        bots = [ TableBot('b', 'bot%i' % ii, policy=('model' if ii % 2 else 'random'), rng=random.Random(ii)) for ii in range(4) ]
+        with mock.patch('games.events.send_event') as send, self.captureOnCommitCallbacks(execute=True):
+            for bot in bots:
+                self.assertIsNotNone(bot.join()[0])
+            GM.start('b', bots[0].token)
+            
+            for ii in range(1000):
+                acted = [ bot.act() for bot in bots ]
+                self.assertTrue(all([ ok for msg, ok in filter(None, acted) ]))
+                if not any(acted):
+                    break
+        
+        game = GM.Game.objects.get(pk='b')
+        self.assertEqual(game.stage, GM.Game.Stage.GAME_OVER)
+        self.assertGreater(game.version, 4)
+        self.assertTrue(send.called)
+    
+    def test_autoplay ( self ):
+        tokens = [ GM.join('a', 'p%i' % ii)[0] for ii in range(4) ]
+        GM.start('a', tokens[0])
+        autoplay = CockroachAutoplay()
+        
+        for ii in range(1000):
+            game, _, _ = GM.get_game_and_player('a', None)
+            players = in_turn_order(game)
+            waiting = autoplay.waiting(game, players)
+            if not waiting:
+                break
+            
+            # alternate the considered move and the quick one
+            plan = autoplay.plan(game, players, waiting[0])
+            name, kwargs = plan.finish(plan.fn(*plan.args)) if ii % 2 else plan.fallback
+            msg, ok = getattr(GM, name)('a', str(waiting[0].token), **kwargs)
+            self.assertTrue(ok, msg)
+        
+        self.assertEqual(game.stage, GM.Game.Stage.GAME_OVER)
@@ -0,0 +1,163 @@
+'''
+Async entry points into the (synchronous) game logic, for the async views.
+
+Each call first queues on the game's asyncio lock, so moves on one game
+are handled one at a time without tying up a thread while they wait.
+Then:
+
+ * if the game is resident in the in-memory store (with its flusher
+   running, so nothing in the move writes to the database), the move
+   runs directly on the event loop (settings.GAME_INLINE_MOVES), unless
+   another thread holds the game, e.g. to send out its events: the loop
+   never waits for a game's lock
+ * otherwise it runs in one of a pool of settings.GAME_DB_THREADS
+   worker threads, so moves on different games proceed in parallel
+   rather than queueing for Django's single shared thread. Each thread
+   keeps its database connection from one move to the next, for the
+   database's CONN_MAX_AGE, as a request thread would, so moves don't
+   pay for connecting (which on PostgreSQL costs more than most moves)
+ * with GAME_DB_THREADS = 0 it runs in Django's thread for synchronous
+   code instead, as `sync_to_async` would. The tests run that way (see
+   `games.testrunner`), since a test case's transaction is on that
+   thread's connection
+
+Entry points made with `move` also tell the table of a successful move,
+with the notifier the app's views `announce`, holding the game the whole
+time: the move's writes and the notification's status write go in one
+transaction, and so one commit. The notifier is handed the game instance
+the move changed, so it only has to write the status.
+'''
+import asyncio, contextvars, functools
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from .locks import locks, hold, hold_async
+from .journal import moved
+from .store import store
+from . import metrics
+
+# how each app tells its table about a move, by app label
+announcers = {}
+
+executor = None
+
+def pool ():
+    '''
+    The worker threads, started on first use.
+    '''
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=threads(), thread_name_prefix='game-db')
+    return executor
+
+
+def pooled ( fn, *args, **kwargs ):
+    '''
+    Call `fn` in a worker thread, dropping its connection before and after
+    if it is broken or past its age, as Django does around each request.
+    '''
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+def threads ():
+    return getattr(settings, 'GAME_DB_THREADS', 16)
+
+
+def inline_enabled ():
+    return getattr(settings, 'GAME_INLINE_MOVES', True)
+
+
+def resident ( Game, tag ):
+    '''
+    Whether a game can be played without touching the database.
+    '''
+    return store.enabled() and (store.flusher is not None) and (store.get(Game, tag) is not None)
+
+
+def run_inline ( key, fn, *args, **kwargs ):
+    '''
+    Call `fn` here and now, holding the game's lock, if nobody else holds
+    it. Returns whether it did, and what `fn` returned.
+    '''
+    lock = locks.get(key)
+    if not lock.acquire(blocking=False):
+        return False, None
+    try:
+        return True, fn(*args, **kwargs)
+    finally:
+        lock.release()
+
+
+async def call ( Game, tag, fn, *args, inline=True, **kwargs ):
+    '''
+    Call `fn(*args, **kwargs)` holding the game's lock, on the event loop
+    if it can be, else in a worker thread. Pass `inline=False` for calls
+    that always need the database, such as creating or deleting rows.
+    '''
+    key = (Game._meta.app_label, tag)
+    async with hold_async(key):
+        if inline and inline_enabled() and resident(Game, tag):
+            done, result = run_inline(key, fn, *args, **kwargs)
+            if done:
+                return result
+
+        if not threads():
+            return await sync_to_async(metrics.counted(fn))(*args, **kwargs)
+
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            pool(), functools.partial(context.run, pooled, metrics.counted(fn), *args, **kwargs))
+
+
+def entry ( Game, fn, inline=True ):
+    '''
+    Async version of a game logic entry point taking the tag first.
+    '''
+    @functools.wraps(fn)
+    async def wrapper ( tag, *args, **kwargs ):
+        return await call(Game, tag, fn, tag, *args, inline=inline, **kwargs)
+
+    return wrapper
+
+
+def announce ( Game, notify ):
+    '''
+    Have moves made through `move` entry points tell the table with
+    `notify(None, tag, msg)`.
+    '''
+    announcers[Game._meta.app_label] = notify
+
+
+def announced ( Game, fn, notify=None ):
+    '''
+    A game logic move that tells the table if it succeeds, in the same
+    hold on the game as the move itself, with `notify` or else the app's
+    announced notifier.
+    '''
+    app = Game._meta.app_label
+
+    @functools.wraps(fn)
+    def wrapper ( tag, *args, **kwargs ):
+        with hold((app, tag)):
+            result = fn(tag, *args, **kwargs)
+            # moves return (msg, ok), join (token, msg, notify)
+            msg, ok = result[-2:]
+            game = moved(Game, tag)
+            tell = notify or announcers.get(app)
+            if ok and (tell is not None):
+                tell(None, tag, msg, game=game)
+            return result
+
+    return wrapper
+
+
+def move ( Game, fn, inline=True ):
+    '''
+    Async version of a game logic move taking the tag first, which also
+    tells the table if it succeeds (see `announced`).
+    '''
+    return entry(Game, announced(Game, fn), inline=inline)
@@ -0,0 +1,271 @@
+'''
+Compact card containers for the game apps, and model fields to store them.
+
+Each container packs into a single integer column and is only unpacked
+when first looked at, so loading a game costs one int per hand rather than
+a string to split and parse:
+
+ * CardSet: distinct card values as a bitmask (No Thanks! hands and deck)
+ * SuitCounts: a hand of suited cards as a vector of 4-bit per-suit counts
+   (Cockroach Poker hands and tricks)
+ * CardStack: an ordered pile of binary cards behind a sentinel bit
+   (Skull hands and stacks)
+
+The containers are mutable, so e.g. `player.hand.add(card)` followed by
+`player.save()` stores the changed hand.
+'''
+import random
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+
+class CardSet:
+    '''
+    A set of distinct non-negative card values, held as a bitmask with
+    bit n set if card n is present. Iterates in ascending order.
+    '''
+    __slots__ = ('mask',)
+
+    def __init__ ( self, cards=() ):
+        self.mask = 0
+        for card in cards:
+            self.mask |= 1 << card
+
+    @classmethod
+    def unpack ( cls, packed ):
+        cards = cls()
+        cards.mask = packed
+        return cards
+
+    def pack ( self ):
+        return self.mask
+
+    def add ( self, card ):
+        self.mask |= 1 << card
+
+    def discard ( self, card ):
+        self.mask &= ~(1 << card)
+
+    def draw ( self ):
+        '''
+        Remove and return a card chosen uniformly at random.
+        '''
+        card = random.choice(list(self))
+        self.discard(card)
+        return card
+
+    def __contains__ ( self, card ):
+        return bool((self.mask >> card) & 1)
+
+    def __len__ ( self ):
+        return bin(self.mask).count('1')
+
+    def __iter__ ( self ):
+        mask = self.mask
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def __eq__ ( self, other ):
+        return isinstance(other, CardSet) and (self.mask == other.mask)
+
+    def __repr__ ( self ):
+        return 'CardSet(%r)' % list(self)
+
+
+class SuitCounts:
+    '''
+    A multiset of suited cards held as a count per suit, packed four bits
+    to a suit. Iterates over the suits in ascending order with repeats,
+    which is the same as the old sorted hand list, so indexes into that
+    list still pick out the same card.
+    '''
+    __slots__ = ('packed', 'decoded')
+
+    BITS = 4
+    MASK = (1 << BITS) - 1
+
+    def __init__ ( self, cards=() ):
+        self.packed = 0
+        self.decoded = []
+        for card in cards:
+            self.add(card)
+
+    @classmethod
+    def unpack ( cls, packed ):
+        cards = cls()
+        cards.packed = packed
+        cards.decoded = None
+        return cards
+
+    def pack ( self ):
+        if self.decoded is not None:
+            self.packed = 0
+            for suit, count in enumerate(self.decoded):
+                self.packed |= count << (suit * self.BITS)
+        return self.packed
+
+    @property
+    def counts ( self ):
+        '''
+        Per-suit counts, unpacked on first use.
+        '''
+        if self.decoded is None:
+            self.decoded = []
+            packed = self.packed
+            while packed:
+                self.decoded.append(packed & self.MASK)
+                packed >>= self.BITS
+        return self.decoded
+
+    def count ( self, suit ):
+        counts = self.counts
+        return counts[suit] if suit < len(counts) else 0
+
+    def add ( self, suit ):
+        counts = self.counts
+        if suit >= len(counts):
+            counts.extend([0] * (suit + 1 - len(counts)))
+        if counts[suit] == self.MASK:
+            raise ValueError('too many cards of suit %i' % suit)
+        counts[suit] += 1
+
+    def pop ( self, idx ):
+        '''
+        Remove and return the card at an index into the sorted hand.
+        '''
+        if (idx < 0) or (idx >= len(self)):
+            raise IndexError('card index out of range')
+        for suit, count in enumerate(self.counts):
+            if idx < count:
+                self.decoded[suit] -= 1
+                return suit
+            idx -= count
+
+    def __contains__ ( self, suit ):
+        return self.count(suit) > 0
+
+    def __len__ ( self ):
+        return sum(self.counts)
+
+    def __iter__ ( self ):
+        for suit, count in enumerate(self.counts):
+            for ii in range(count):
+                yield suit
+
+    def __eq__ ( self, other ):
+        return isinstance(other, SuitCounts) and (self.pack() == other.pack())
+
+    def __repr__ ( self ):
+        return 'SuitCounts(%r)' % list(self)
+
+
+class CardStack:
+    '''
+    An ordered pile of binary cards (0 or 1), bottom first, packed with card
+    i in bit i below a sentinel bit that marks the length.
+    '''
+    __slots__ = ('packed', 'decoded')
+
+    def __init__ ( self, cards=() ):
+        self.packed = 1
+        self.decoded = [ int(card) for card in cards ]
+
+    @classmethod
+    def unpack ( cls, packed ):
+        cards = cls()
+        cards.packed = packed or 1
+        cards.decoded = None
+        return cards
+
+    def pack ( self ):
+        if self.decoded is not None:
+            self.packed = 1 << len(self.decoded)
+            for ii, card in enumerate(self.decoded):
+                self.packed |= card << ii
+        return self.packed
+
+    @property
+    def cards ( self ):
+        '''
+        The cards as a list, bottom first, unpacked on first use.
+        '''
+        if self.decoded is None:
+            size = self.packed.bit_length() - 1
+            self.decoded = [ (self.packed >> ii) & 1 for ii in range(size) ]
+        return self.decoded
+
+    def push ( self, card ):
+        self.cards.append(card)
+
+    def extend ( self, cards ):
+        self.cards.extend(list(cards))
+
+    def pop ( self, idx=-1 ):
+        return self.cards.pop(idx)
+
+    def __getitem__ ( self, idx ):
+        return self.cards[idx]
+
+    def __len__ ( self ):
+        return len(self.cards)
+
+    def __iter__ ( self ):
+        return iter(list(self.cards))
+
+    def __eq__ ( self, other ):
+        return isinstance(other, CardStack) and (self.pack() == other.pack())
+
+    def __str__ ( self ):
+        return ''.join([ str(card) for card in self.cards ])
+
+    def __repr__ ( self ):
+        return 'CardStack(%r)' % str(self)
+
+
+class PackedCardsDescriptor(DeferredAttribute):
+    '''
+    Field attribute that turns whatever is assigned (a container, a packed
+    int or a list of cards) into the field's container type.
+    '''
+    def __set__ ( self, instance, value ):
+        instance.__dict__[self.field.attname] = self.field.to_python(value)
+
+
+class PackedCardsMixin:
+    '''
+    Stores a card container in an integer column.
+    '''
+    container = None
+    descriptor_class = PackedCardsDescriptor
+
+    def from_db_value ( self, value, expression, connection ):
+        return None if value is None else self.container.unpack(value)
+
+    def to_python ( self, value ):
+        if (value is None) or isinstance(value, self.container):
+            return value
+        if isinstance(value, int):
+            return self.container.unpack(value)
+        return self.container(value)
+
+    def get_prep_value ( self, value ):
+        if isinstance(value, self.container):
+            value = value.pack()
+        return super().get_prep_value(value)
+
+    def value_to_string ( self, obj ):
+        return str(self.get_prep_value(self.value_from_object(obj)))
+
+
+class CardSetField(PackedCardsMixin, models.BigIntegerField):
+    container = CardSet
+
+
+class SuitCountsField(PackedCardsMixin, models.BigIntegerField):
+    container = SuitCounts
+
+
+class CardStackField(PackedCardsMixin, models.PositiveSmallIntegerField):
+    container = CardStack
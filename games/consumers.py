@@ -0,0 +1,179 @@
+'''
+WebSocket transport for game play, alongside the game page and its event
+stream.
+
+Playing from the game page takes an HTTP request per move, a stream
+connection for the events, and (without pushed state) another request per
+refresh. A socket at /ws/<app>/<tag>/ does all of it on one connection:
+
+ * on connecting, the client is sent its view of the game
+ * it sends moves as JSON, `{"move": "pay", ...}` with the fields the game
+   page would post (`take`, `pay`, `place`, `bid`, `flip`, `play`,
+   `refer`, `call`, ... and `join`, `destroy` and `refresh`), and each
+   is answered with a `reply` carrying the move's message and the
+   client's state after it
+ * the game's events come down the same connection as they would down
+   the stream: `state` and `patch` for pushed state, `message` for a game
+   that has gone. A 'refresh' ping is answered here, by sending the
+   client's state, rather than passed on for the client to call back.
+
+Everything sent is `{"type": ..., "data": ...}`, as for the stream's
+events. The player is the one in the session, as for the game page and
+its stream (never one named in the URL, which would put their token in
+access logs); joining over the socket makes the client that player for
+the rest of the connection, and the reply carries the new token. Moves go
+through the same code as the game page's (see `games.pages`), so they are
+journaled, announced and scheduled around exactly the same.
+
+The game pages play over the socket where they can open one, falling
+back to posting moves and following the event stream (see
+home/static/games/game-socket.js).
+
+Each app has a consumer deriving `GameConsumer` (see the apps'
+`consumers` modules), routed in `home.routing`.
+'''
+import asyncio, json
+from urllib.parse import urlsplit
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http.request import validate_host
+from .events import SPECTATOR, Subscription, viewer_channel
+from .scheduler import scheduler
+from .snapshots import cache
+
+
+class GameConsumer(AsyncJsonWebsocketConsumer):
+    '''
+    Play one game over a socket. Subclasses set `pages`, the app's
+    `games.pages.GamePages`, whose moves it makes.
+    '''
+    pages = None
+
+    async def connect ( self ):
+        self.Game, self.logic = self.pages.Game, self.pages.logic
+        self.tag = self.scope['url_route']['kwargs']['tag']
+        self.token = self.player_token()
+        self.version = None
+        self.subscription = None
+        self.forwarding = None
+
+        if not self.same_origin():
+            await self.close()
+            return
+        await self.accept()
+        entry = await self.lookup()
+        self.listen(entry)
+        await self.send_state('state', entry, 'You are viewing this game as non-player.' if self.token == SPECTATOR else '')
+        self.forwarding = asyncio.get_running_loop().create_task(self.forward())
+
+    async def disconnect ( self, code ):
+        if getattr(self, 'forwarding', None) is not None:
+            self.forwarding.cancel()
+        self.listen(None)
+
+    def same_origin ( self ):
+        '''
+        Whether the socket was opened from one of our own pages. Sockets
+        carry the session cookie, so any other site's could play as the
+        session's player.
+        '''
+        origin = dict(self.scope.get('headers', [])).get(b'origin')
+        if origin is None:
+            return False
+        return validate_host(urlsplit(origin.decode('latin1')).hostname or '', settings.ALLOWED_HOSTS)
+
+    def player_token ( self ):
+        session = self.scope.get('session')
+        token = session.get(self.pages.session_key) if session is not None else None
+        return SPECTATOR if token is None else token
+
+    def listen ( self, entry ):
+        '''
+        Listen for the game's events for the viewer of a looked up state:
+        its player, or the spectators if it is nobody's. None to stop.
+        '''
+        if self.subscription is not None:
+            # `forward` moves on to the new one
+            self.subscription.close()
+            self.subscription = None
+        if entry is None:
+            return
+
+        viewer = self.token if 'nickname' in entry[1] else SPECTATOR
+        self.subscription = Subscription([ self.tag, viewer_channel(self.tag, viewer) ])
+
+    async def lookup ( self ):
+        return await cache.lookup_async(self.Game, self.logic.visible_state, self.tag, self.token)
+
+    async def send_state ( self, event_type, entry, msg='', **extra ):
+        version, state, _ = entry
+        if version is not None:
+            self.version = version
+        await self.send_json(dict(extra, type=event_type, data=dict(state, msg=msg)))
+
+    async def receive_json ( self, content ):
+        action = content.get('move', 'refresh') if isinstance(content, dict) else None
+        try:
+            if action == 'refresh':
+                await self.send_state('reply', await self.lookup(), move=action)
+            elif action == 'destroy':
+                await self.destroy()
+            elif action in self.pages.moves:
+                await self.play(action, content)
+            else:
+                await self.send_json({ 'type' : 'reply', 'move' : action, 'data' : { 'msg' : 'unknown move %s' % action } })
+        except KeyError as error:
+            await self.send_json({ 'type' : 'reply', 'move' : action, 'data' : { 'msg' : 'move %s needs %s' % (action, error) } })
+        except (TypeError, ValueError) as error:
+            # socket messages are any JSON, not just what the game page's form posts
+            await self.send_json({ 'type' : 'reply', 'move' : action, 'data' : { 'msg' : 'invalid move %s: %s' % (action, error) } })
+
+    async def play ( self, action, content ):
+        token, msg, notify = await self.pages.act(self.tag, self.token, action, content)
+        if notify:
+            # the move has told the table already
+            scheduler.poke(self.Game, self.tag)
+            msg = ''
+
+        extra = { 'move' : action }
+        if token != self.token:
+            self.token = extra['token'] = token
+
+        entry = await self.lookup()
+        if 'token' in extra:
+            self.listen(entry)
+        await self.send_state('reply', entry, msg or '', **extra)
+
+    async def destroy ( self ):
+        # everyone watching, this client included, is told if the game has gone
+        success, msg = await self.pages.destroy(self.tag, self.token)
+        await self.send_json({ 'type' : 'reply', 'move' : 'destroy', 'data' : { 'msg' : msg } })
+
+    async def forward ( self ):
+        '''
+        Send the game's events on as they are queued for the subscription.
+        '''
+        while True:
+            queued = await self.subscription.next()
+            if queued is None:
+                # closed for a new one
+                continue
+
+            events, refresh = queued
+            for event in events:
+                if (event.type == 'message') and (event.data.get('text') == 'refresh'):
+                    refresh = refresh or (self.version is None) or (event.data.get('version', self.version + 1) > self.version)
+                    continue
+                # states and patches both bring the client up to their version
+                if 'version' in event.data:
+                    self.version = event.data['version']
+                await self.send_json({ 'type' : event.type, 'data' : event.data })
+
+            if refresh:
+                # have the client's state sent, rather than have it call back for it
+                await self.send_state('state', await self.lookup())
+
+    @classmethod
+    async def encode_json ( cls, content ):
+        return json.dumps(content, cls=DjangoJSONEncoder)
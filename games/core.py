@@ -0,0 +1,161 @@
+'''
+The game logic every game app shares.
+
+Joining, starting, destroying and purging games, and finding a game and
+player by tag and token, work the same way whatever the game: only who
+may play, how a game is dealt and what is said about it differ. Each app
+describes its game with a `Rules` subclass, and an `Engine` built from
+that provides the shared entry points, with everything around them done
+once here for every game: holding the game, journaling and timing each
+move (see `games.locks`), loading through the in-memory store and the
+state cache (see `games.loader`), and the async versions for the views
+(see `games.aio`). The apps' game_logic modules add their own moves with
+the engine's `move` and `view` decorators.
+
+Each app's page views are shared likewise (see `games.pages`).
+'''
+import random
+from .loader import load_game, player_named
+from .store import store, save_all
+from .locks import game_move
+from .snapshots import cache
+from . import aio
+
+
+class Rules:
+    '''
+    What a game app plugs into the engine. Subclasses set `Game` (whose
+    `create` makes a game with its owner, taking any `join` options),
+    `min_players`, `max_players` and `over` (the stage of a finished game,
+    which can be started again), and implement `deal`.
+    '''
+    Game = None
+    min_players = 1
+    max_players = 1
+    over = None
+
+    def deal ( self, game, players, seats ):
+        '''
+        Set up a game and its players, seated in the turn order `seats`,
+        for play, without saving them.
+        '''
+        raise NotImplementedError
+
+    def started ( self, game, players ):
+        return 'Started game %s' % game.tag
+
+    def created ( self, game, owner ):
+        return 'Game %s created, owned by %s' % (game.tag, owner.nickname)
+
+    def joined ( self, game, player, count ):
+        '''
+        What to say when `player` joins, making `count` players.
+        '''
+        return 'Player %s joined game %s' % (player.nickname, game.tag)
+
+
+class Engine:
+    '''
+    The shared entry points of one game app's logic, played by `rules`.
+    '''
+    def __init__ ( self, rules ):
+        self.rules = rules
+        self.Game = Game = rules.Game
+
+        # moves on one game are applied one at a time
+        self.move = game_move(Game)
+        self.view = game_move(Game, rows=False)
+
+        self.join = self.move(self.join)
+        self.start = self.move(self.start)
+        self.destroy = self.move(self.destroy)
+
+        # joining and destroying always touch the database
+        self.async_join = aio.move(Game, self.join, inline=False)
+        self.async_start = aio.move(Game, self.start)
+        self.async_destroy = aio.entry(Game, self.destroy, inline=False)
+
+    def get_game_and_player ( self, tag, token ):
+        '''
+        Map game and player PKs to their model objects, if possible.
+        The game comes back with all its players prefetched.
+        '''
+        return load_game(self.Game, tag, token)
+
+    def join ( self, tag, nickname, automated=False, **options ):
+        '''
+        Attempt to add a player to a game. If the game is in progress, this fails.
+        If the game already has a player with the same nickname, reconnects that player.
+        If the game doesn't exist, it is created with `options` and the player becomes its owner.
+        An `automated` player has their moves made by the turn scheduler, and
+        can only join an existing game.
+        '''
+        rules = self.rules
+
+        # go through the loader so an in-memory game is seen as it stands
+        game, _, _ = self.get_game_and_player( tag, None )
+
+        if (game is None) and automated:
+            return None, 'Game %s does not exist' % tag, False
+
+        if game is None:
+            game, owner = self.Game.create(tag, nickname, **options)
+            return str(owner.token), rules.created(game, owner), True
+
+        try:
+            existing = player_named(game, nickname)
+            return str(existing.token), 'Rejoining game %s as existing player %s' % (tag, nickname), False
+        except game.player_set.model.DoesNotExist:
+            pass
+
+        if game.stage != self.Game.Stage.GATHERING:
+            return None, 'Game %s already in progress' % tag, False
+
+        # the loaded players, rather than a count query
+        count = len(game.player_set.all())
+        if count >= rules.max_players:
+            return None, 'Game %s already has the maximum number of players (%i)' % (tag, rules.max_players), False
+
+        player = game.player_set.create(nickname=nickname, automated=automated)
+        return str(player.token), rules.joined(game, player, count + 1), True
+
+    def start ( self, tag, token ):
+        '''
+        Attempt to launch a game.
+        '''
+        rules = self.rules
+        game, player, err = self.get_game_and_player( tag, token )
+        if err is not None:
+            return err, False
+
+        if game.stage not in (self.Game.Stage.GATHERING, rules.over):
+            return 'Game %s is already in progress' % tag, False
+
+        players = game.player_set.all()
+        count = len(players)
+        if count < rules.min_players:
+            return 'Not enough players to start game %s (%i)' % (tag, count), False
+
+        rules.deal(game, players, random.sample(range(count), count))
+        save_all([ game ] + list(players))
+
+        return rules.started(game, players), True
+
+    def destroy ( self, tag, token ):
+        '''
+        Delete a game and all its players.
+        '''
+        game, player, err = self.get_game_and_player( tag, token )
+        if err is not None:
+            return False, err
+
+        game.delete()
+        return True, 'game %s deleted' % tag
+
+    def purge ( self ):
+        '''
+        Destroy all games. For testing only, not to be exposed to outside world!
+        '''
+        self.Game.objects.all().delete()
+        store.clear()
+        cache.clear()
@@ -0,0 +1,288 @@
+'''
+Helpers for telling connected clients about game state changes.
+
+In the original scheme every move sends a bare 'refresh' ping on the game's
+channel and every client then calls back with `how=json` to have its own
+view of the state rebuilt. In push mode (settings.PUSH_STATE) the server
+instead builds each viewer's state once per move and sends it down a
+channel only that viewer subscribes to: as a patch against the previous
+version (settings.PUSH_PATCHES) when that is to hand and smaller, else
+whole.
+
+Events go to the streams connected to this process and, through the event
+broker if there is one, to those of every other server process (see
+`games.pubsub`).
+
+A game page's stream, at /events/<app>/<tag>/, follows the game's public
+channel and its viewer's own (`ViewerChannels`). The viewer is the player
+whose token is in the session, if they sit at the game, else the
+spectators: the token is never in the stream's URL, where it would end
+up in server and proxy access logs.
+
+A burst of moves on one game, such as a round changing over or everyone
+placing their first card at once, would otherwise have every client
+refresh once per move. Refreshes and pushes are instead held back for
+settings.GAME_EVENT_COALESCE seconds after the first, and then one goes
+out for the game as it stands at the end: a push of the latest state, or
+a ping carrying the latest version (clients that already have it needn't
+call back). 'index' pings, for a game that has gone, go straight away.
+'''
+import json, threading
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django_eventstream import send_event
+from django_eventstream.channelmanager import DefaultChannelManager
+from django_eventstream.consumers import Listener, get_listener_manager
+from .snapshots import cache
+from .patches import make_patch
+from .pubsub import bus
+from .locks import locks
+from . import metrics
+
+# pseudo-token under which all spectators share a single public view
+SPECTATOR = 'nobody'
+
+def push_enabled ():
+    '''
+    Whether moves should push per-viewer state rather than a refresh ping.
+    '''
+    return getattr(settings, 'PUSH_STATE', False)
+
+
+def patches_enabled ():
+    '''
+    Whether pushed state should go as patches where possible.
+    '''
+    return getattr(settings, 'PUSH_PATCHES', False)
+
+
+def coalesce_window ():
+    '''
+    Seconds to gather a game's events for before sending, or 0 to send
+    each as it comes.
+    '''
+    return getattr(settings, 'GAME_EVENT_COALESCE', 0)
+
+
+class Coalescer:
+    '''
+    The events held back for each game, as the function that sends the
+    latest, and the version last pushed for each game (the base of the
+    next patch).
+    '''
+    def __init__ ( self ):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.pushed = {}
+
+    def submit ( self, key, fn ):
+        '''
+        Have `fn()` called at the end of the game's window, instead of
+        whatever was waiting for it.
+        '''
+        window = coalesce_window()
+        if window <= 0:
+            fn()
+            return
+
+        with self.lock:
+            timer = self.pending[key][1] if key in self.pending else None
+            if timer is None:
+                timer = threading.Timer(window, self.send, (key,))
+                timer.daemon = True
+                timer.start()
+            self.pending[key] = (fn, timer)
+
+    def send ( self, key ):
+        with self.lock:
+            fn, timer = self.pending.pop(key, (None, None))
+        if timer is not None:
+            # in case we're early
+            timer.cancel()
+        if fn is not None:
+            fn()
+
+    def flush ( self ):
+        '''
+        Send everything held back now.
+        '''
+        for key in list(self.pending):
+            self.send(key)
+
+    def forget ( self, key ):
+        '''
+        Drop a game's held back events, e.g. once it is destroyed.
+        '''
+        with self.lock:
+            _, timer = self.pending.pop(key, (None, None))
+            self.pushed.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+
+coalescer = Coalescer()
+
+
+def viewer_channel ( tag, viewer ):
+    '''
+    Name of the event channel carrying state for one viewer of a game.
+    Players are keyed by their token, which only they know, so the
+    redacted state for a seat is never sent to anyone else.
+    '''
+    return '%s-%s' % (tag, viewer)
+
+
+# how to tell who is watching each app's games: the session key its player
+# tokens are kept under, and its `get_game_and_player`, by app label
+viewers = {}
+
+def identify ( Game, session_key, get_game_and_player ):
+    '''
+    Have streams of an app's games follow the viewer's own channel, for the
+    player in the session under `session_key`.
+    '''
+    viewers[Game._meta.app_label] = (session_key, get_game_and_player)
+
+
+def viewer_of ( app, tag, session ):
+    '''
+    Who a session watches a game as: its player's token if they are
+    sitting at it, else SPECTATOR.
+    '''
+    session_key, get_game_and_player = viewers[app]
+    token = session.get(session_key) if session is not None else None
+    if token is None:
+        return SPECTATOR
+    _, player, _ = get_game_and_player(tag, token)
+    return SPECTATOR if player is None else token
+
+
+class ViewerChannels(DefaultChannelManager):
+    '''
+    Event stream channels: for /events/<app>/<tag>/, the game's public
+    channel and the channel of its viewer in the stream's session (see
+    settings.EVENTSTREAM_CHANNELMANAGER_CLASS); otherwise as the URL says.
+    '''
+    def get_channels_for_request ( self, request, view_kwargs ):
+        app = view_kwargs.get('app')
+        if app not in viewers:
+            return super().get_channels_for_request(request, view_kwargs)
+
+        tag = view_kwargs['tag']
+        viewer = viewer_of(app, tag, request.scope.get('session'))
+        return set([ tag, viewer_channel(tag, viewer) ])
+
+
+class Subscription:
+    '''
+    The events sent on some channels, as this process queues them for its
+    streams, for something other than a stream to pass on (such as a game
+    socket, see `games.consumers`). The one place that knows how
+    django_eventstream queues them.
+    '''
+    def __init__ ( self, channels ):
+        self.listener = Listener()
+        self.listener.channels = set(channels)
+        self.closed = False
+        get_listener_manager().add_listener(self.listener)
+
+    def close ( self ):
+        if not self.closed:
+            self.closed = True
+            get_listener_manager().remove_listener(self.listener)
+            # wake anyone waiting in `next`
+            self.listener.aevent.set()
+
+    async def next ( self ):
+        '''
+        Wait for the events queued since the last call, as
+        `(events, overflow)`, `overflow` if some were dropped for too many
+        queued. None once closed.
+        '''
+        listener = self.listener
+        await listener.aevent.wait()
+        with get_listener_manager().lock:
+            items, listener.channel_items = listener.channel_items, {}
+            overflow, listener.overflow = listener.overflow, False
+            listener.aevent.clear()
+
+        if self.closed:
+            return None
+        return [ event for events in items.values() for event in events ], overflow
+
+
+def send ( app, tag, channel, event_type, data ):
+    '''
+    Send an event about a game to everyone listening on a channel, in
+    this process and the others.
+    '''
+    bus.local(send_event, channel, event_type, data)
+    bus.forward(app, tag, channel, event_type, data)
+
+
+def push_state ( game, visible_state ):
+    '''
+    Build the visible state for each player in a loaded game plus the
+    public spectator view, all from the same snapshot, and send each down
+    its own viewer channel, once the game's window is up. The states are
+    cached under the game's version for later refreshes.
+    '''
+    key = (game._meta.app_label, game.tag)
+    coalescer.submit(key, lambda: push_now(game, visible_state))
+
+
+def push_now ( game, visible_state ):
+    key = (game._meta.app_label, game.tag)
+    app, tag = key
+    
+    # a resident game may be moving on meanwhile
+    with locks.get(key), metrics.fanning_out(app):
+        # a move made while this waited for the game pushes its own state,
+        # and caching this one would set the game's latest version back
+        latest = cache.version(type(game), tag)
+        if (latest is not None) and (latest > game.version):
+            return
+
+        tokens =[str(pp.token) for pp in game.player_set.all()]
+        with coalescer.lock:
+            pushed = coalescer.pushed.get(key)
+            coalescer.pushed[key] = game.version
+        
+        for viewer in tokens + [SPECTATOR]:
+            state = visible_state(tag, viewer, game=game)
+            state['msg'] = ''
+            _, _, encoded = cache.put(game, viewer, state)
+            
+            previous = None
+            if patches_enabled():
+                # the version before, else the last one pushed from here
+                previous = cache.at(game, game.version - 1, viewer) or (pushed and cache.at(game, pushed, viewer))
+            if previous:
+                patch = make_patch(previous[1], state, previous[0], game.version)
+                if len(json.dumps(patch, cls=DjangoJSONEncoder)) < len(encoded):
+                    send(app, tag, viewer_channel(tag, viewer), 'patch', patch)
+                    continue
+            
+            send(app, tag, viewer_channel(tag, viewer), 'state', state)
+
+
+def ping ( Game, tag, action, version=None ):
+    '''
+    Send a bare message to everyone watching a game: 'refresh' to have
+    them call back for the state (at `version`), once the game's window is
+    up, or 'index' straight away when it has gone.
+    '''
+    key = (Game._meta.app_label, tag)
+    data = { 'text' : action }
+    if version is not None:
+        data['version'] = version
+    
+    def now ():
+        with metrics.fanning_out(key[0]):
+            send(key[0], tag, tag, 'message', data)
+    
+    if action == 'refresh':
+        coalescer.submit(key, now)
+    else:
+        coalescer.forget(key)
+        now()
@@ -0,0 +1,342 @@
+'''
+Append-only journal of the moves made in each game, with snapshots.
+
+The game and player rows only ever hold a game's current state, and its
+`status` only the last message. Every successful game logic move (see
+`games.locks.game_move`) also appends a journal entry recording:
+
+ * the move: the game logic function, who made it (nickname, never the
+   token) and its other arguments
+ * the message it returned, and the state version it is published at
+   (the game's version plus one, which its notification bumps it to)
+ * what it changed in the game's compact state, as a patch (see
+   `games.patches`)
+
+Every settings.GAME_JOURNAL_SNAPSHOT_EVERY entries, and on the first
+entry this process writes for a game, the entry carries the whole compact
+state as well. Any past state of a game can so be rebuilt from the
+nearest snapshot before it plus the patches since (`replay`), without
+reading the game's rows; `restore` writes a rebuilt state back over them,
+e.g. to recover games whose in-memory changes never made it to the
+database. `history` lists the moves alone, which is cheap.
+
+The compact state of a game is its own and its players' fields as JSON
+values (cards packed), players keyed by token. It leaves out what only
+the notifications write, `status` and `version`, which replay takes
+from the entries, and the `modified` timestamp.
+
+Before and after states come for free from the move's own loads (see
+`games.loader`), unless the move created or deleted rows, when the game
+is read again afterwards. The instance a move changed is also handed on
+to its notification (`moved`), which so needn't read the game again.
+
+Each app keeps its journal as a `Move` model deriving `JournalEntry`,
+with a `game` foreign key. Under the in-memory store, entries for
+resident games are written behind with the rest of their changes.
+'''
+import functools, inspect, threading
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from .patches import diff, apply
+from .store import store, game_key
+
+# fields only the notifications write
+UNJOURNALED = ('status', 'version', 'modified')
+
+# JSON native types, stored as they are
+PLAIN = (bool, int, float, str, type(None))
+
+
+def enabled ():
+    return getattr(settings, 'GAME_JOURNAL', False)
+
+
+def snapshot_every ():
+    return getattr(settings, 'GAME_JOURNAL_SNAPSHOT_EVERY', 25)
+
+
+class JournalEntry(models.Model):
+    # the game logic function, who made the move and with what
+    action = models.CharField(max_length=20)
+    actor = models.CharField(max_length=32, blank=True, default='')
+    args = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+
+    # the message the move returned, and the state version it is published at
+    status = models.CharField(max_length=200, default='')
+    version = models.PositiveIntegerField(default=0)
+
+    # patch from the compact state before the move to the state after it
+    changes = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+
+    # the whole compact state after the move, every so often
+    snapshot = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        abstract = True
+        ordering = ('id',)
+
+    def __str__ ( self ):
+        return '%s %s %s' % (self.version, self.actor, self.action)
+
+
+def journal_model ( Game ):
+    return Game.move_set.rel.related_model
+
+
+def player_model ( Game ):
+    return Game.player_set.rel.related_model
+
+
+def journaled_fields ( model ):
+    return [ ff for ff in model._meta.concrete_fields if ff.attname not in UNJOURNALED ]
+
+
+def encode ( field, obj ):
+    value = field.get_prep_value(field.value_from_object(obj))
+    return value if isinstance(value, PLAIN) else DjangoJSONEncoder().default(value)
+
+
+def capture ( game, players ):
+    '''
+    The compact state of a game and its players.
+    '''
+    return {
+        'game' : { ff.attname : encode(ff, game) for ff in journaled_fields(type(game)) },
+        'players' : { str(pp.token) : { ff.attname : encode(ff, pp) for ff in journaled_fields(type(pp)) } for pp in players },
+    }
+
+
+def rebuild ( Game, state ):
+    '''
+    Unsaved model instances of a game and its players, in turn order, as
+    at a compact state.
+    '''
+    Player = player_model(Game)
+    game = Game(**{ ff.attname : ff.to_python(state['game'][ff.attname]) for ff in journaled_fields(Game) if ff.attname in state['game'] })
+    players = [ Player(**{ ff.attname : ff.to_python(values[ff.attname]) for ff in journaled_fields(Player) if ff.attname in values })
+                for values in state['players'].values() ]
+    players.sort(key=lambda pp: pp.turn_order)
+    return game, players
+
+
+class Recording:
+    '''
+    A move in progress on one game: its state before, and the instance
+    that the move changes.
+    '''
+    def __init__ ( self, Game, tag ):
+        self.Game = Game
+        self.tag = tag
+        self.before = None
+        self.game = None
+        self.stale = False
+
+
+local = threading.local()
+
+def recordings ():
+    if not hasattr(local, 'recordings'):
+        local.recordings = {}
+    return local.recordings
+
+
+def loaded ( game ):
+    '''
+    Note a game loaded by the current thread, for any move recording on it.
+    '''
+    rec = recordings().get(game_key(game))
+    if rec is None:
+        return
+    if (rec.before is None) and enabled():
+        rec.before = capture(game, game.player_set.all())
+    rec.game = game
+
+
+def moved ( Game, tag ):
+    '''
+    The instance of a game that the current thread's last move on it
+    loaded and changed, as left by that move, or None if there isn't one
+    to be trusted: the move loaded nothing, or created or deleted rows.
+    Each move's instance is handed out once.
+    '''
+    rec = getattr(local, 'last', None)
+    local.last = None
+    if (rec is None) or (rec.Game is not Game) or (rec.tag != tag) or rec.stale:
+        return None
+    return rec.game
+
+
+def rows_changed ( sender, instance, **kwargs ):
+    '''
+    A move created or deleted a row: its loaded game is out of date.
+    '''
+    rec = recordings().get(game_key(instance)) if getattr(local, 'recordings', None) else None
+    if rec is not None:
+        rec.stale = True
+
+
+def saved ( sender, instance, created, **kwargs ):
+    if created:
+        rows_changed(sender, instance)
+
+
+post_save.connect(saved)
+post_delete.connect(rows_changed)
+
+
+class Journal:
+    def __init__ ( self ):
+        # entries written per game since its last snapshot
+        self.since = {}
+        self.signatures = {}
+
+    def signature ( self, fn ):
+        sig = self.signatures.get(fn)
+        if sig is None:
+            sig = self.signatures[fn] = inspect.signature(fn)
+        return sig
+
+    def arguments ( self, fn, tag, args, kwargs ):
+        '''
+        A call's arguments by name, with any taken as `**kwargs` among them.
+        '''
+        sig = self.signature(fn)
+        arguments = dict(sig.bind(tag, *args, **kwargs).arguments)
+        for name, param in sig.parameters.items():
+            if param.kind == param.VAR_KEYWORD:
+                arguments.update(arguments.pop(name, {}))
+        return arguments
+
+    def recorder ( self, Game, fn ):
+        '''
+        Wrap a game logic move taking the game tag first to journal what
+        each call changes. Calls must hold the game's lock.
+        '''
+        @functools.wraps(fn)
+        def wrapper ( tag, *args, **kwargs ):
+            return self.record(Game, fn, tag, args, kwargs)
+        return wrapper
+
+    def record ( self, Game, fn, tag, args, kwargs ):
+        key = (Game._meta.app_label, tag)
+        active = recordings()
+        if key in active:
+            return fn(tag, *args, **kwargs)
+
+        rec = active[key] = Recording(Game, tag)
+        try:
+            result = fn(tag, *args, **kwargs)
+        finally:
+            del active[key]
+        local.last = rec
+
+        if enabled():
+            self.append(rec, fn, self.arguments(fn, tag, args, kwargs), result)
+        return result
+
+    def after ( self, rec ):
+        '''
+        The game and its players after a move, read again if the move
+        added or removed rows. None if the game is gone.
+        '''
+        if (rec.game is not None) and not rec.stale:
+            return rec.game, rec.game.player_set.all()
+
+        game = store.get(rec.Game, rec.tag) if store.enabled() else None
+        if game is None:
+            game = rec.Game.objects.filter(pk=rec.tag).first()
+            if game is None:
+                return None
+        return game, player_model(rec.Game).objects.filter(game_id=rec.tag).order_by('turn_order')
+
+    def append ( self, rec, fn, arguments, result ):
+        found = self.after(rec)
+        if found is None:
+            # destroyed, and its journal with it
+            self.since.pop((rec.Game._meta.app_label, rec.tag), None)
+            return
+
+        game, players = found
+        state = capture(game, players)
+        changes = diff(rec.before or {}, state)
+        if not changes:
+            return
+
+        token = arguments.get('token')
+        actor = state['players'].get(str(token), {}).get('nickname', '') if token else arguments.get('nickname', '')
+        # moves return (msg, ok), join (token, msg, notify)
+        msg = result[1] if len(result) == 3 else result[0]
+
+        key = game_key(game)
+        count = self.since.get(key)
+        snapshot = (rec.before is None) or (count is None) or (count + 1 >= snapshot_every())
+        self.since[key] = 0 if snapshot else count + 1
+
+        entry = journal_model(rec.Game)(
+            game_id=rec.tag, action=fn.__name__, actor=actor,
+            args={ kk : vv for kk, vv in arguments.items() if kk not in ('tag', 'token') },
+            status=msg if isinstance(msg, str) else '', version=game.version + 1,
+            changes=changes, snapshot=state if snapshot else None)
+
+        if store.enabled() and (store.get(rec.Game, rec.tag) is not None):
+            store.append(key, entry)
+        else:
+            entry.save()
+
+    def history ( self, Game, tag, since=0 ):
+        '''
+        A game's moves published after version `since`, oldest first, as
+        dicts without the states.
+        '''
+        return list(journal_model(Game).objects.filter(game_id=tag, version__gt=since)
+                    .values('id', 'action', 'actor', 'args', 'status', 'version', 'created'))
+
+    def replay ( self, Game, tag, upto=None ):
+        '''
+        A game's compact state after the last move published at or before
+        version `upto` (or after its last move), as
+        `(state, status, version)`, or None if it has no such moves.
+        '''
+        entries = journal_model(Game).objects.filter(game_id=tag)
+        if upto is not None:
+            entries = entries.filter(version__lte=upto)
+
+        base = entries.filter(snapshot__isnull=False).order_by('-id').values('id', 'snapshot', 'status', 'version').first()
+        if base is None:
+            return None
+
+        state, status, version = base['snapshot'], base['status'], base['version']
+        for changes, status, version in entries.filter(id__gt=base['id']).values_list('changes', 'status', 'version'):
+            state = apply(state, { 'ops' : changes })
+        return state, status, version
+
+    def restore ( self, Game, tag ):
+        '''
+        Write a game's state as replayed from its journal back over its
+        rows, e.g. after a crash lost changes that were only in memory.
+        Returns the restored game, or None if there is nothing to replay.
+        '''
+        replayed = self.replay(Game, tag)
+        if replayed is None:
+            return None
+
+        state, status, version = replayed
+        game, players = rebuild(Game, state)
+        game.status = status
+        game.version = version
+
+        store.evict((Game._meta.app_label, tag), flush=False)
+        with transaction.atomic():
+            player_model(Game).objects.filter(game_id=tag).exclude(token__in=[ pp.token for pp in players ]).delete()
+            for obj in [ game ] + players:
+                # update the row if it is there, else insert it
+                obj._state.adding = False
+                obj.save()
+        return game
+
+
+journal = Journal()
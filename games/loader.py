@@ -0,0 +1,109 @@
+'''
+Shared loading of game state for the game apps.
+
+A game and all of its players are fetched together in one prefetched
+round trip, and the game logic and state builders then work from that
+in-memory snapshot. Within the snapshot, `game.player_set.all()` is the
+cached player list ordered by turn order; anything else on the related
+manager (`get`, `filter`, `order_by`...) goes back to the database, so
+use the helpers below instead.
+
+When the in-memory store is enabled (see `games.store`), loaded games stay
+resident and later loads are served from memory. Loads within a move are
+noted for its journal entry (see `games.journal`).
+'''
+import uuid
+from django.db.models import Prefetch
+from .store import store
+from .locks import locking_rows
+from . import journal
+
+def load_game ( Game, tag, token=None ):
+    '''
+    Fetch a game with all its players prefetched and resolve the player
+    token within it. Returns `(game, player, err)` in the same form as the
+    apps' `get_game_and_player`.
+    '''
+    game = store.get(Game, tag) if store.enabled() else None
+    
+    if game is None:
+        Player = Game.player_set.rel.related_model
+        players = Prefetch('player_set', queryset=Player.objects.order_by('turn_order'))
+
+        games = Game.objects.prefetch_related(players)
+        if locking_rows():
+            # inside a move: hold the game's row until the move commits
+            games = games.select_for_update()
+
+        try:
+            game = games.get(pk=tag)
+        except Game.DoesNotExist:
+            return None, None, 'Game %s does not exist' % tag
+        
+        if store.enabled():
+            store.put(game)
+
+    journal.loaded(game)
+    player, err = find_player(game, token)
+    return game, player, err
+
+
+def find_player ( game, token ):
+    '''
+    Resolve a player token within a loaded game. Returns `(player, err)`.
+    '''
+    # tokens come back as we handed them out, so are looked up as they are
+    player = seated(game).get(token)
+    if player is not None:
+        return player, None
+
+    try:
+        valid = str(uuid.UUID(token))
+    except Exception:
+        return None, 'Invalid player token %s' % token
+
+    player = seated(game).get(valid)
+    if player is None:
+        return None, 'Player %s is not in game %s' % (token, game.tag)
+    return player, None
+
+
+def seated ( game ):
+    '''
+    The loaded players of a game by token, as a string, indexed once per load.
+    '''
+    players = game.player_set.all()
+    index = getattr(game, '_seated', None)
+    if (index is None) or (index[0] is not players):
+        index = game._seated = (players, { str(pp.token) : pp for pp in players })
+    return index[1]
+
+
+def player_at ( game, turn_order ):
+    '''
+    Look up a player by turn order within a loaded game.
+    '''
+    for pp in game.player_set.all():
+        if pp.turn_order == turn_order:
+            return pp
+
+    raise game.player_set.model.DoesNotExist('No player at turn order %s in game %s' % (turn_order, game.tag))
+
+
+def player_named ( game, nickname ):
+    '''
+    Look up a player by nickname within a loaded game.
+    '''
+    for pp in game.player_set.all():
+        if pp.nickname == nickname:
+            return pp
+
+    raise game.player_set.model.DoesNotExist('No player %s in game %s' % (nickname, game.tag))
+
+
+def in_turn_order ( game ):
+    '''
+    The loaded players sorted by current turn order. (The prefetched order
+    goes stale once a move reassigns turn orders, as `start` does.)
+    '''
+    return sorted(game.player_set.all(), key=lambda pp: pp.turn_order)
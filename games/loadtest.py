@@ -0,0 +1,598 @@
+'''
+Load generator: full tables of bot players against a running server.
+
+    python -m games.loadtest --url http://localhost:8000 --app nothanks --games 50
+
+Each game is played start to finish by bots that go through the same
+interfaces as the game pages. Each seat joins with a POST and keeps the
+session cookie it is given, as a browser would, which is how the server
+knows whose state to push it. It then plays over a socket per seat (see
+`games.consumers`), sending its moves and following the state (pushed
+states and patches) down it, and acts whenever the state offers it
+actions. As the pages do, a seat whose socket won't open, or closes,
+carries on with one POST per move (`move=...`, `how=json`) and an event
+stream, which also carries refresh pings; `--transport http` plays that
+way throughout. At the end it reports, per app:
+
+ * moves/sec over the whole run
+ * p50/p95/p99 latency of move requests, overall and per move
+ * p50/p95/p99 fan-out latency: from sending a move to each seat's
+   stream delivering the version it produced (push mode only, since
+   refresh pings carry no version)
+
+Only the standard library is used, over plain HTTP/1.1 with keep-alive
+and a minimal WebSocket client, so a few thousand seats fit in one client
+process.
+'''
+import argparse, asyncio, base64, collections, json, os, random, statistics, struct, time
+from urllib.parse import urlencode, urlsplit
+from . import patches
+
+# players per table if not given
+PLAYERS = { 'nothanks' : 5, 'skull' : 6, 'cockroach' : 4 }
+
+
+class Connection:
+    '''
+    Minimal keep-alive HTTP/1.1 client connection.
+    '''
+    def __init__ ( self, host, port ):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        # one request at a time: a seat may refresh while it is moving
+        self.busy = asyncio.Lock()
+
+    async def open ( self ):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close ( self ):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def send ( self, method, path, body=b'', headers=() ):
+        if self.writer is None:
+            await self.open()
+
+        lines = [ '%s %s HTTP/1.1' % (method, path), 'Host: %s' % self.host,
+                  'Content-Length: %i' % len(body) ]
+        lines += [ '%s: %s' % hh for hh in headers ]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        fields = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            # one cookie per line, each line kept
+            fields[name] = fields[name] + '\n' + value.strip() if name in fields else value.strip()
+        return status, fields
+
+    async def chunks ( self, fields ):
+        '''
+        The body of the response whose header `fields` were just read, as it arrives.
+        '''
+        if fields.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                data = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    return
+                yield data[:-2]
+        elif 'content-length' in fields:
+            yield await self.reader.readexactly(int(fields['content-length']))
+        else:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    self.close()
+                    return
+                yield data
+
+    async def request ( self, method, path, body=b'', headers=() ):
+        '''
+        Make a request and read its whole response: `(status, fields, body)`.
+        '''
+        async with self.busy:
+            try:
+                status, fields = await self.send(method, path, body, headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # the server dropped an idle connection: try once more on a new one
+                self.close()
+                status, fields = await self.send(method, path, body, headers)
+
+            body = b''.join([ chunk async for chunk in self.chunks(fields) ])
+            if fields.get('connection', '').lower() == 'close':
+                self.close()
+            return status, fields, body
+
+
+class Socket(Connection):
+    '''
+    Minimal WebSocket client connection, for JSON in text frames.
+    '''
+    async def upgrade ( self, path, headers=() ):
+        '''
+        Open a socket at `path`. Returns whether the server accepted it.
+        '''
+        key = base64.b64encode(os.urandom(16)).decode()
+        headers = [ ('Upgrade', 'websocket'), ('Connection', 'Upgrade'),
+                    ('Sec-WebSocket-Key', key), ('Sec-WebSocket-Version', '13') ] + list(headers)
+        try:
+            status, _ = await self.send('GET', path, headers=headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            status = None
+        if status != 101:
+            self.close()
+        return status == 101
+
+    def frame ( self, opcode, payload ):
+        # clients mask everything they send
+        mask = os.urandom(4)
+        size = len(payload)
+        if size < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | size)
+        elif size < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, size)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, size)
+        self.writer.write(header + mask + bytes([ bb ^ mask[ii % 4] for ii, bb in enumerate(payload) ]))
+
+    def send_json ( self, content ):
+        self.frame(0x1, json.dumps(content).encode())
+
+    async def receive_json ( self ):
+        '''
+        The next message the server sends, or None once it has closed.
+        '''
+        message = b''
+        while True:
+            try:
+                first, second = await self.reader.readexactly(2)
+                size = second & 0x7f
+                if size == 126:
+                    size, = struct.unpack('!H', await self.reader.readexactly(2))
+                elif size == 127:
+                    size, = struct.unpack('!Q', await self.reader.readexactly(8))
+                payload = await self.reader.readexactly(size)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                return None
+
+            opcode = first & 0x0f
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self.frame(0xa, payload)
+                continue
+            if opcode in (0x0, 0x1):
+                message += payload
+                if first & 0x80:
+                    return json.loads(message)
+
+
+class Stats:
+    '''
+    Timings gathered over a run of one app.
+    '''
+    def __init__ ( self ):
+        self.moves = {}
+        self.sent = {}
+        self.arrived = []
+        self.errors = 0
+        self.fallbacks = 0
+        self.games = 0
+
+    def move ( self, name, elapsed ):
+        self.moves.setdefault(name, []).append(elapsed)
+
+    def produced ( self, tag, version, started ):
+        self.sent[(tag, version)] = started
+
+    def fan_out ( self ):
+        return [ tt - self.sent[key] for key, tt in self.arrived if key in self.sent ]
+
+
+def cookie ( fields, name ):
+    '''
+    The value of the cookie `name` set by a response with header `fields`, or None.
+    '''
+    for line in fields.get('set-cookie', '').split('\n'):
+        key, _, value = line.partition('=')
+        if key.strip() == name:
+            return value.split(';', 1)[0]
+    return None
+
+
+def percentiles ( values ):
+    if not values:
+        return 'n/a'
+    if len(values) == 1:
+        values = values * 2
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return 'p50 %.1f  p95 %.1f  p99 %.1f ms' % tuple([ 1000 * cuts[ii - 1] for ii in (50, 95, 99) ])
+
+
+class Bot:
+    '''
+    One seat at a table. Keeps its view of the state up to date from its
+    event stream and the responses to its own moves, and makes a move
+    whenever that view offers it actions. Subclasses choose the moves.
+    '''
+    def __init__ ( self, table, nickname, owner=False ):
+        self.table = table
+        self.nickname = nickname
+        self.owner = owner
+        self.token = None
+        self.session = None
+        self.state = {}
+        self.changed = asyncio.Event()
+        self.done = False
+        self.conn = Connection(table.host, table.port)
+        # while playing over a socket: it, and the moves awaiting replies, in order
+        self.socket = None
+        self.pending = collections.deque()
+
+    async def post ( self, **fields ):
+        '''
+        POST to the game page (or make the move over the socket) and take
+        the returned state as the latest.
+        '''
+        if self.socket is not None:
+            return await self.request(fields)
+
+        table = self.table
+        fields = dict(fields, how='json')
+        if self.token is not None:
+            fields['token'] = self.token
+
+        headers = [ ('Content-Type', 'application/x-www-form-urlencoded'),
+                    ('Cookie', self.cookies()), ('X-CSRFToken', table.csrf) ]
+
+        started = time.monotonic()
+        status, response, body = await self.conn.request('POST', table.path, urlencode(fields).encode(), headers)
+        elapsed = time.monotonic() - started
+        self.session = cookie(response, 'sessionid') or self.session
+
+        move = fields.get('move', 'refresh')
+        if status != 200:
+            table.stats.errors += 1
+            return None
+        table.stats.move(move, elapsed)
+
+        try:
+            state = json.loads(body)
+        except ValueError:
+            # destroying a game answers with the index page
+            return None
+
+        if (move != 'refresh') and not state.get('msg'):
+            table.stats.produced(table.tag, state.get('version'), started)
+        self.update(state)
+        return state
+
+    def request ( self, fields ):
+        '''
+        Make a move over the socket: a future of the state replied.
+        '''
+        reply = asyncio.get_running_loop().create_future()
+        self.pending.append((fields.get('move', 'refresh'), time.monotonic(), reply))
+        self.socket.send_json(fields)
+        return reply
+
+    def replied ( self, state ):
+        table = self.table
+        move, started, reply = self.pending.popleft()
+        table.stats.move(move, time.monotonic() - started)
+
+        if (move not in ('refresh', 'destroy')) and not state.get('msg'):
+            table.stats.produced(table.tag, state.get('version'), started)
+        if 'version' in state:
+            self.update(state)
+        reply.set_result(state)
+
+    async def refresh ( self ):
+        '''
+        Fetch the whole state again. Over the socket its reply comes in
+        with the events, so isn't waited for.
+        '''
+        if self.socket is None:
+            await self.post(move='refresh')
+        else:
+            self.request({ 'move' : 'refresh' })
+
+    def cookies ( self ):
+        cookies = 'csrftoken=%s' % self.table.csrf
+        return cookies if self.session is None else cookies + '; sessionid=%s' % self.session
+
+    def update ( self, state ):
+        if ('err' in state) or (state.get('version', -1) >= self.state.get('version', -1)):
+            self.state = state
+            self.changed.set()
+
+    async def listen ( self ):
+        '''
+        Follow the game until it is over: over a socket if the table plays
+        over them and one opens, else, or once it closes, over the event
+        stream.
+        '''
+        if self.table.transport == 'socket':
+            await self.follow_socket()
+        if not self.done:
+            await self.follow_stream()
+
+    async def follow_socket ( self ):
+        table = self.table
+        socket = Socket(table.host, table.port)
+        origin = 'http://%s:%i' % (table.host, table.port)
+        if not await socket.upgrade('/ws/%s/%s/' % (table.app, table.tag), [ ('Origin', origin), ('Cookie', self.cookies()) ]):
+            table.stats.fallbacks += 1
+            return
+
+        try:
+            # the state on connecting is no move's fan-out
+            first = await socket.receive_json()
+            if first is None:
+                return
+            self.update(first['data'])
+            self.socket = socket
+
+            while not self.done:
+                event = await socket.receive_json()
+                if event is None:
+                    if not self.done:
+                        table.stats.fallbacks += 1
+                    return
+                if event['type'] == 'reply':
+                    self.replied(event['data'])
+                else:
+                    await self.receive(event['type'], event['data'])
+        finally:
+            # anything still awaiting a reply goes without
+            self.socket = None
+            while self.pending:
+                reply = self.pending.popleft()[2]
+                if not reply.done():
+                    reply.set_result(None)
+            socket.close()
+
+    async def follow_stream ( self ):
+        table = self.table
+        conn = Connection(table.host, table.port)
+        status, fields = await conn.send('GET', '/events/%s/%s/' % (table.app, table.tag),
+                                         headers=[ ('Accept', 'text/event-stream'), ('Cookie', self.cookies()) ])
+        event, data, pending = 'message', [], b''
+        try:
+            async for chunk in conn.chunks(fields):
+                pending += chunk
+                while b'\n' in pending:
+                    line, pending = pending.split(b'\n', 1)
+                    line = line.decode().rstrip('\r')
+                    if line.startswith('event:'):
+                        event = line[6:].strip()
+                    elif line.startswith('data:'):
+                        data.append(line[5:].strip())
+                    elif not line:
+                        if data:
+                            await self.receive_text(event, '\n'.join(data))
+                        event, data = 'message', []
+                if self.done:
+                    return
+        finally:
+            conn.close()
+
+    async def receive_text ( self, event, data ):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            # e.g. the stream-open event
+            return
+        await self.receive(event, data)
+
+    async def receive ( self, event, data ):
+        table = self.table
+        if event in ('state', 'patch'):
+            table.stats.arrived.append(((table.tag, data['version']), time.monotonic()))
+
+        if event == 'state':
+            self.update(data)
+        elif event == 'patch':
+            if self.state.get('version') == data['base']:
+                self.update(patches.apply(self.state, data))
+            elif data['version'] > self.state.get('version', -1):
+                await self.refresh()
+        elif (event == 'message') and (data.get('text') == 'refresh'):
+            await self.refresh()
+        elif (event == 'message') and (data.get('text') == 'index'):
+            self.done = True
+            self.changed.set()
+
+    async def play ( self ):
+        '''
+        Act on each new state until the game ends.
+        '''
+        while not self.done:
+            try:
+                await asyncio.wait_for(self.changed.wait(), self.table.patience)
+            except asyncio.TimeoutError:
+                # nothing heard for a while: look again
+                await self.refresh()
+                continue
+            self.changed.clear()
+
+            if 'err' in self.state:
+                # the game has gone
+                break
+
+            if self.table.moves >= self.table.max_moves:
+                # taking too long: abandon it
+                if self.owner:
+                    await self.post(move='destroy')
+                break
+
+            actions = self.state.get('actions', [])
+            if 'destroy' in actions:
+                # game over: the owner clears up, which tells everyone else
+                if self.owner:
+                    await self.post(move='destroy')
+                    self.done = True
+                continue
+
+            if actions:
+                self.table.moves += 1
+                await self.act(actions)
+
+        self.done = True
+        self.conn.close()
+
+    async def act ( self, actions ):
+        raise NotImplementedError
+
+
+class NoThanksBot(Bot):
+    async def act ( self, actions ):
+        state = self.state
+        if 'end_round' in actions:
+            if self.owner:
+                await self.post(move='end_round')
+        elif ('pay' in actions) and (random.random() < 0.7):
+            await self.post(move='pay', wallet=state['your_cash'])
+        elif 'take' in actions:
+            await self.post(move='take', card=state['card'])
+
+
+class SkullBot(Bot):
+    async def act ( self, actions ):
+        state = self.state
+        hand = state.get('your_hand', [])
+        if 'end_round' in actions:
+            if self.owner:
+                await self.post(move='end_round')
+        elif ('place' in actions) and hand and (('bid' not in actions) or (random.random() < 0.6)):
+            await self.post(move='place', card=random.randrange(len(hand)))
+        elif ('bid' in actions) and state.get('possible_bids') and (('decline' not in actions) or (random.random() < 0.4)):
+            await self.post(move='bid', bid=state['possible_bids'][0])
+        elif 'decline' in actions:
+            await self.post(move='decline')
+        elif 'flip' in actions:
+            targets = [ pp['nickname'] for pp in state['players'] if len(pp['stack']) > pp['flipped'] ]
+            if targets:
+                await self.post(move='flip', target=random.choice(targets))
+
+
+class CockroachBot(Bot):
+    async def act ( self, actions ):
+        state = self.state
+        me = state.get('your_turn_order')
+        targets = [ tt for tt in state.get('referrable', []) if tt != me ]
+        claim = random.randrange(len(state['suits']))
+        if ('play' in actions) and targets and state.get('your_hand'):
+            await self.post(move='play', card_idx=random.randrange(len(state['your_hand'])),
+                            target=random.choice(targets), claim=claim)
+        elif ('peek' in actions) and (random.random() < 0.3):
+            await self.post(move='peek')
+        elif ('refer' in actions) and targets and (('call' not in actions) or (random.random() < 0.5)):
+            await self.post(move='refer', target=random.choice(targets), claim=claim)
+        elif 'call' in actions:
+            await self.post(move='call', verdict=random.choice(['yes', 'no']))
+
+
+BOTS = { 'nothanks' : NoThanksBot, 'skull' : SkullBot, 'cockroach' : CockroachBot }
+
+
+class Table:
+    '''
+    One game played to completion by a full table of bots.
+    '''
+    def __init__ ( self, args, app, tag, csrf, stats ):
+        url = urlsplit(args.url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.app = app
+        self.tag = tag
+        self.path = '/%s/%s/' % (app, tag)
+        self.csrf = csrf
+        self.stats = stats
+        self.patience = args.patience
+        self.transport = args.transport
+        self.max_moves = args.max_moves
+        self.moves = 0
+        self.bots = [ BOTS[app](self, 'bot%i' % ii, owner=(ii == 0)) for ii in range(args.players or PLAYERS[app]) ]
+        self.join_fields = { 'num_rounds' : args.rounds } if app == 'nothanks' else {}
+
+    async def run ( self ):
+        for bot in self.bots:
+            state = await bot.post(move='join', nick=bot.nickname, **self.join_fields)
+            bot.token = state['token']
+
+        listeners = [ asyncio.ensure_future(bot.listen()) for bot in self.bots ]
+        # give the streams a moment to connect before anything happens
+        await asyncio.sleep(0.2)
+
+        await self.bots[0].post(move='start')
+        await asyncio.gather(*[ bot.play() for bot in self.bots ])
+
+        for ll in listeners:
+            ll.cancel()
+        self.stats.games += 1
+
+
+async def get_csrf ( args, app ):
+    url = urlsplit(args.url)
+    conn = Connection(url.hostname, url.port or 80)
+    _, fields, _ = await conn.request('GET', '/%s/' % app)
+    conn.close()
+    return cookie(fields, 'csrftoken')
+
+
+async def run_app ( args, app ):
+    stats = Stats()
+    csrf = await get_csrf(args, app)
+    run = os.urandom(3).hex()
+    tables = [ Table(args, app, 'lt%s%s%i' % (app[:2], run, ii), csrf, stats) for ii in range(args.games) ]
+
+    started = time.monotonic()
+    results = await asyncio.gather(*[ tt.run() for tt in tables ], return_exceptions=True)
+    elapsed = time.monotonic() - started
+
+    failed = [ rr for rr in results if isinstance(rr, Exception) ]
+    count = sum([ len(vv) for vv in stats.moves.values() ])
+    moves = [ tt for name, vv in stats.moves.items() if name not in ('join', 'refresh') for tt in vv ]
+
+    print('%s: %i/%i games in %.1fs, %i moves (%i errors, %i seats fell back to http)' % (
+        app, stats.games, len(tables), elapsed, count, stats.errors, stats.fallbacks))
+    print('  moves/sec   %.1f' % (len(moves) / elapsed))
+    print('  move        %s' % percentiles(moves))
+    for name in sorted(stats.moves):
+        print('    %-10s %s (%i)' % (name, percentiles(stats.moves[name]), len(stats.moves[name])))
+    print('  fan-out     %s' % percentiles(stats.fan_out()))
+    for ff in failed[:3]:
+        print('  failed: %r' % ff)
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='Play many games at once against a running server.')
+    parser.add_argument('--url', default='http://localhost:8000', help='server to play against')
+    parser.add_argument('--app', action='append', choices=sorted(BOTS), help='game to play (repeatable, default all)')
+    parser.add_argument('--games', type=int, default=10, help='concurrent games per app')
+    parser.add_argument('--players', type=int, default=0, help='players per game (default depends on the game)')
+    parser.add_argument('--rounds', type=int, default=1, help='rounds per No Thanks! game')
+    parser.add_argument('--max-moves', type=int, default=2000, help='give up on a game after this many moves')
+    parser.add_argument('--transport', choices=('socket', 'http'), default='socket',
+                        help='play over a socket per seat (falling back to http), or POST moves and follow event streams')
+    parser.add_argument('--patience', type=float, default=5.0, help='seconds to wait for news before refreshing')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the bots\' choices')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    for app in (args.app or sorted(BOTS)):
+        asyncio.run(run_app(args, app))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+'''
+Per-game serialization of moves.
+
+Moves within one game must be applied strictly one after another, or two
+concurrent requests can each load the same state and one write clobbers
+the other. Moves in different games have nothing to do with each other
+and shouldn't wait on each other.
+
+Within a process each game tag gets its own lock, so only moves on the
+same game queue up. The move also runs in a transaction, so it commits
+(and on SQLite syncs to disk) once rather than once per save, and that
+serializes moves on a game across processes as well:
+
+ * on PostgreSQL the transaction takes an advisory lock on the game's
+   app and tag, which holds even before the game has a row (two
+   processes creating the same game), and holds the game's row with
+   SELECT ... FOR UPDATE
+ * on SQLite a transaction takes the database's write lock before it
+   reads anything (see `games.sqlite3`), so only one runs at a time
+'''
+import asyncio, functools, threading, weakref
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection, transaction
+from .store import store
+from .journal import journal
+from . import metrics
+
+class GameLocks:
+    '''
+    Lazily created per-game locks, dropped again once nobody holds them.
+    '''
+    def __init__ ( self ):
+        self.guard = threading.Lock()
+        self.locks = weakref.WeakValueDictionary()
+        self.async_locks = weakref.WeakValueDictionary()
+
+    def get ( self, key ):
+        with self.guard:
+            lock = self.locks.get(key)
+            if lock is None:
+                lock = self.locks[key] = threading.RLock()
+            return lock
+
+    def get_async ( self, key ):
+        with self.guard:
+            lock = self.async_locks.get(key)
+            if lock is None:
+                lock = self.async_locks[key] = asyncio.Lock()
+            return lock
+
+
+locks = GameLocks()
+local = threading.local()
+
+def locking_rows ():
+    '''
+    Whether game loads in the current move should lock the game row.
+    '''
+    return getattr(local, 'for_update', False)
+
+
+def atomic_moves ():
+    '''
+    Whether every move runs in a transaction, rather than only where
+    rows can be locked (settings.GAME_ATOMIC_MOVES).
+    '''
+    return getattr(settings, 'GAME_ATOMIC_MOVES', True) or connection.features.has_select_for_update
+
+
+@contextmanager
+def hold ( key, rows=True ):
+    '''
+    Hold a game's lock for the duration of a move, inside one transaction:
+    the move's writes, and those of anything else done holding the lock
+    (such as the notification's status write), are committed together,
+    once. Where the database can, the game's row is locked too. (A
+    resident in-memory game writes nothing until it is flushed, and has no
+    row to lock: the store is only for single-process deployments.)
+    '''
+    with locks.get(key):
+        if (not rows) or locking_rows() or store.enabled() or not atomic_moves():
+            yield
+            return
+
+        local.for_update = True
+        try:
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s), hashtext(%s))', key)
+                yield
+        finally:
+            local.for_update = False
+
+
+def after_commit ( fn ):
+    '''
+    Call `fn()` once the current move's transaction commits, or now if it
+    isn't in one: a resident game's move opens none, and may be running
+    on the event loop (see `games.aio`), where `transaction.on_commit`
+    isn't allowed to ask the database whether it is in autocommit.
+    '''
+    if connection.in_atomic_block:
+        transaction.on_commit(fn)
+    else:
+        fn()
+
+
+def hold_async ( key ):
+    '''
+    The asyncio lock for a game, for coroutines to serialize on before
+    handing a move to a worker thread.
+    '''
+    return locks.get_async(key)
+
+
+def game_move ( Game, rows=True ):
+    '''
+    Decorator for game logic entry points taking the game tag as their
+    first argument: runs each call holding that game's lock, journals what
+    it changes (see `games.journal`) and times it (see `games.metrics`).
+    Read-only entry points pass `rows=False` to skip locking the row and
+    journaling.
+    '''
+    app = Game._meta.app_label
+
+    def decorator ( fn ):
+        timed = metrics.logic(app, journal.recorder(Game, fn) if rows else fn)
+
+        @functools.wraps(fn)
+        def wrapper ( tag, *args, **kwargs ):
+            with hold((app, tag), rows=rows):
+                return timed(tag, *args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,271 @@
+'''
+Timing and SQL instrumentation of game requests and game logic.
+
+Each game page request is measured per (app, move): wall time, SQL
+queries made and time spent in them, time spent fanning the move out to
+the event channels, and response size. Each game logic entry point is
+measured per (app, function) for wall time and SQL. Everything is kept
+in process and served in Prometheus text format at /metrics/
+(settings.GAME_METRICS); with settings.GAME_METRICS_LOG every request also
+logs one JSON line.
+
+The metrics give away which games are being played and how, so /metrics/
+only answers staff users and the addresses in settings.GAME_METRICS_ALLOW
+(by default the local host, for a scraper on the same machine). Behind a
+proxy every request comes from the proxy's address: leave that out of
+GAME_METRICS_ALLOW, and restrict /metrics/ at the proxy instead.
+
+SQL is counted on the thread that runs it: the request's sample is found
+through a context variable, which follows the work from the async view
+into the worker thread that does it (see `games.aio`).
+'''
+import contextvars, functools, json, logging, threading, time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def enabled ():
+    return getattr(settings, 'GAME_METRICS', False)
+
+
+class Registry:
+    '''
+    Counters, gauges and histograms by name and label values.
+    '''
+    def __init__ ( self ):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def describe ( self, name, kind, text ):
+        self.help[name] = (kind, text)
+
+    def inc ( self, name, labels, value=1 ):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set ( self, name, labels, value ):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.gauges.setdefault(name, {})[key] = value
+
+    def observe ( self, name, labels, value ):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            counts = series.get(key)
+            if counts is None:
+                # one count per bucket, then the sum and count of all values
+                counts = series[key] = [0] * (len(BUCKETS) + 2)
+            for ii, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    counts[ii] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def clear ( self ):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def render ( self ):
+        '''
+        Everything in Prometheus text exposition format.
+        '''
+        def labelled ( name, key, extra=() ):
+            pairs = [ '%s="%s"' % (kk, str(vv).replace('\\', '\\\\').replace('"', '\\"')) for kk, vv in tuple(key) + tuple(extra) ]
+            return '%s{%s}' % (name, ','.join(pairs)) if pairs else name
+
+        lines = []
+        with self.lock:
+            for name in sorted(set(self.counters) | set(self.gauges) | set(self.histograms)):
+                kind, text = self.help.get(name, ('untyped', ''))
+                lines.append('# HELP %s %s' % (name, text))
+                lines.append('# TYPE %s %s' % (name, kind))
+                series = { **self.counters.get(name, {}), **self.gauges.get(name, {}) }
+                for key, value in sorted(series.items()):
+                    lines.append('%s %s' % (labelled(name, key), repr(value)))
+                for key, counts in sorted(self.histograms.get(name, {}).items()):
+                    for bound, count in zip(BUCKETS, counts):
+                        lines.append('%s %i' % (labelled(name + '_bucket', key, [('le', repr(bound))]), count))
+                    lines.append('%s %i' % (labelled(name + '_bucket', key, [('le', '+Inf')]), counts[-1]))
+                    lines.append('%s %s' % (labelled(name + '_sum', key), repr(counts[-2])))
+                    lines.append('%s %i' % (labelled(name + '_count', key), counts[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+registry.describe('game_requests_total', 'counter', 'Game page requests.')
+registry.describe('game_request_seconds', 'histogram', 'Wall time of game page requests.')
+registry.describe('game_request_queries_total', 'counter', 'SQL queries made by game page requests.')
+registry.describe('game_request_query_seconds_total', 'counter', 'Time spent in SQL by game page requests.')
+registry.describe('game_request_fanout_seconds_total', 'counter', 'Time game page requests spent sending events.')
+registry.describe('game_response_bytes_total', 'counter', 'Size of game page responses.')
+registry.describe('game_fanout_seconds', 'histogram', 'Time to send the events for one move.')
+registry.describe('game_logic_seconds', 'histogram', 'Wall time of game logic calls.')
+registry.describe('game_logic_queries_total', 'counter', 'SQL queries made by game logic calls.')
+registry.describe('game_logic_query_seconds_total', 'counter', 'Time spent in SQL by game logic calls.')
+
+
+class Sample:
+    '''
+    What one request or game logic call cost.
+    '''
+    __slots__ = ('queries', 'query_time', 'fanout_time')
+
+    def __init__ ( self ):
+        self.queries = 0
+        self.query_time = 0.0
+        self.fanout_time = 0.0
+
+
+# the sample of the request being handled, if any
+current = contextvars.ContextVar('game_metrics_sample', default=None)
+
+
+@contextmanager
+def counting ( sample ):
+    '''
+    Add SQL run on this thread's connection meanwhile to a sample.
+    '''
+    if sample is None:
+        yield
+        return
+
+    def wrapper ( execute, sql, params, many, context ):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            sample.queries += 1
+            sample.query_time += time.perf_counter() - started
+
+    with connection.execute_wrapper(wrapper):
+        yield
+
+
+def counted ( fn ):
+    '''
+    Wrap a function so the SQL it runs counts towards the current
+    request, wherever it is called from.
+    '''
+    @functools.wraps(fn)
+    def wrapper ( *args, **kwargs ):
+        with counting(current.get()):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def fanning_out ( app ):
+    '''
+    Time sending a move's events.
+    '''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        sample = current.get()
+        if sample is not None:
+            sample.fanout_time += elapsed
+        if enabled():
+            registry.observe('game_fanout_seconds', { 'app' : app }, elapsed)
+
+
+def logic ( app, fn ):
+    '''
+    Wrap a game logic entry point to record its wall time and SQL.
+    '''
+    @functools.wraps(fn)
+    def wrapper ( *args, **kwargs ):
+        if not enabled():
+            return fn(*args, **kwargs)
+
+        sample = Sample()
+        started = time.perf_counter()
+        try:
+            with counting(sample):
+                return fn(*args, **kwargs)
+        finally:
+            labels = { 'app' : app, 'function' : fn.__name__ }
+            registry.observe('game_logic_seconds', labels, time.perf_counter() - started)
+            registry.inc('game_logic_queries_total', labels, sample.queries)
+            registry.inc('game_logic_query_seconds_total', labels, sample.query_time)
+    return wrapper
+
+
+def instrument ( app, moves ):
+    '''
+    Decorator for an async game view taking `(request, tag)`: records the
+    request under its move, if it is one of `moves`, else as 'view'.
+    '''
+    def decorator ( view ):
+        @functools.wraps(view)
+        async def wrapper ( request, tag, *args, **kwargs ):
+            if not enabled():
+                return await view(request, tag, *args, **kwargs)
+
+            move = request.POST.get('move', None)
+            move = move if move in moves else 'view'
+
+            sample = Sample()
+            reset = current.set(sample)
+            started = time.perf_counter()
+            try:
+                response = await view(request, tag, *args, **kwargs)
+            finally:
+                current.reset(reset)
+            elapsed = time.perf_counter() - started
+
+            size = 0 if response.streaming else len(response.content)
+            labels = { 'app' : app, 'move' : move }
+            registry.inc('game_requests_total', labels)
+            registry.observe('game_request_seconds', labels, elapsed)
+            registry.inc('game_request_queries_total', labels, sample.queries)
+            registry.inc('game_request_query_seconds_total', labels, sample.query_time)
+            registry.inc('game_request_fanout_seconds_total', labels, sample.fanout_time)
+            registry.inc('game_response_bytes_total', labels, size)
+
+            if getattr(settings, 'GAME_METRICS_LOG', False):
+                logger.info(json.dumps({ 'app' : app, 'move' : move, 'tag' : tag, 'status' : response.status_code,
+                                         'seconds' : round(elapsed, 6), 'queries' : sample.queries,
+                                         'query_seconds' : round(sample.query_time, 6),
+                                         'fanout_seconds' : round(sample.fanout_time, 6), 'bytes' : size }))
+            return response
+        return wrapper
+    return decorator
+
+
+def allowed ( request ):
+    '''
+    Whether a request may see the metrics.
+    '''
+    user = getattr(request, 'user', None)
+    if (user is not None) and user.is_staff:
+        return True
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'GAME_METRICS_ALLOW', ('127.0.0.1', '::1'))
+
+
+def view ( request ):
+    '''
+    The metrics, for Prometheus to scrape.
+    '''
+    if not enabled():
+        raise Http404('metrics are disabled')
+    if not allowed(request):
+        # as if there were nothing here
+        raise Http404('metrics are not served to %s' % request.META.get('REMOTE_ADDR'))
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
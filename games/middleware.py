@@ -0,0 +1,37 @@
+'''
+Middleware for serving the site under ASGI.
+'''
+import asyncio
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    '''
+    WhiteNoise that can sit in an async middleware chain.
+
+    The stock middleware is sync-only, which makes Django run every request
+    through it (and everything below it) in its single shared sync thread,
+    async views included. Looking up a static file is a dict hit, so here
+    it just happens on the event loop and everything else is passed on.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__ ( self, get_response=None, *args, **kwargs ):
+        super().__init__(get_response, *args, **kwargs)
+        if asyncio.iscoroutinefunction(get_response):
+            # mark instances as coroutine functions, as Django's own middleware does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__ ( self, request ):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__ ( self, request ):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,181 @@
+'''
+The pages every game app shares: its index, and the game page, which
+shows a game and makes moves posted to it.
+
+Each app describes its own moves with a `GamePages` subclass: the names of
+the moves (`plays`) and how to make one from the fields posted for it
+(`play`). Joining, adding a bot, starting and destroying are the same for
+every game (see `games.core`), as is everything around a move:
+
+ * telling the table, in the move's transaction (`send_notification`,
+   see `games.aio`), by pushing the new state or a refresh ping once it
+   has committed (see `games.events`)
+ * poking the turn scheduler (see `games.scheduler`)
+ * answering from the state cache (see `games.snapshots`), with a 304 for
+   a client that already has the latest state
+ * recording each request in `games.metrics`
+
+The game page's moves are also made over a socket (see `games.consumers`).
+'''
+import json
+from django.shortcuts import render
+from .locks import hold, after_commit
+from .snapshots import cache
+from .scheduler import scheduler
+from . import aio, events, metrics
+
+# moves every game has, for seating players
+SEATING = ('join', 'add_bot', 'start')
+
+# what a notification writes
+STATUS_FIELDS = ('status', 'version', 'modified')
+
+
+class GamePages:
+    '''
+    The pages of one game app. Subclasses set `Game`, `logic` (the app's
+    game_logic module, built on a `games.core.Engine`), `session_key`,
+    where the player's token is kept in the session, and `plays`, and
+    implement `play`; `options` turns the fields posted to join into
+    options for a new game.
+    '''
+    Game = None
+    logic = None
+    session_key = None
+    plays = ()
+
+    def __init__ ( self ):
+        self.app = self.Game._meta.app_label
+        self.moves = SEATING + tuple(self.plays)
+        self.game = metrics.instrument(self.app, self.moves + ('destroy',))(self.game)
+
+        # moves made from the game page tell the table in the same transaction
+        aio.announce(self.Game, self.send_notification)
+        # and its stream follows the player in the session
+        events.identify(self.Game, self.session_key, self.logic.get_game_and_player)
+
+    def options ( self, data ):
+        return {}
+
+    async def play ( self, tag, token, action, data ):
+        '''
+        Make one of the app's own moves, from fields `data`, returning the
+        move's message and whether it went ahead.
+        '''
+        raise NotImplementedError
+
+    def send_notification ( self, request, tag, msg, action='refresh', game=None ):
+        '''
+        Tell everyone watching a game that it has changed, with a new
+        status `msg`: 'refresh' after a move, or 'index' once it has gone.
+        '''
+        logic = self.logic
+
+        # hold the game while writing status so as not to clobber a concurrent move
+        with hold((self.app, tag)):
+            # a move hands over the game it has just changed, rather than have it read again
+            if game is None:
+                game, _, _ = logic.get_game_and_player(tag, None)
+
+            if game is not None:
+                game.status = msg
+                cache.bump(game)
+                game.save(update_fields=STATUS_FIELDS)
+            else:
+                cache.forget(self.Game, tag)
+
+            # tell clients only once the move they are to look at has been committed
+            if (game is not None) and (action == 'refresh') and events.push_enabled():
+                # build every viewer's state once here, rather than have each client call back for it
+                after_commit(lambda: events.push_state(game, logic.visible_state))
+            else:
+                # send message irrespective of game existence, to notify destruction
+                after_commit(lambda: events.ping(self.Game, tag, action, None if game is None else game.version))
+
+    # index page: join a game
+    def index ( self, request ):
+        return render(request, '%s/index.html' % self.app, {})
+
+    async def act ( self, tag, token, action, data ):
+        '''
+        Make one of the `moves` for the player with `token`, from fields
+        `data` as the game page posts them. Returns the player's token (new
+        after joining), the move's message and whether it went ahead.
+        '''
+        logic = self.logic
+
+        if action == 'join':
+            nick = data.get('nick', None)
+            if nick is None:
+                return token, 'you must provide a valid nickname to join a game', False
+            joined, msg, notify = await logic.async_join(tag, nick, **self.options(data))
+            return joined or token, msg, notify
+
+        if action == 'add_bot':
+            # a seat played by the turn scheduler; whoever adds it stays who they were
+            nick = data.get('nick', None)
+            if nick is None:
+                return token, 'you must provide a nickname for the bot', False
+            _, msg, notify = await logic.async_join(tag, nick, automated=True)
+        elif action == 'start':
+            msg, notify = await logic.async_start(tag, token)
+        else:
+            msg, notify = await self.play(tag, token, action, data)
+        return token, msg, notify
+
+    async def destroy ( self, tag, token ):
+        '''
+        Destroy a game, sending everyone watching it back to the index.
+        '''
+        success, msg = await self.logic.async_destroy(tag, token)
+        if success:
+            await aio.call(self.Game, tag, self.send_notification, None, tag, msg, action='index')
+        return success, msg
+
+    # game page: view game state, optionally performing an action
+    async def game ( self, request, tag ):
+        action = request.POST.get('move', None)
+        token = request.session.get(self.session_key, request.POST.get('token', 'nobody'))
+        how = request.POST.get('how', None)
+        notify = False
+
+        if action=='join' and request.POST.get('nick', None) is None:
+            return render(request, '%s/index.html' % self.app, { 'msg' : 'you must provide a valid nickname to join a game' })
+
+        if action in self.moves:
+            joined, msg, notify = await self.act(tag, token, action, request.POST)
+            if joined != token:
+                request.session[self.session_key] = token = joined
+
+        elif action=='destroy':
+            success, msg = await self.destroy(tag, token)
+            if success:
+                return render(request, '%s/index.html' % self.app, { 'msg' : msg })
+        else:
+            msg = 'You are viewing this game as non-player.' if token=='nobody' else ''
+
+            if how == 'json':
+                # a refresh from a client that already has the latest state
+                response = cache.not_modified(request, self.Game, tag, token)
+                if response is not None:
+                    return response
+
+        if notify:
+            # the move has told the table already
+            scheduler.poke(self.Game, tag)
+            msg = ''
+
+        msg = msg or ''
+
+        entry = await cache.lookup_async(self.Game, self.logic.visible_state, tag, token)
+
+        if how == 'json':
+            return cache.respond(self.Game, tag, token, entry, msg)
+
+        state = dict(entry[1], msg=msg)
+        state['json_state'] = json.dumps(state)
+
+        # the page's stream finds the player for their own pushed state in the session
+        if ('nickname' in state) and (request.session.get(self.session_key) != token):
+            request.session[self.session_key] = token
+        return render(request, '%s/game.html' % self.app, state)
@@ -0,0 +1,72 @@
+'''
+Compact patches between two versions of a viewer's visible state.
+
+After a move, a viewer who has the state at the previous version only
+needs to hear what the move changed, e.g. one player's cash, the pool and
+the next player, rather than the whole table again. A patch is the list
+of changes, as paths into the state dict:
+
+    { 'base' : 4, 'version' : 5,
+      'ops' : [ [['pool'], 1], [['players', 2, 'cash'], 10], [['next_player'], 3] ] }
+
+An op with a value sets that path, an op without one removes it. Clients
+apply a patch only on top of its base version, and fetch the full state
+instead if they don't have that (see home/static/games/state-patch.js).
+'''
+import copy
+
+def diff ( old, new, path=() ):
+    '''
+    Ops turning state `old` into `new`. Dicts are compared key by key and
+    lists of the same length item by item; anything else that differs is
+    replaced whole.
+    '''
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key, value in new.items():
+            if key in old:
+                ops.extend(diff(old[key], value, path + (key,)))
+            else:
+                ops.append([list(path + (key,)), value])
+        for key in old:
+            if key not in new:
+                ops.append([list(path + (key,))])
+        return ops
+
+    if isinstance(old, list) and isinstance(new, list) and (len(old) == len(new)):
+        ops = []
+        for ii, (aa, bb) in enumerate(zip(old, new)):
+            ops.extend(diff(aa, bb, path + (ii,)))
+        return ops
+
+    if (type(old) == type(new)) and (old == new):
+        return []
+
+    return [[list(path), new]]
+
+
+def make_patch ( old, new, base, version ):
+    return { 'base' : base, 'version' : version, 'ops' : diff(old, new) }
+
+
+def apply ( state, patch ):
+    '''
+    Return a copy of `state` with a patch applied, as clients do.
+    '''
+    state = copy.deepcopy(state)
+    for op in patch['ops']:
+        path = op[0]
+        if not path:
+            state = copy.deepcopy(op[1])
+            continue
+
+        target = state
+        for key in path[:-1]:
+            target = target[key]
+
+        if len(op) > 1:
+            target[path[-1]] = copy.deepcopy(op[1])
+        else:
+            del target[path[-1]]
+
+    return state
@@ -0,0 +1,328 @@
+'''
+Publish/subscribe for game events across server processes.
+
+django_eventstream hands an event only to the streams connected to the
+process that sends it. With one server process that is everybody; with
+several sharing the load of the streams, settings.GAME_EVENT_BROKER names
+a broker that every event also goes through to reach the others:
+
+ * `redis://host:port` or `unix:///path/to.sock`: a Redis server, or
+   anything else speaking its protocol for PUBLISH and SUBSCRIBE, such as
+   the stand-in this module runs when there is no Redis to hand:
+
+       python -m games.pubsub unix:///tmp/games-events.sock
+
+ * None: events stay in the process that sends them, as before
+
+Each process sends its own events to its own streams straight away, as
+before, and publishes them on the broker's settings.GAME_EVENT_TOPIC
+channel for the others, ignoring them when they come back. The bus runs
+as tasks on the server's event loop, connecting when the process handles
+its first request (see `connecting`). Delivery is best effort, as it is
+for a stream that drops: a process that loses the broker logs it and
+reconnects, and its clients catch up when they next refresh.
+
+An event from another process also tells this one's state cache that the
+game has moved on (see `games.snapshots`).
+
+Streams wait for their events on the server's event loop, which doesn't
+notice them being queued from another thread (such as a move's worker
+thread, or the timer that sends a coalesced event) until something else
+wakes it. So events for this process's streams are always queued on the
+event loop (`local`).
+'''
+import asyncio, json, logging, os, sys, uuid
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+# this process, to know its own events when they come back
+ORIGIN = uuid.uuid4().hex
+
+# seconds to wait before reconnecting to the broker
+RETRY = 1.0
+
+
+def broker ():
+    return getattr(settings, 'GAME_EVENT_BROKER', None)
+
+
+def topic ():
+    return getattr(settings, 'GAME_EVENT_TOPIC', 'games')
+
+
+class BrokerError(Exception):
+    pass
+
+
+def encode ( value ):
+    '''
+    A value in the Redis protocol: bytes and strings as bulk strings,
+    lists as arrays.
+    '''
+    if isinstance(value, int):
+        return b':%i\r\n' % value
+    if isinstance(value, list):
+        return b'*%i\r\n' % len(value) + b''.join([ encode(vv) for vv in value ])
+    if isinstance(value, str):
+        value = value.encode()
+    return b'$%i\r\n%s\r\n' % (len(value), value)
+
+
+def command ( *args ):
+    return encode(list(args))
+
+
+async def read ( reader ):
+    '''
+    Read one value in the Redis protocol.
+    '''
+    line = await reader.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('broker connection closed')
+
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest.decode()
+    if kind == b'-':
+        raise BrokerError(rest.decode())
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        size = int(rest)
+        return None if size < 0 else (await reader.readexactly(size + 2))[:-2]
+    if kind == b'*':
+        count = int(rest)
+        return None if count < 0 else [ await read(reader) for ii in range(count) ]
+    raise BrokerError('unexpected reply %r' % line)
+
+
+async def connect ( url ):
+    parts = urlsplit(url)
+    if parts.scheme == 'unix':
+        return await asyncio.open_unix_connection(parts.path)
+    if parts.scheme == 'redis':
+        return await asyncio.open_connection(parts.hostname or 'localhost', parts.port or 6379)
+    raise ValueError('GAME_EVENT_BROKER must be a redis:// or unix:// URL, not %s' % url)
+
+
+async def subscribers ( url, channel ):
+    '''
+    How many connections are subscribed to a broker channel.
+    '''
+    reader, writer = await connect(url)
+    try:
+        writer.write(command('PUBSUB', 'NUMSUB', channel))
+        await writer.drain()
+        return (await read(reader))[1]
+    finally:
+        writer.close()
+
+
+class Bus:
+    '''
+    How this process's game events reach streams: its own on the server's
+    event loop, and everybody else's through the broker, with one
+    connection publishing its events and one subscribed to everybody's.
+    '''
+    def __init__ ( self ):
+        # the server's event loop, and the one connected to the broker from
+        self.home = None
+        self.loop = None
+        self.outbox = None
+        self.tasks = []
+
+    def start ( self ):
+        '''
+        Note the running event loop as the server's, and connect to the
+        broker from it, if there is a broker and we aren't already.
+        '''
+        loop = asyncio.get_running_loop()
+        self.home = loop
+        if (not broker()) or (self.loop is loop):
+            return
+        self.loop = loop
+        self.outbox = asyncio.Queue()
+        self.tasks = [ loop.create_task(self.publishing()), loop.create_task(self.subscribing()) ]
+
+    def stop ( self ):
+        for task in self.tasks:
+            task.cancel()
+        self.home = self.loop = None
+        self.tasks = []
+
+    def local ( self, fn, *args ):
+        '''
+        Call `fn(*args)`, which queues events for this process's streams,
+        on the server's event loop: straight away if this is it (or there
+        isn't one), else as soon as it gets to it.
+        '''
+        home = self.home
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if (home is None) or (home is running):
+            fn(*args)
+            return
+        try:
+            home.call_soon_threadsafe(fn, *args)
+        except RuntimeError:
+            # the event loop has gone away
+            self.home = None
+            fn(*args)
+
+    def forward ( self, app, tag, channel, event_type, data ):
+        '''
+        Publish an event already sent to this process's streams for the
+        other processes to send to theirs. Call from any thread.
+        '''
+        if self.loop is None:
+            return
+
+        message = json.dumps({ 'origin' : ORIGIN, 'app' : app, 'tag' : tag, 'channel' : channel,
+                               'type' : event_type, 'data' : data }, cls=DjangoJSONEncoder).encode()
+        try:
+            self.loop.call_soon_threadsafe(self.outbox.put_nowait, message)
+        except RuntimeError:
+            # the event loop has gone away
+            self.loop = None
+
+    async def publishing ( self ):
+        while True:
+            try:
+                reader, writer = await connect(broker())
+                try:
+                    while True:
+                        # send whatever has piled up in one go, then collect the replies
+                        batch = [ await self.outbox.get() ]
+                        while not self.outbox.empty():
+                            batch.append(self.outbox.get_nowait())
+                        writer.write(b''.join([ command('PUBLISH', topic(), mm) for mm in batch ]))
+                        await writer.drain()
+                        for mm in batch:
+                            await read(reader)
+                finally:
+                    writer.close()
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, BrokerError):
+                logger.warning('lost the event broker at %s: publishing again in %is', broker(), RETRY, exc_info=True)
+                await asyncio.sleep(RETRY)
+
+    async def subscribing ( self ):
+        while True:
+            try:
+                reader, writer = await connect(broker())
+                try:
+                    writer.write(command('SUBSCRIBE', topic()))
+                    await writer.drain()
+                    while True:
+                        reply = await read(reader)
+                        if reply[0] == b'message':
+                            self.receive(reply[2])
+                finally:
+                    writer.close()
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, BrokerError):
+                logger.warning('lost the event broker at %s: subscribing again in %is', broker(), RETRY, exc_info=True)
+                await asyncio.sleep(RETRY)
+
+    def receive ( self, message ):
+        '''
+        Send another process's event to this process's streams.
+        '''
+        from django_eventstream.consumers import get_listener_manager
+        from django_eventstream.event import Event
+        from .snapshots import cache
+
+        try:
+            event = json.loads(message)
+        except ValueError:
+            logger.warning('ignoring malformed game event %r', message[:100])
+            return
+        if event.get('origin') == ORIGIN:
+            return
+
+        cache.stale(event['app'], event['tag'])
+        channel = event['channel']
+        get_listener_manager().add_to_queues(channel, Event(channel, event['type'], event['data']))
+
+
+bus = Bus()
+
+
+def connecting ( application ):
+    '''
+    Wrap an ASGI application to have each request make sure the process is
+    connected to the event broker.
+    '''
+    def instance ( scope ):
+        inner = application(scope)
+
+        async def run ( receive, send ):
+            bus.start()
+            return await inner(receive, send)
+
+        return run
+
+    return instance
+
+
+class Broker:
+    '''
+    Stand-in for a Redis server's publish/subscribe: PUBLISH, SUBSCRIBE,
+    PUBSUB NUMSUB and PING, and nothing else.
+    '''
+    def __init__ ( self ):
+        self.subscribed = {}
+
+    async def serve ( self, url ):
+        parts = urlsplit(url)
+        if parts.scheme == 'unix':
+            if os.path.exists(parts.path):
+                os.unlink(parts.path)
+            return await asyncio.start_unix_server(self.handle, parts.path)
+        return await asyncio.start_server(self.handle, parts.hostname or 'localhost', parts.port or 6379)
+
+    async def handle ( self, reader, writer ):
+        channels = set()
+        try:
+            while True:
+                args = await read(reader)
+                name = args[0].upper()
+                if name == b'PUBLISH':
+                    targets = self.subscribed.get(args[1], set())
+                    for ww in targets:
+                        ww.write(encode([ b'message', args[1], args[2] ]))
+                    writer.write(encode(len(targets)))
+                elif name == b'SUBSCRIBE':
+                    for channel in args[1:]:
+                        self.subscribed.setdefault(channel, set()).add(writer)
+                        channels.add(channel)
+                        writer.write(encode([ b'subscribe', channel, len(channels) ]))
+                elif (name == b'PUBSUB') and (args[1].upper() == b'NUMSUB'):
+                    writer.write(encode(sum([ [ cc, len(self.subscribed.get(cc, ())) ] for cc in args[2:] ], [])))
+                elif name == b'PING':
+                    writer.write(b'+PONG\r\n')
+                else:
+                    writer.write(b'-ERR unknown command\r\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, BrokerError):
+            pass
+        finally:
+            for channel in channels:
+                self.subscribed[channel].discard(writer)
+            writer.close()
+
+
+async def serve ( url ):
+    server = await Broker().serve(url)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit('usage: python -m games.pubsub redis://host:port|unix:///path/to.sock')
+    asyncio.run(serve(sys.argv[1]))
@@ -1,6 +1,10 @@
 from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.sessions import SessionMiddlewareStack
+from games.pubsub import connecting
 import home.routing
 
-application = ProtocolTypeRouter({
+# each server process passes game events on to the others (see games/pubsub.py)
+application = connecting(ProtocolTypeRouter({
     'http': URLRouter(home.routing.urlpatterns),
-})
\ No newline at end of file
+    'websocket': SessionMiddlewareStack(URLRouter(home.routing.websocket_urlpatterns)),
+}))
@@ -0,0 +1,288 @@
+'''
+Background turns: moves for automated seats, and for players who sit on
+their turn too long.
+
+Nothing happens in a game unless something moves it, and without this
+that something is always a human's request. The scheduler runs as tasks
+on the server's event loop and is poked whenever a move has been made
+(the views call `poke` after notifying the table). For each poke it looks
+at who the game is waiting for now, which covers every way the turn
+passes on: starting, advancing, a new round, a card referred.
+
+ * if an automated seat (`Player.automated`) is to move, its move is
+   worked out in a pool of worker processes, so the thinking never holds
+   up the event loop, within settings.GAME_BOT_DEADLINE seconds; past
+   that a quick fallback move is played instead
+ * if only people are to move and settings.GAME_TURN_TIMEOUT is set, a
+   timer is armed for this version of the game; if it goes off with the
+   game unchanged, the first waiting player's move is made for them
+
+Either way the move goes through the app's game logic and
+`send_notification`, exactly as one made from the game page would, and
+the game is looked at again afterwards.
+
+Each app says how to play it with an `Autoplay` registered here (see the
+apps' `bots` modules). Queue depth, think time, deadline misses and moves
+made are recorded in `games.metrics`.
+'''
+import asyncio, logging, multiprocessing, os, time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from .loader import load_game, in_turn_order
+from .locks import hold
+from .metrics import registry
+from . import aio
+
+logger = logging.getLogger(__name__)
+
+# games looked at concurrently
+TASKS = 4
+
+registry.describe('scheduler_queue_depth', 'gauge', 'Games waiting for the turn scheduler to look at them.')
+registry.describe('scheduler_think_seconds', 'histogram', 'Time bots spent working out a move.')
+registry.describe('scheduler_deadline_misses_total', 'counter', 'Bot moves that overran their deadline.')
+registry.describe('scheduler_moves_total', 'counter', 'Moves made by the turn scheduler.')
+
+
+def enabled ():
+    return getattr(settings, 'GAME_SCHEDULER', False)
+
+
+def turn_timeout ():
+    return getattr(settings, 'GAME_TURN_TIMEOUT', None)
+
+
+def deadline ():
+    return getattr(settings, 'GAME_BOT_DEADLINE', 2.0)
+
+
+class Plan(namedtuple('Plan', 'fn args finish fallback')):
+    '''
+    How to make one move. `fn(*args)` runs in a worker process and
+    `finish` turns what it returns into the move for the game logic, as
+    `(name, kwargs)`; `fallback` is the move to make if that takes too
+    long. With no `fn` the fallback is simply played.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def just ( cls, name, **kwargs ):
+        return cls(None, (), None, (name, kwargs))
+
+
+class Autoplay:
+    '''
+    How the scheduler plays one game app: which players a game is waiting
+    for, and how to move for one of them. Subclasses set `Game`, `logic`
+    (the app's game_logic module) and `notify` (its views'
+    `send_notification`).
+    '''
+    Game = None
+    logic = None
+    notify = None
+
+    def waiting ( self, game, players ):
+        '''
+        The players, in turn order, any of whom the game is waiting on.
+        '''
+        raise NotImplementedError
+
+    def plan ( self, game, players, player ):
+        '''
+        A `Plan` for `player`'s move. Called holding the game, so anything
+        the plan needs from the game must be copied out of it here.
+        '''
+        raise NotImplementedError
+
+
+# what the scheduler found when it looked at a game
+Survey = namedtuple('Survey', 'version waiting token reason plan')
+
+
+class Scheduler:
+    def __init__ ( self ):
+        self.apps = {}
+        self.loop = None
+        self.queue = None
+        self.queued = set()
+        self.timers = {}
+        self.tasks = []
+        self.executor = None
+
+    def register ( self, autoplay ):
+        self.apps[autoplay.Game._meta.app_label] = autoplay
+
+    def start ( self ):
+        '''
+        Start the scheduler's tasks on the running event loop, if they
+        aren't already.
+        '''
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.queued = set()
+        self.timers = {}
+        self.tasks = [ loop.create_task(self.work()) for ii in range(TASKS) ]
+
+    def stop ( self ):
+        for task in self.tasks:
+            task.cancel()
+        for _, handle in self.timers.values():
+            handle.cancel()
+        self.loop = None
+        self.tasks = []
+        self.timers = {}
+
+    def pool ( self ):
+        '''
+        The worker processes bots think in, started on first use. They are
+        spawned rather than forked, as this process has threads and open
+        database connections that a fork would copy.
+        '''
+        if self.executor is None:
+            workers = getattr(settings, 'GAME_BOT_WORKERS', 0) or os.cpu_count() or 1
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def poke ( self, Game, tag, expired=None ):
+        '''
+        Have a game looked at again, e.g. after a move. Call from the event
+        loop. `expired` is the version of the game whose turn timer went off.
+        '''
+        if (not enabled()) or (Game._meta.app_label not in self.apps):
+            return
+        self.start()
+
+        job = (Game._meta.app_label, tag, expired)
+        if job in self.queued:
+            return
+        self.queued.add(job)
+        self.queue.put_nowait(job)
+        registry.set('scheduler_queue_depth', {}, self.queue.qsize())
+
+    async def work ( self ):
+        while True:
+            job = await self.queue.get()
+            self.queued.discard(job)
+            registry.set('scheduler_queue_depth', {}, self.queue.qsize())
+            try:
+                await self.turn(*job)
+            except Exception:
+                logger.exception('scheduled turn failed in %s game %s', job[0], job[1])
+            finally:
+                self.queue.task_done()
+
+    async def idle ( self ):
+        '''
+        Wait until every game poked has been looked at, along with any
+        poked in turn (but not for turn timers yet to go off).
+        '''
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def turn ( self, app, tag, expired ):
+        '''
+        Make the move the game is waiting on, if it is ours to make.
+        '''
+        autoplay = self.apps[app]
+        Game = autoplay.Game
+
+        survey = await aio.call(Game, tag, self.survey, autoplay, tag, expired)
+        if survey.plan is None:
+            if survey.waiting and turn_timeout():
+                self.arm(Game, tag, survey.version)
+            else:
+                self.disarm(app, tag)
+            return
+
+        move, kwargs = await self.think(app, survey.plan)
+        moved = await aio.call(Game, tag, self.apply, autoplay, tag, survey, move, kwargs)
+        if moved:
+            registry.inc('scheduler_moves_total', { 'app' : app, 'reason' : survey.reason })
+            self.poke(Game, tag)
+
+    def survey ( self, autoplay, tag, expired ):
+        '''
+        Who the game is waiting on, and the plan for the move to make for
+        them if it is ours to make.
+        '''
+        with hold((autoplay.Game._meta.app_label, tag), rows=False):
+            game, _, _ = load_game(autoplay.Game, tag)
+            if game is None:
+                return Survey(None, False, None, None, None)
+
+            players = in_turn_order(game)
+            waiting = autoplay.waiting(game, players)
+            automated = [ pp for pp in waiting if pp.automated ]
+            if automated:
+                player, reason = automated[0], 'automated'
+            elif waiting and (expired == game.version):
+                player, reason = waiting[0], 'timeout'
+            else:
+                return Survey(game.version, bool(waiting), None, None, None)
+
+            return Survey(game.version, True, str(player.token), reason, autoplay.plan(game, players, player))
+
+    async def think ( self, app, plan ):
+        '''
+        Carry out a plan in the worker pool, falling back on its quick move
+        if it overruns the deadline or fails.
+        '''
+        if plan.fn is None:
+            return plan.fallback
+
+        started = time.perf_counter()
+        try:
+            future = self.loop.run_in_executor(self.pool(), plan.fn, *plan.args)
+            return plan.finish(await asyncio.wait_for(future, deadline()))
+        except asyncio.TimeoutError:
+            registry.inc('scheduler_deadline_misses_total', { 'app' : app })
+            return plan.fallback
+        except BrokenProcessPool:
+            # a worker died: start afresh next time
+            logger.exception('bot worker pool broke in %s', app)
+            self.executor = None
+            return plan.fallback
+        except Exception:
+            logger.exception('bot failed to think of a move in %s', app)
+            return plan.fallback
+        finally:
+            registry.observe('scheduler_think_seconds', { 'app' : app }, time.perf_counter() - started)
+
+    def apply ( self, autoplay, tag, survey, move, kwargs ):
+        '''
+        Make a move through the game logic and tell the table, unless the
+        game has moved on since it was planned. All in one transaction.
+        '''
+        with hold((autoplay.Game._meta.app_label, tag)):
+            game, _, _ = load_game(autoplay.Game, tag)
+            if (game is None) or (game.version != survey.version):
+                return False
+
+            msg, ok = aio.announced(autoplay.Game, getattr(autoplay.logic, move), autoplay.notify)(tag, survey.token, **kwargs)
+            return ok
+
+    def arm ( self, Game, tag, version ):
+        '''
+        Set the turn timer for a version of a game, unless it is set already.
+        '''
+        key = (Game._meta.app_label, tag)
+        timer = self.timers.get(key)
+        if (timer is not None) and (timer[0] == version):
+            return
+        if timer is not None:
+            timer[1].cancel()
+        handle = self.loop.call_later(turn_timeout(), self.poke, Game, tag, version)
+        self.timers[key] = (version, handle)
+
+    def disarm ( self, app, tag ):
+        timer = self.timers.pop((app, tag), None)
+        if timer is not None:
+            timer[1].cancel()
+
+
+scheduler = Scheduler()
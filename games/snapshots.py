@@ -0,0 +1,182 @@
+'''
+Cache of built visible states, keyed by the game's state version.
+
+Every move that changes a game ends in the app's `send_notification`,
+which writes the new status and bumps the game's `version`. What a viewer
+sees is a function of the game and the viewer alone, so the state built
+for (game, version, viewer) and its JSON encoding stay good until the
+version moves on. The push of a move's new state fills the cache for
+every seat, so refreshes after a move mostly find their state ready.
+
+The latest version of each game is remembered as well, so a refresh from
+a client that sends back the ETag of the version it already has can be
+answered 304 Not Modified without loading the game at all. Another
+server process's move on a game (see `games.pubsub`) makes the version
+known here stale, so the next lookup reads the game again.
+'''
+import hashlib, json, threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags
+from . import aio
+from .loader import load_game
+
+class StateCache:
+    '''
+    Least recently used visible states, plus each game's latest version.
+    '''
+    def __init__ ( self ):
+        self.lock = threading.Lock()
+        self.versions = {}
+        self.states = OrderedDict()
+
+    def size ( self ):
+        return getattr(settings, 'STATE_CACHE_SIZE', 4096)
+
+    def version ( self, Game, tag ):
+        '''
+        The latest known version of a game, or None.
+        '''
+        with self.lock:
+            return self.versions.get((Game._meta.app_label, tag))
+
+    def bump ( self, game ):
+        '''
+        Move a game on to its next version. Call holding the game's lock,
+        before saving it.
+        '''
+        game.version += 1
+        with self.lock:
+            self.versions[(game._meta.app_label, game.tag)] = game.version
+
+    def get ( self, Game, tag, viewer ):
+        '''
+        The cached `(version, state, encoded)` for a viewer of the latest
+        version of a game, or None.
+        '''
+        app = Game._meta.app_label
+        with self.lock:
+            version = self.versions.get((app, tag))
+            key = (app, tag, version, viewer)
+            entry = self.states.get(key)
+            if entry is not None:
+                self.states.move_to_end(key)
+            return entry
+
+    def at ( self, game, version, viewer ):
+        '''
+        The cached `(version, state, encoded)` for a viewer of a particular
+        version of a loaded game, if it is still held, else None.
+        '''
+        with self.lock:
+            return self.states.get((game._meta.app_label, game.tag, version, viewer))
+
+    def put ( self, game, viewer, state ):
+        '''
+        Cache a viewer's state (built with an empty 'msg') of a loaded game
+        as its current version. Returns the new `(version, state, encoded)`.
+        '''
+        app = game._meta.app_label
+        entry = (game.version, state, json.dumps(state, cls=DjangoJSONEncoder))
+        with self.lock:
+            self.versions[(app, game.tag)] = game.version
+            self.states[(app, game.tag, game.version, viewer)] = entry
+            while len(self.states) > self.size():
+                self.states.popitem(last=False)
+        return entry
+
+    def stale ( self, app, tag ):
+        '''
+        Stop trusting the latest version known for a game, e.g. after
+        another process has moved it on.
+        '''
+        with self.lock:
+            self.versions.pop((app, tag), None)
+
+    def forget ( self, Game, tag ):
+        '''
+        Drop everything about a game, e.g. once it is destroyed.
+        '''
+        app = Game._meta.app_label
+        with self.lock:
+            self.versions.pop((app, tag), None)
+            for key in [ kk for kk in self.states if kk[:2] == (app, tag) ]:
+                del self.states[key]
+
+    def clear ( self ):
+        with self.lock:
+            self.versions.clear()
+            self.states.clear()
+
+    def lookup ( self, Game, visible_state, tag, viewer ):
+        '''
+        A viewer's state of a game as `(version, state, encoded)`, building
+        and caching it if need be. Call holding the game's lock. Errors
+        (e.g. no such game) come back uncached, with version None.
+        '''
+        entry = self.get(Game, tag, viewer)
+        if entry is not None:
+            return entry
+
+        game, _, _ = load_game(Game, tag)
+        if game is None:
+            return None, visible_state(tag, viewer), None
+
+        state = visible_state(tag, viewer, game=game)
+        state['msg'] = ''
+        return self.put(game, viewer, state)
+
+    async def lookup_async ( self, Game, visible_state, tag, viewer ):
+        '''
+        As `lookup`, from a coroutine: cache hits are served straight away,
+        misses wait their turn on the game.
+        '''
+        entry = self.get(Game, tag, viewer)
+        if entry is None:
+            entry = await aio.call(Game, tag, self.lookup, Game, visible_state, tag, viewer)
+        return entry
+
+    def etag ( self, Game, tag, version, viewer ):
+        '''
+        ETag for a viewer's state at a version. The viewer's token is
+        hashed in rather than shown.
+        '''
+        text = '%s:%s:%i:%s' % (Game._meta.app_label, tag, version, viewer)
+        return '"%s"' % hashlib.blake2b(text.encode(), digest_size=12).hexdigest()
+
+    def not_modified ( self, request, Game, tag, viewer ):
+        '''
+        A 304 response if the request's If-None-Match names the latest
+        version of the game for this viewer, else None.
+        '''
+        version = self.version(Game, tag)
+        if version is None:
+            return None
+
+        etag = self.etag(Game, tag, version, viewer)
+        if etag not in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            return None
+
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    def respond ( self, Game, tag, viewer, entry, msg ):
+        '''
+        JSON response for a looked up state, tagged with its version's ETag.
+        Without a message to add the cached encoding is sent as it is.
+        '''
+        version, state, encoded = entry
+        if msg or (encoded is None):
+            response = JsonResponse(dict(state, msg=msg))
+        else:
+            response = HttpResponse(encoded, content_type='application/json')
+
+        if version is not None:
+            response['ETag'] = self.etag(Game, tag, version, viewer)
+        return response
+
+
+cache = StateCache()
@@ -0,0 +1,17 @@
+'''
+SQLite backend whose transactions take the write lock up front.
+
+Every move runs in a transaction (see `games.locks`) that reads the game
+and then writes it. Under SQLite's default deferred BEGIN, two such
+transactions on different games can both read and then neither can go on
+to write ("database is locked"), as the busy timeout doesn't help a
+reader wait for a writer that is itself waiting. BEGIN IMMEDIATE makes
+each transaction wait its turn for the write lock before it reads
+anything instead.
+'''
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit ( self ):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -0,0 +1,291 @@
+'''
+Optional in-memory authority for live games, with write-behind persistence.
+
+With settings.GAME_STORE = 'memory', a game loaded through `games.loader`
+stays resident in this process as its model instances (the game plus its
+prefetched players), and later requests are served from that snapshot.
+Models that mix in `WriteBehindMixin` then only mark themselves dirty on
+`save()` while their game is resident; the dirty instances are written
+back in batches, one transaction per flush:
+
+ * on a timer, every settings.GAME_STORE_FLUSH_INTERVAL seconds
+ * promptly at round and game ends (see `checkpoint`)
+ * at interpreter shutdown
+
+Creating and deleting rows always goes straight to the database, except
+for rows that are only ever appended, such as journal entries (see
+`games.journal`), which are written in the same flushes. A new player
+joining a resident game evicts it (after flushing), so the next load
+picks up the new seat.
+
+This only makes sense for a single process serving all games.
+'''
+import atexit, logging, threading, time
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def game_key ( obj ):
+    '''
+    Store key of the game an instance belongs to: (app label, game tag).
+    Players carry their game's tag as `game_id`, games are keyed by it.
+    '''
+    return (obj._meta.app_label, getattr(obj, 'game_id', obj.pk))
+
+
+class GameStore:
+    '''
+    Resident games and their unsaved changes.
+    '''
+    def __init__ ( self ):
+        self.lock = threading.RLock()
+        # held for the whole of each flush, from taking its rows to committing them
+        self.flushing = threading.Lock()
+        self.games = {}
+        self.touched = {}
+        self.dirty = {}
+        self.appended = {}
+        self.wake = threading.Event()
+        self.flusher = None
+
+    def enabled ( self ):
+        return getattr(settings, 'GAME_STORE', 'database') == 'memory'
+
+    def interval ( self ):
+        return getattr(settings, 'GAME_STORE_FLUSH_INTERVAL', 2.0)
+
+    def get ( self, Game, tag ):
+        '''
+        Return the resident snapshot for a game, or None.
+        '''
+        key = (Game._meta.app_label, tag)
+        with self.lock:
+            game = self.games.get(key)
+            if game is not None:
+                self.touched[key] = time.monotonic()
+            return game
+
+    def put ( self, game ):
+        '''
+        Make a freshly loaded game (with players prefetched) resident.
+        '''
+        key = game_key(game)
+        with self.lock:
+            self.games[key] = game
+            self.touched[key] = time.monotonic()
+        self.start_flusher()
+
+    def holds ( self, obj ):
+        '''
+        Whether saves of an existing instance should be deferred.
+        '''
+        if obj._state.adding or not self.enabled():
+            return False
+        with self.lock:
+            return game_key(obj) in self.games
+
+    def mark_dirty ( self, obj ):
+        with self.lock:
+            self.dirty.setdefault(game_key(obj), set()).add(obj)
+
+    def append ( self, key, obj ):
+        '''
+        Queue a new row belonging to a resident game to be inserted with
+        the game's next flush.
+        '''
+        with self.lock:
+            self.appended.setdefault(key, []).append(obj)
+
+    def evict ( self, key, flush=True ):
+        '''
+        Drop a resident game, writing back its changes first unless told not to.
+        '''
+        if flush:
+            self.flush(key)
+        # wait for any flush under way to commit, so that deleting the game
+        # next finds every row it wrote
+        with self.flushing, self.lock:
+            self.games.pop(key, None)
+            self.touched.pop(key, None)
+            self.dirty.pop(key, None)
+            self.appended.pop(key, None)
+
+    def clear ( self ):
+        '''
+        Forget everything without writing back. For testing.
+        '''
+        with self.lock:
+            self.games.clear()
+            self.touched.clear()
+            self.dirty.clear()
+            self.appended.clear()
+
+    def checkpoint ( self, game ):
+        '''
+        Ask for a game's changes to be written back soon, e.g. at a round
+        end. Done by the flusher thread if there is one, otherwise inline.
+        '''
+        if self.flusher is None:
+            self.flush(game_key(game))
+        else:
+            self.wake.set()
+
+    def flush ( self, key=None ):
+        '''
+        Write back dirty instances, for one game or all of them, in a
+        single transaction with one bulk UPDATE per model, plus one bulk
+        INSERT per model of appended rows.
+        '''
+        with self.flushing:
+            return self.write_back(key)
+
+    def write_back ( self, key ):
+        # call holding the flushing lock
+        with self.lock:
+            keys = list(set(self.dirty) | set(self.appended)) if key is None else [key]
+            pending = { kk : self.dirty.pop(kk) for kk in keys if kk in self.dirty }
+            appended = { kk : self.appended.pop(kk) for kk in keys if kk in self.appended }
+
+        batches = {}
+        for objs in pending.values():
+            for obj in objs:
+                batches.setdefault(type(obj), []).append(obj)
+
+        inserts = {}
+        for objs in appended.values():
+            for obj in objs:
+                inserts.setdefault(type(obj), []).append(obj)
+
+        if not (batches or inserts):
+            return 0
+
+        try:
+            with transaction.atomic():
+                for model, objs in batches.items():
+                    bulk_update(model, objs)
+                for model, objs in inserts.items():
+                    model.objects.bulk_create(objs)
+        except Exception:
+            # put them back to be retried on the next flush
+            with self.lock:
+                for kk, objs in pending.items():
+                    self.dirty.setdefault(kk, set()).update(objs)
+                for kk, objs in appended.items():
+                    self.appended[kk] = objs + self.appended.get(kk, [])
+            raise
+
+        return sum([ len(objs) for objs in batches.values() ]) + sum([ len(objs) for objs in inserts.values() ])
+
+    def evict_idle ( self, idle ):
+        '''
+        Drop resident games with nothing to write back that have not been
+        touched for `idle` seconds.
+        '''
+        cutoff = time.monotonic() - idle
+        with self.lock:
+            stale = [ kk for kk, tt in self.touched.items() if (tt < cutoff) and (kk not in self.dirty) and (kk not in self.appended) ]
+            for kk in stale:
+                self.games.pop(kk, None)
+                self.touched.pop(kk, None)
+
+    def start_flusher ( self ):
+        '''
+        Start the background write-behind thread, if configured and not yet running.
+        '''
+        if (self.flusher is not None) or not self.interval():
+            return
+        with self.lock:
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self.run_flusher, name='game-store-flusher', daemon=True)
+                self.flusher.start()
+
+    def stop_flusher ( self ):
+        '''
+        Stop the write-behind thread, once it has written back what is
+        left. For testing.
+        '''
+        with self.lock:
+            flusher, self.flusher = self.flusher, None
+        if flusher is not None:
+            self.wake.set()
+            flusher.join()
+
+    def run_flusher ( self ):
+        me = threading.current_thread()
+        while True:
+            # with no interval (any more), only when woken
+            self.wake.wait(self.interval() or None)
+            self.wake.clear()
+            try:
+                self.flush()
+                self.evict_idle(getattr(settings, 'GAME_STORE_IDLE_TIMEOUT', 3600))
+            except Exception:
+                logger.exception('game store flush failed')
+            if self.flusher is not me:
+                connection.close()
+                return
+
+
+def bulk_update ( model, objs ):
+    '''
+    Write every field of existing instances of one model in one UPDATE.
+    '''
+    fields = [ ff for ff in model._meta.concrete_fields if not ff.primary_key ]
+    for obj in objs:
+        # keep auto_now timestamps behaving as they do under save()
+        for ff in fields:
+            setattr(obj, ff.attname, ff.pre_save(obj, False))
+    model.objects.bulk_update(objs, [ ff.name for ff in fields ])
+
+
+def save_all ( objs ):
+    '''
+    Save many existing instances together, e.g. every player at a round
+    change: deferred as usual while their game is resident, otherwise one
+    UPDATE per model, all in one transaction, rather than one per instance.
+    '''
+    batches = {}
+    for obj in objs:
+        if store.holds(obj):
+            store.mark_dirty(obj)
+        else:
+            batches.setdefault(type(obj), []).append(obj)
+
+    if batches:
+        with transaction.atomic():
+            for model, batch in batches.items():
+                bulk_update(model, batch)
+
+
+store = GameStore()
+
+@atexit.register
+def flush_on_exit ():
+    if store.dirty or store.appended:
+        store.flush()
+
+
+class WriteBehindMixin:
+    '''
+    Model mixin that defers saves of resident games to the store.
+    '''
+    def save ( self, *args, **kwargs ):
+        if store.holds(self):
+            store.mark_dirty(self)
+            return
+
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+
+        if adding and store.enabled():
+            # a new seat at a resident game: reload it next time
+            key = game_key(self)
+            if key[1] != self.pk:
+                store.evict(key)
+
+    def delete ( self, *args, **kwargs ):
+        if store.enabled():
+            store.evict(game_key(self), flush=False)
+        return super().delete(*args, **kwargs)
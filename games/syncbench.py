@@ -0,0 +1,127 @@
+'''
+Commit benchmark: how many times the database is synced to disk per move.
+
+    python -m games.syncbench --games 20
+
+On SQLite every commit is synced to disk (with the default
+`synchronous=FULL`), and a write made outside a transaction is a commit
+of its own. This plays whole games of each app against a fresh SQLite
+database in a temporary directory, the way the game pages do (each move
+through the game logic, then its notification), and counts the commits:
+once with settings.GAME_ATOMIC_MOVES off, where each save commits by
+itself, and once with it on, where a move and its status write commit
+together (see `games.locks`). It reports, per app and setting, commits
+and milliseconds per move.
+
+Moves are each seat's quick fallback move from the turn scheduler's
+`Autoplay` (see `games.scheduler`), so no bot thinking is timed.
+'''
+import argparse, os, tempfile, time
+
+# statements that don't commit anything by themselves
+READS = ('SELECT', 'BEGIN')
+
+# tables of this many players
+PLAYERS = { 'nothanks' : 5, 'skull' : 4, 'cockroach' : 4 }
+
+
+class Commits:
+    '''
+    Counts the commits made on a connection: explicit ones, and writes
+    made in autocommit mode.
+    '''
+    def __init__ ( self, connection ):
+        self.connection = connection
+        self.count = 0
+
+    def __call__ ( self, execute, sql, params, many, context ):
+        if (not self.connection.in_atomic_block) and not sql.lstrip().upper().startswith(READS):
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__ ( self ):
+        commit = self.connection.commit
+
+        def counted ():
+            self.count += 1
+            commit()
+
+        self.connection.commit = counted
+        self.wrapper = self.connection.execute_wrapper(self)
+        self.wrapper.__enter__()
+        return self
+
+    def __exit__ ( self, *exc ):
+        self.wrapper.__exit__(*exc)
+        del self.connection.commit
+
+
+def play ( autoplay, tag, players ):
+    '''
+    Play one game to the end, returning the number of moves made.
+    '''
+    from .aio import announced
+    from .loader import load_game, in_turn_order
+    from .locks import hold
+
+    Game, logic = autoplay.Game, autoplay.logic
+    tokens = [ announced(Game, logic.join)(tag, 'p%i' % ii)[0] for ii in range(players) ]
+    announced(Game, logic.start)(tag, tokens[0])
+
+    moves = 0
+    while moves < 2000:
+        with hold((Game._meta.app_label, tag), rows=False):
+            game, _, _ = load_game(Game, tag)
+            seats = in_turn_order(game)
+            waiting = autoplay.waiting(game, seats)
+            if not waiting:
+                break
+            player = waiting[0]
+            move, kwargs = autoplay.plan(game, seats, player).fallback
+
+        announced(Game, getattr(logic, move))(tag, str(player.token), **kwargs)
+        moves += 1
+
+    logic.destroy(tag, tokens[0])
+    return moves
+
+
+def run ( args ):
+    from django.db import connection
+    from django.test.utils import override_settings
+    from .scheduler import scheduler
+
+    for app in args.apps:
+        autoplay = scheduler.apps[app]
+        for atomic in (False, True):
+            with override_settings(GAME_ATOMIC_MOVES=atomic), Commits(connection) as commits:
+                started = time.perf_counter()
+                moves = sum([ play(autoplay, 'sb%s%i%i' % (app[:2], atomic, ii), PLAYERS[app]) for ii in range(args.games) ])
+                elapsed = time.perf_counter() - started
+
+            print('%-10s %-7s %i moves  %5.2f commits/move  %6.2f ms/move' % (
+                app, 'atomic' if atomic else 'per-save', moves, commits.count / moves, 1000 * elapsed / moves))
+
+
+def main ():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--games', type=int, default=10, help='games played per app and setting')
+    parser.add_argument('--apps', nargs='+', default=list(PLAYERS), choices=list(PLAYERS))
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'games.settings')
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    with tempfile.TemporaryDirectory() as tmp:
+        django.setup()
+        settings.DATABASES['default'] = { 'ENGINE' : 'games.sqlite3', 'NAME' : os.path.join(tmp, 'syncbench.sqlite3') }
+        settings.GAME_STORE = 'database'
+        settings.GAME_SCHEDULER = False
+        call_command('migrate', verbosity=0)
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
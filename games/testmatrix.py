@@ -0,0 +1,47 @@
+'''
+Run the test suites against each database backend in turn.
+
+    python -m games.testmatrix --postgres postgres://localhost/games [labels...]
+
+The suites run once on SQLite and once on PostgreSQL (the database the
+URL names is only used to connect: Django creates and drops a test_
+database beside it). Without --postgres, the GAME_TEST_DATABASE_URL
+environment variable is used, and failing that PostgreSQL is skipped.
+Any test labels are passed on to `manage.py test`. Exits non-zero if any
+backend's run fails.
+'''
+import argparse, os, subprocess, sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run ( name, url, labels ):
+    env = dict(os.environ)
+    env.pop('DATABASE_URL', None)
+    if url:
+        env['DATABASE_URL'] = url
+
+    print('== %s' % name, flush=True)
+    result = subprocess.run([ sys.executable, 'manage.py', 'test', '--noinput' ] + labels, cwd=BASE_DIR, env=env)
+    return result.returncode == 0
+
+
+def main ():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--postgres', default=os.environ.get('GAME_TEST_DATABASE_URL'), help='postgres:// URL to test against')
+    parser.add_argument('labels', nargs='*', help='test labels, e.g. nothanks')
+    args = parser.parse_args()
+
+    results = { 'sqlite' : run('sqlite', None, args.labels) }
+    if args.postgres:
+        results['postgres'] = run('postgres', args.postgres, args.labels)
+    else:
+        print('== postgres skipped: no --postgres or GAME_TEST_DATABASE_URL')
+
+    for name, ok in results.items():
+        print('%-10s %s' % (name, 'ok' if ok else 'FAILED'))
+    sys.exit(0 if all(results.values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
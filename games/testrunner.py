@@ -0,0 +1,22 @@
+'''
+Test runner for the game apps.
+
+Test cases wrap each test in a transaction on the test thread's database
+connection, which moves only see if they run on that thread too. So the
+tests make moves in Django's thread for synchronous code, rather than in
+the worker threads or on the event loop (see `games.aio`); tests of those
+turn them back on with `override_settings`.
+'''
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class GameTestRunner(DiscoverRunner):
+    def setup_test_environment ( self, **kwargs ):
+        super().setup_test_environment(**kwargs)
+        self.moves_here = override_settings(GAME_DB_THREADS=0, GAME_INLINE_MOVES=False)
+        self.moves_here.enable()
+
+    def teardown_test_environment ( self, **kwargs ):
+        self.moves_here.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,841 @@
+'''
+Tests of what the game apps share (see `games.core`, `games.pages` and the
+rest of this package). Most play No Thanks!, as any game would do; the
+query counts are checked for every game.
+'''
+import asyncio, http.client, os, shutil, socket, subprocess, sys, tempfile, threading, time
+from unittest import mock
+from urllib.parse import urlencode
+from django.conf import settings
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipIfDBFeature
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from channels.testing import WebsocketCommunicator
+from django_eventstream.consumers import get_listener_manager
+from django_eventstream.event import Event
+
+from nothanks.models import Game, Player, Move, INITIAL_CASH
+from nothanks import game_logic as GM, views
+from skull import game_logic as skull_logic, views as skull_views
+from cockroach import game_logic as cockroach_logic
+from .store import store
+from .snapshots import cache
+from .metrics import registry
+from .loader import in_turn_order, find_player, seated
+from .scheduler import scheduler
+from .journal import journal, capture
+from .syncbench import Commits
+from .routing import application
+from . import aio, events, locks, pubsub
+
+# every game app's logic
+GAMES = (GM, skull_logic, cockroach_logic)
+
+
+def session_with ( token, pages=views.pages ):
+    '''
+    A session cookie's value for player `token` of the game app with
+    `pages` (No Thanks! unless given).
+    '''
+    session = SessionStore()
+    session[pages.session_key] = token
+    session.save()
+    return session.session_key
+
+
+class QueryCountTests(TestCase):
+    '''
+    Loading a game should cost the same small number of queries however
+    many players are sitting at it, in every game.
+    '''
+    def make_game ( self, logic, tag, count ):
+        tokens = [ logic.join(tag, 'p%i' % ii)[0] for ii in range(count) ]
+        logic.start(tag, tokens[0])
+        return tokens
+    
+    def test_visible_state ( self ):
+        for logic in GAMES:
+            for count in (logic.MIN_PLAYERS, logic.MAX_PLAYERS):
+                with self.subTest(app=logic.Game._meta.app_label, players=count):
+                    tokens = self.make_game(logic, 'q%i' % count, count)
+                    
+                    # one for the game, one for all its players
+                    with self.assertNumQueries(2):
+                        logic.visible_state('q%i' % count, tokens[-1])
+                    with self.assertNumQueries(2):
+                        logic.visible_state('q%i' % count, 'nobody')
+    
+    def test_refresh_request ( self ):
+        for logic in GAMES:
+            app = logic.Game._meta.app_label
+            counts = []
+            for count in (logic.MIN_PLAYERS, logic.MAX_PLAYERS):
+                tokens = self.make_game(logic, 'r%i' % count, count)
+                
+                with CaptureQueriesContext(connection) as ctx:
+                    response = self.client.post('/%s/r%i/' % (app, count), { 'token' : tokens[-1], 'how' : 'json' })
+                
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['your_nickname'], 'p%i' % (count - 1))
+                counts.append(len(ctx.captured_queries))
+            
+            with self.subTest(app=app):
+                self.assertEqual(counts[0], counts[1])
+                self.assertLessEqual(counts[0], 3)
+    
+    # the journal reads a game again after a move adds a row
+    @override_settings(GAME_JOURNAL=False)
+    def test_join ( self ):
+        for logic in GAMES:
+            app = logic.Game._meta.app_label
+            with self.subTest(app=app):
+                logic.join('j', 'owner')
+                
+                # the players are loaded with the game, and the new one isn't read back
+                with CaptureQueriesContext(connection) as ctx:
+                    token, msg, notify = logic.join('j', 'p1')
+                self.assertTrue(notify)
+                sql = [ qq['sql'] for qq in ctx.captured_queries ]
+                self.assertEqual(len([ qq for qq in sql if qq.startswith('SELECT') and ' FROM "%s_player"' % app in qq ]), 1)
+                _, player, _ = logic.get_game_and_player('j', token)
+                self.assertEqual(player.nickname, 'p1')
+
+
+class NotificationTests(TestCase):
+    '''
+    A move's notification works from the game the move loaded.
+    '''
+    def make_game ( self, tag, count ):
+        tokens = [ GM.join(tag, 'p%i' % ii)[0] for ii in range(count) ]
+        GM.start(tag, tokens[0])
+        return tokens
+    
+    def test_notified_move ( self ):
+        self.make_game('n', 3)
+        game = Game.objects.get(pk='n')
+        leader = str(in_turn_order(game)[game.next_player].token)
+        
+        with CaptureQueriesContext(connection) as ctx:
+            msg, ok = aio.announced(Game, GM.pay)('n', leader, wallet=INITIAL_CASH)
+        self.assertTrue(ok)
+        
+        # the notification reuses the move's game, and writes only its status
+        sql = [ qq['sql'] for qq in ctx.captured_queries ]
+        self.assertEqual(len([ qq for qq in sql if qq.startswith('SELECT') and ' FROM "nothanks_game"' in qq ]), 1)
+        status = [ qq for qq in sql if qq.startswith('UPDATE "nothanks_game"') ][-1]
+        self.assertNotIn('"pool"', status)
+        self.assertEqual(Game.objects.get(pk='n').status, msg)
+
+
+class StateCacheTests(TestCase):
+    '''
+    Refreshing an unchanged game is answered from the state cache, or with
+    304 Not Modified if the client says it has the latest version.
+    '''
+    def tearDown ( self ):
+        cache.clear()
+    
+    def refresh ( self, token, etag=None ):
+        headers = {} if etag is None else { 'HTTP_IF_NONE_MATCH' : etag }
+        return self.client.post('/nothanks/c/', { 'token' : token, 'how' : 'json' }, **headers)
+    
+    def test_not_modified ( self ):
+        tokens = [ GM.join('c', 'p%i' % ii)[0] for ii in range(3) ]
+        GM.start('c', tokens[0])
+        
+        first = self.refresh(tokens[1])
+        self.assertEqual(first.status_code, 200)
+        
+        with self.assertNumQueries(0):
+            again = self.refresh(tokens[1])
+            unchanged = self.refresh(tokens[1], first['ETag'])
+        
+        self.assertEqual(again.content, first.content)
+        self.assertEqual(unchanged.status_code, 304)
+        
+        # someone else's view of the same version is a different entity
+        self.assertNotEqual(self.refresh(tokens[2])['ETag'], first['ETag'])
+        
+        state = first.json()
+        leader = tokens[int(state['players'][state['next_player']]['nickname'][1:])]
+        wallet = self.refresh(leader).json()['your_cash']
+        moved = self.client.post('/nothanks/c/', { 'token' : leader, 'how' : 'json', 'move' : 'pay', 'wallet' : wallet })
+        self.assertEqual(moved.json()['version'], state['version'] + 1)
+        
+        changed = self.refresh(tokens[1], first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['pool'], 1)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+    
+    def test_overtaken_push ( self ):
+        tokens = [ GM.join('o', 'p%i' % ii)[0] for ii in range(3) ]
+        GM.start('o', tokens[0])
+        views.send_notification(None, 'o', 'started')
+        before, _, _ = GM.get_game_and_player('o', None)
+        
+        # a push held back until after the next move leaves its version be
+        leader = str(in_turn_order(before)[before.next_player].token)
+        aio.announced(Game, GM.pay)('o', leader, wallet=INITIAL_CASH)
+        events.push_now(before, GM.visible_state)
+        self.assertEqual(cache.version(Game, 'o'), before.version + 1)
+        self.assertIsNone(cache.get(Game, 'o', 'nobody'))
+
+
+class PlayerTokenTests(TestCase):
+    '''
+    Moves find their player by token among the game's loaded players.
+    '''
+    def test_find_player ( self ):
+        tokens = [ GM.join('s', 'p%i' % ii)[0] for ii in range(3) ]
+        game, player, err = GM.get_game_and_player('s', tokens[1])
+        self.assertEqual((player.nickname, err), ('p1', None))
+        
+        # however the token is spelled, once per load
+        self.assertIs(find_player(game, tokens[1].upper())[0], player)
+        self.assertIs(game._seated[1], seated(game))
+        
+        # someone else's token is no use at this game
+        GM.join('t', 'other')
+        _, player, err = GM.get_game_and_player('t', tokens[1])
+        self.assertIsNone(player)
+        self.assertEqual(err, 'Player %s is not in game t' % tokens[1])
+        self.assertEqual(GM.get_game_and_player('t', 'nobody')[2], 'Invalid player token nobody')
+
+
+class StreamViewerTests(TestCase):
+    '''
+    A game page's stream follows the player in its session, never one
+    named in its URL.
+    '''
+    def channels ( self, tag, session ):
+        request = mock.Mock(scope={ 'session' : session })
+        return events.ViewerChannels().get_channels_for_request(request, { 'app' : 'nothanks', 'tag' : tag })
+
+    def test_viewer ( self ):
+        tokens = [ GM.join('v', 'p%i' % ii)[0] for ii in range(2) ]
+        GM.join('w', 'other')
+        key = views.pages.session_key
+
+        self.assertEqual(self.channels('v', { key : tokens[1] }), { 'v', 'v-%s' % tokens[1] })
+        # spectators: no player, or one from another game
+        self.assertEqual(self.channels('w', { key : tokens[1] }), { 'w', 'w-nobody' })
+        self.assertEqual(self.channels('v', {}), { 'v', 'v-nobody' })
+        self.assertEqual(self.channels('v', None), { 'v', 'v-nobody' })
+
+    def test_page_session ( self ):
+        token = GM.join('v', 'p0')[0]
+        self.client.post('/nothanks/v/', { 'token' : token })
+        self.assertEqual(self.client.session[views.pages.session_key], token)
+
+
+@override_settings(GAME_EVENT_COALESCE=0)
+class MetricsTests(TestCase):
+    '''
+    Requests and game logic calls are counted per move, SQL included.
+    '''
+    def setUp ( self ):
+        registry.clear()
+    
+    def tearDown ( self ):
+        cache.clear()
+    
+    def test_move_metrics ( self ):
+        tokens = [ GM.join('x', 'p%i' % ii)[0] for ii in range(3) ]
+        GM.start('x', tokens[0])
+        
+        state = GM.visible_state('x', 'nobody')
+        leader = tokens[int(state['players'][state['next_player']]['nickname'][1:])]
+        # the test's transaction never commits, so run what the move left for after commit
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/nothanks/x/', { 'token' : leader, 'how' : 'json', 'move' : 'pay', 'wallet' : INITIAL_CASH })
+        self.assertEqual(response.status_code, 200)
+        
+        labels = (('app', 'nothanks'), ('move', 'pay'))
+        self.assertEqual(registry.counters['game_requests_total'][labels], 1)
+        self.assertGreater(registry.counters['game_request_queries_total'][labels], 0)
+        self.assertEqual(registry.counters['game_response_bytes_total'][labels], len(response.content))
+        self.assertEqual(registry.histograms['game_fanout_seconds'][(('app', 'nothanks'),)][-1], 1)
+        
+        pay = (('app', 'nothanks'), ('function', 'pay'))
+        self.assertGreater(registry.counters['game_logic_queries_total'][pay], 0)
+        self.assertLessEqual(registry.counters['game_logic_queries_total'][pay], registry.counters['game_request_queries_total'][labels])
+        
+        text = self.client.get('/metrics/').content.decode()
+        self.assertIn('game_requests_total{app="nothanks",move="pay"} 1', text)
+        self.assertIn('game_logic_seconds_count{app="nothanks",function="pay"} 1', text)
+    
+    def test_metrics_restricted ( self ):
+        # only the local host and staff see them
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='203.0.113.9').status_code, 404)
+        with self.settings(GAME_METRICS_ALLOW=('203.0.113.9',)):
+            self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='203.0.113.9').status_code, 200)
+
+
+@override_settings(GAME_JOURNAL_SNAPSHOT_EVERY=4)
+class JournalTests(TestCase):
+    '''
+    Every move is journaled, and replaying the journal gives back the
+    game as its rows have it.
+    '''
+    def play ( self, tag, moves ):
+        tokens = { 'p%i' % ii : GM.join(tag, 'p%i' % ii)[0] for ii in range(3) }
+        GM.start(tag, tokens['p0'])
+        for ii in range(moves):
+            state = GM.visible_state(tag, 'nobody')
+            token = tokens[state['players'][state['next_player']]['nickname']]
+            if ii % 3:
+                msg, ok = GM.pay(tag, token, wallet=GM.visible_state(tag, token)['your_cash'])
+            else:
+                msg, ok = GM.take(tag, token, current_card=state['card'])
+            self.assertTrue(ok, msg)
+            views.send_notification(None, tag, msg)
+        return tokens
+    
+    def current ( self, tag ):
+        game = Game.objects.get(pk=tag)
+        return capture(game, in_turn_order(game))
+    
+    def test_history ( self ):
+        tokens = self.play('h', 6)
+        GM.pay('h', tokens['p0'], wallet=-1)
+        
+        history = journal.history(Game, 'h')
+        self.assertEqual([ hh['action'] for hh in history ][:4], [ 'join', 'join', 'join', 'start' ])
+        self.assertEqual(len(history), 10)
+        self.assertEqual(history[1]['actor'], 'p1')
+        self.assertTrue(history[-1]['status'].startswith(history[-1]['actor']))
+        # no tokens in the journal
+        self.assertFalse(any([ 'token' in hh['args'] for hh in history ]))
+    
+    def test_replay ( self ):
+        self.play('r', 9)
+        state, status, version = journal.replay(Game, 'r')
+        self.assertEqual(state, self.current('r'))
+        
+        # snapshots every so often, and older states replay too
+        entries = Move.objects.filter(game_id='r')
+        self.assertEqual(entries.count(), 13)
+        self.assertEqual(entries.filter(snapshot__isnull=False).count(), 4)
+        earlier, status, version = journal.replay(Game, 'r', upto=3)
+        self.assertEqual((status, version), (entries[6].status, 3))
+        self.assertNotEqual(earlier, state)
+    
+    def test_restore ( self ):
+        self.play('s', 5)
+        expected = self.current('s')
+        Game.objects.filter(pk='s').update(pool=0, next_player=0)
+        Player.objects.filter(game_id='s').update(cash=0)
+        
+        journal.restore(Game, 's')
+        self.assertEqual(self.current('s'), expected)
+
+
+@override_settings(GAME_STORE='memory', GAME_STORE_FLUSH_INTERVAL=0)
+class MemoryStoreTests(TestCase):
+    '''
+    With the in-memory store, moves on a resident game do no database
+    writes until the store is flushed.
+    '''
+    def tearDown ( self ):
+        store.clear()
+    
+    def test_write_behind ( self ):
+        tokens = [ GM.join('m', 'p%i' % ii)[0] for ii in range(3) ]
+        GM.start('m', tokens[0])
+        
+        game, _, _ = GM.get_game_and_player('m', tokens[0])
+        leader = str(GM.player_at(game, 0).token)
+        
+        with self.assertNumQueries(0):
+            msg, ok = GM.pay('m', leader, wallet=INITIAL_CASH)
+            self.assertTrue(ok, msg)
+            state = GM.visible_state('m', leader)
+        
+        self.assertEqual(state['pool'], 1)
+        self.assertEqual(state['next_player'], 1)
+        self.assertEqual(Game.objects.get(pk='m').pool, 0)
+        
+        store.flush()
+        
+        self.assertEqual(Game.objects.get(pk='m').pool, 1)
+        self.assertEqual(Player.objects.get(pk=leader).cash, INITIAL_CASH - 1)
+        self.assertEqual(Move.objects.filter(game_id='m').last().action, 'pay')
+    
+    def test_join_evicts ( self ):
+        GM.join('j', 'p0')
+        GM.join('j', 'p1')
+        GM.visible_state('j', 'nobody')
+        GM.join('j', 'p2')
+        
+        self.assertEqual(len(GM.visible_state('j', 'nobody')['players']), 3)
+
+
+class ConcurrentMoveTests(TransactionTestCase):
+    '''
+    Hammer many games with concurrent moves from several threads: no move
+    that reports success may be lost.
+    '''
+    GAMES = 6
+    THREADS = 4
+    ATTEMPTS = 5
+    
+    def tearDown ( self ):
+        store.clear()
+    
+    def hammer ( self, tag ):
+        '''
+        Repeatedly pay for whoever is next, as several clients might.
+        '''
+        paid = 0
+        try:
+            tokens = self.tokens[tag]
+            for ii in range(self.ATTEMPTS):
+                state = GM.visible_state(tag, tokens['p0'])
+                token = tokens[state['players'][state['next_player']]['nickname']]
+                wallet = GM.visible_state(tag, token)['your_cash']
+                msg, ok = GM.pay(tag, token, wallet=wallet)
+                paid += ok
+        finally:
+            connection.close()
+        
+        with self.lock:
+            self.paid[tag] += paid
+    
+    def run_games ( self ):
+        self.tokens = {}
+        for gg in range(self.GAMES):
+            tag = 's%i' % gg
+            self.tokens[tag] = { 'p%i' % ii : GM.join(tag, 'p%i' % ii)[0] for ii in range(3) }
+            GM.start(tag, self.tokens[tag]['p0'])
+        
+        self.lock = threading.Lock()
+        self.paid = { tag : 0 for tag in self.tokens }
+        threads = [ threading.Thread(target=self.hammer, args=(tag,)) for tag in self.tokens for ii in range(self.THREADS) ]
+        for tt in threads:
+            tt.start()
+        for tt in threads:
+            tt.join()
+        
+        store.flush()
+        
+        for tag in self.tokens:
+            game = Game.objects.get(pk=tag)
+            cash = sum([ pp.cash for pp in game.player_set.all() ])
+            self.assertGreater(self.paid[tag], 0)
+            self.assertEqual(game.pool, self.paid[tag])
+            self.assertEqual(cash + game.pool, 3 * INITIAL_CASH)
+            self.assertEqual(game.next_player, self.paid[tag] % 3)
+    
+    def test_database ( self ):
+        self.run_games()
+    
+    def test_across_processes ( self ):
+        # as if every thread were a server process of its own, sharing only the database
+        with mock.patch.object(locks.locks, 'get', lambda key: threading.RLock()):
+            self.run_games()
+    
+    @override_settings(GAME_STORE='memory', GAME_STORE_FLUSH_INTERVAL=0)
+    def test_memory_store ( self ):
+        self.run_games()
+
+
+class AtomicMoveTests(TransactionTestCase):
+    '''
+    A move and its notification's status write are committed together.
+    '''
+    def move ( self ):
+        tokens = [ GM.join('c', 'p%i' % ii)[0] for ii in range(3) ]
+        GM.start('c', tokens[0])
+        game = Game.objects.get(pk='c')
+        leader = in_turn_order(game)[game.next_player].token
+        
+        with Commits(connection) as commits:
+            msg, ok = aio.announced(Game, GM.pay)('c', str(leader), wallet=INITIAL_CASH)
+        self.assertTrue(ok)
+        
+        game = Game.objects.get(pk='c')
+        self.assertEqual(game.status, msg)
+        self.assertEqual(game.pool, 1)
+        return commits.count
+    
+    def test_one_commit ( self ):
+        self.assertEqual(self.move(), 1)
+    
+    # databases that lock rows always run moves in a transaction
+    @skipIfDBFeature('has_select_for_update')
+    @override_settings(GAME_ATOMIC_MOVES=False)
+    def test_per_save ( self ):
+        self.assertGreater(self.move(), 2)
+
+
+@override_settings(GAME_DB_THREADS=4, GAME_INLINE_MOVES=True)
+class AsyncMoveTests(TransactionTestCase):
+    '''
+    The same through the async entry points, with many coroutines on one
+    event loop: moves on a game are still applied one at a time.
+    '''
+    GAMES = 6
+    CLIENTS = 4
+    ATTEMPTS = 5
+    
+    def tearDown ( self ):
+        store.stop_flusher()
+        store.clear()
+    
+    async def hammer ( self, tag ):
+        paid = 0
+        tokens = self.tokens[tag]
+        for ii in range(self.ATTEMPTS):
+            state = await GM.async_visible_state(tag, tokens['p0'])
+            token = tokens[state['players'][state['next_player']]['nickname']]
+            wallet = (await GM.async_visible_state(tag, token))['your_cash']
+            msg, ok = await GM.async_pay(tag, token, wallet=wallet)
+            paid += ok
+        return tag, paid
+    
+    async def run_clients ( self ):
+        return await asyncio.gather(*[ self.hammer(tag) for tag in self.tokens for ii in range(self.CLIENTS) ])
+    
+    def run_games ( self ):
+        self.tokens = {}
+        for gg in range(self.GAMES):
+            tag = 'a%i' % gg
+            self.tokens[tag] = { 'p%i' % ii : GM.join(tag, 'p%i' % ii)[0] for ii in range(3) }
+            GM.start(tag, self.tokens[tag]['p0'])
+        
+        paid = { tag : 0 for tag in self.tokens }
+        for tag, count in asyncio.run(self.run_clients()):
+            paid[tag] += count
+        
+        store.flush()
+        
+        for tag in self.tokens:
+            game = Game.objects.get(pk=tag)
+            self.assertGreater(paid[tag], 0)
+            self.assertEqual(game.pool, paid[tag])
+            self.assertEqual(game.next_player, paid[tag] % 3)
+    
+    def test_database ( self ):
+        self.run_games()
+    
+    @override_settings(GAME_STORE='memory', GAME_STORE_FLUSH_INTERVAL=0)
+    def test_memory_store ( self ):
+        self.run_games()
+    
+    # resident games are played on the event loop, and the flusher writes them back
+    @override_settings(GAME_STORE='memory', GAME_STORE_FLUSH_INTERVAL=0.1)
+    def test_memory_store_flushing ( self ):
+        self.run_games()
+    
+    @override_settings(GAME_STORE='memory', GAME_STORE_FLUSH_INTERVAL=60)
+    def test_held_elsewhere ( self ):
+        GM.join('h', 'p0')
+        GM.visible_state('h', 'nobody')
+        where = lambda: threading.current_thread().name
+        
+        # a resident game is played on the loop, unless another thread holds it
+        self.assertEqual(asyncio.run(aio.call(Game, 'h', where)), threading.current_thread().name)
+        held, done = threading.Event(), threading.Event()
+        def hold ():
+            with locks.locks.get(('nothanks', 'h')):
+                held.set()
+                done.wait(10)
+        threading.Thread(target=hold).start()
+        held.wait(10)
+        try:
+            self.assertTrue(asyncio.run(aio.call(Game, 'h', where)).startswith('game-db'))
+        finally:
+            done.set()
+
+
+@override_settings(GAME_SCHEDULER=True, GAME_BOT_DEADLINE=0.5, GAME_BOT_WORKERS=1)
+class SchedulerTests(TransactionTestCase):
+    '''
+    The turn scheduler moves for automated seats, and for people who sit
+    on their turn, through the game logic.
+    '''
+    def setUp ( self ):
+        registry.clear()
+    
+    def tearDown ( self ):
+        cache.clear()
+    
+    def next_player ( self, tag ):
+        game = Game.objects.get(pk=tag)
+        return in_turn_order(game)[game.next_player]
+    
+    def test_automated ( self ):
+        token = GM.join('s', 'me')[0]
+        for nick in ('b1', 'b2'):
+            self.assertTrue(GM.join('s', nick, automated=True)[2])
+        GM.start('s', token)
+        if not self.next_player('s').automated:
+            GM.pay('s', token, wallet=INITIAL_CASH)
+        version = Game.objects.get(pk='s').version
+        
+        async def run ():
+            scheduler.poke(Game, 's')
+            await asyncio.wait_for(scheduler.idle(), 10)
+            scheduler.stop()
+        asyncio.run(run())
+        
+        # the bots moved until it was my turn, each move published once
+        moves = sum(registry.counters['scheduler_moves_total'].values())
+        self.assertFalse(self.next_player('s').automated)
+        self.assertGreater(moves, 0)
+        self.assertEqual(Game.objects.get(pk='s').version, version + moves)
+        self.assertEqual(registry.gauges['scheduler_queue_depth'][()], 0)
+        self.assertIn('scheduler_queue_depth 0', self.client.get('/metrics/').content.decode())
+    
+    def test_add_bot ( self ):
+        async def run ():
+            client = AsyncClient()
+            post = lambda **fields: client.post('/nothanks/ab/', urlencode(dict(fields, how='json')),
+                                                content_type='application/x-www-form-urlencoded')
+            token = (await post(move='join', nick='me')).json()['token']
+            
+            # seated from the page by a player, who stays who they were
+            for nick in ('b1', 'b2'):
+                self.assertEqual((await post(token=token, move='add_bot', nick=nick)).json()['your_nickname'], 'me')
+            state = (await post(token=token, move='start')).json()
+            if state['players'][state['next_player']]['nickname'] == 'me':
+                await post(token=token, move='pay', wallet=INITIAL_CASH)
+            
+            # the page's move pokes the scheduler, which plays the bots' turns
+            await asyncio.wait_for(scheduler.idle(), 10)
+            scheduler.stop()
+        asyncio.run(run())
+        
+        self.assertEqual(sorted(Player.objects.filter(game_id='ab', automated=True).values_list('nickname', flat=True)), ['b1', 'b2'])
+        self.assertEqual(self.next_player('ab').nickname, 'me')
+        self.assertGreater(sum(registry.counters['scheduler_moves_total'].values()), 0)
+    
+    def test_automated_join ( self ):
+        token, msg, notify = GM.join('none', 'b1', automated=True)
+        self.assertIsNone(token)
+        self.assertFalse(Game.objects.filter(pk='none').exists())
+    
+    @override_settings(GAME_TURN_TIMEOUT=0.1)
+    def test_turn_timeout ( self ):
+        tokens = [ GM.join('t', 'p%i' % ii)[0] for ii in range(3) ]
+        GM.start('t', tokens[0])
+        version = Game.objects.get(pk='t').version
+        
+        async def run ():
+            scheduler.poke(Game, 't')
+            # let the turn timer go off at least once
+            await asyncio.sleep(0.3)
+            await asyncio.wait_for(scheduler.idle(), 10)
+            scheduler.stop()
+        asyncio.run(run())
+        
+        moves = registry.counters['scheduler_moves_total'][(('app', 'nothanks'), ('reason', 'timeout'))]
+        self.assertGreaterEqual(moves, 1)
+        self.assertEqual(Game.objects.get(pk='t').version, version + moves)
+
+
+@override_settings(GAME_EVENT_COALESCE=0)
+class SocketTests(TransactionTestCase):
+    '''
+    Playing over a socket: moves are answered on it with the mover's state,
+    and everyone else's sockets are sent theirs.
+    '''
+    def tearDown ( self ):
+        cache.clear()
+    
+    def connect ( self, tag, token=None, pages=views.pages ):
+        headers = [ (b'origin', b'http://localhost') ]
+        if token:
+            headers.append((b'cookie', ('%s=%s' % (settings.SESSION_COOKIE_NAME, session_with(token, pages))).encode()))
+        return WebsocketCommunicator(application, '/ws/%s/%s/' % (pages.app, tag), headers=headers)
+    
+    async def reply ( self, ws ):
+        # pushes for the move may come first
+        while True:
+            sent = await ws.receive_json_from(timeout=5)
+            if sent['type'] == 'reply':
+                return sent
+    
+    def test_play ( self ):
+        tokens = [ GM.join('w', 'p%i' % ii)[0] for ii in range(3) ]
+        GM.start('w', tokens[0])
+        
+        async def run ():
+            spectator = self.connect('w')
+            self.assertTrue((await spectator.connect())[0])
+            seen = await spectator.receive_json_from()
+            self.assertNotIn('nickname', seen['data'])
+            
+            mover = self.connect('w', tokens[seen['data']['next_player']])
+            await mover.connect()
+            state = (await mover.receive_json_from())['data']
+            
+            await mover.send_json_to({ 'move' : 'pay', 'wallet' : state['your_cash'] })
+            reply = await self.reply(mover)
+            self.assertEqual((reply['move'], reply['data']['msg']), ('pay', ''))
+            self.assertEqual(reply['data']['version'], state['version'] + 1)
+            self.assertEqual(reply['data']['your_cash'], state['your_cash'] - 1)
+            
+            # the spectator is pushed the public view, whole or patched
+            pushed = await spectator.receive_json_from(timeout=5)
+            self.assertIn(pushed['type'], ('state', 'patch'))
+            
+            await mover.send_json_to({ 'move' : 'fold' })
+            self.assertEqual((await self.reply(mover))['data']['msg'], 'unknown move fold')
+            
+            # too late to join
+            await spectator.send_json_to({ 'move' : 'join', 'nick' : 'late' })
+            reply = await self.reply(spectator)
+            self.assertNotIn('token', reply)
+            self.assertEqual(reply['data']['msg'], 'Game w already in progress')
+            
+            for ws in (spectator, mover):
+                await ws.disconnect()
+            pubsub.bus.stop()
+        asyncio.run(run())
+        
+        self.assertEqual(Game.objects.get(pk='w').pool, 1)
+    
+    def test_join ( self ):
+        async def run ():
+            # only from our own pages
+            self.assertFalse((await WebsocketCommunicator(application, '/ws/nothanks/wj/').connect())[0])
+            
+            ws = self.connect('wj')
+            await ws.connect()
+            await ws.receive_json_from(timeout=5)
+            
+            await ws.send_json_to({ 'move' : 'join', 'nick' : 'me' })
+            reply = await self.reply(ws)
+            self.assertEqual(reply['data']['nickname'], 'me')
+            await ws.disconnect()
+            pubsub.bus.stop()
+            return reply['token']
+        token = asyncio.run(run())
+        
+        self.assertEqual(str(Player.objects.get(game_id='wj').token), token)
+    
+    def test_malformed_move ( self ):
+        tokens = [ skull_logic.join('wm', 'p%i' % ii)[0] for ii in range(3) ]
+        skull_logic.start('wm', tokens[0])
+        
+        async def run ():
+            ws = self.connect('wm', tokens[0], skull_views.pages)
+            await ws.connect()
+            await ws.receive_json_from(timeout=5)
+            
+            # fields no form would post are taken as bad choices
+            await ws.send_json_to({ 'move' : 'place', 'card' : None })
+            self.assertIn('out of range', (await self.reply(ws))['data']['msg'])
+            
+            # and anything else they upset is answered rather than closing the socket
+            with mock.patch.object(skull_views.pages, 'play', mock.AsyncMock(side_effect=TypeError('bad card'))):
+                await ws.send_json_to({ 'move' : 'place', 'card' : [] })
+                self.assertEqual((await self.reply(ws))['data']['msg'], 'invalid move place: bad card')
+            
+            await ws.send_json_to({ 'move' : 'refresh' })
+            self.assertEqual((await self.reply(ws))['data']['your_nickname'], 'p0')
+            await ws.disconnect()
+            pubsub.bus.stop()
+        asyncio.run(run())
+
+
+class SubscriptionTests(SimpleTestCase):
+    '''
+    Events queued for this process's streams, taken as a subscription.
+    '''
+    def test_next ( self ):
+        async def subscribe ():
+            subscription = events.Subscription([ 'sub', 'sub-nobody' ])
+            for channel in ('sub', 'other', 'sub-nobody'):
+                get_listener_manager().add_to_queues(channel, Event(channel, 'message', { 'text' : channel }))
+            queued, overflow = await subscription.next()
+            subscription.close()
+            return sorted([ event.data['text'] for event in queued ]), overflow, await subscription.next()
+        
+        self.assertEqual(asyncio.run(subscribe()), (['sub', 'sub-nobody'], False, None))
+
+
+class EventBrokerTests(SimpleTestCase):
+    '''
+    Two server processes sharing the event streams through the stand-in
+    broker: every stream gets every event, whichever process sent it.
+    '''
+    EVENTS = 5
+    STREAMS = 2
+    
+    def setUp ( self ):
+        self.tmp = tempfile.mkdtemp()
+        self.url = 'unix://%s' % os.path.join(self.tmp, 'events.sock')
+        self.ports = []
+        for ii in range(2):
+            with socket.socket() as ss:
+                ss.bind(('127.0.0.1', 0))
+                self.ports.append(ss.getsockname()[1])
+        
+        env = dict(os.environ, GAME_EVENT_BROKER=self.url)
+        self.processes = [ subprocess.Popen([ sys.executable, '-m', 'games.pubsub', self.url ]) ]
+        daphne = [ sys.executable, '-c', 'from daphne.cli import CommandLineInterface; CommandLineInterface.entrypoint()' ]
+        self.processes += [ subprocess.Popen(daphne + [ '-b', '127.0.0.1', '-p', str(port), 'games.asgi:application' ],
+                                             env=env, stderr=subprocess.DEVNULL) for port in self.ports ]
+        
+        # this process sends its events from an event loop of its own
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+    
+    def tearDown ( self ):
+        self.loop.call_soon_threadsafe(pubsub.bus.stop)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        for pp in self.processes:
+            pp.terminate()
+            pp.wait()
+        shutil.rmtree(self.tmp)
+    
+    def connect ( self, port ):
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+                conn.request('GET', '/events/fan/', headers={ 'Accept' : 'text/event-stream' })
+                return conn.getresponse()
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+    
+    def listen ( self, port, received, ready ):
+        response = self.connect(port)
+        while len(received) < self.EVENTS:
+            line = response.readline().decode().strip()
+            if line.startswith('event: stream-open'):
+                ready.release()
+            elif line.startswith('data:') and '"text"' in line:
+                received.append(line)
+    
+    def subscribers ( self ):
+        return asyncio.run_coroutine_threadsafe(pubsub.subscribers(self.url, pubsub.topic()), self.loop).result()
+    
+    def test_fan_out ( self ):
+        with override_settings(GAME_EVENT_BROKER=self.url):
+            ready = threading.Semaphore(0)
+            streams = [ (port, []) for port in self.ports for ii in range(self.STREAMS) ]
+            threads = [ threading.Thread(target=self.listen, args=(port, received, ready), daemon=True) for port, received in streams ]
+            for tt in threads:
+                tt.start()
+            for tt in threads:
+                self.assertTrue(ready.acquire(timeout=20))
+            
+            self.loop.call_soon_threadsafe(pubsub.bus.start)
+            deadline = time.monotonic() + 10
+            while self.subscribers() < 3:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.1)
+            
+            for ii in range(self.EVENTS):
+                events.ping(Game, 'fan', 'e%i' % ii)
+            for tt in threads:
+                tt.join(10)
+        
+        for port, received in streams:
+            self.assertEqual([ '"e%i"' % ii in line for ii, line in enumerate(received) ], [ True ] * self.EVENTS)
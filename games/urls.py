@@ -15,6 +15,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
+from games import metrics
 
 urlpatterns = [
     path('', include('home.urls')),
@@ -22,4 +23,5 @@ urlpatterns = [
     path('skull/', include('skull.urls')),
     path('nothanks/', include('nothanks.urls')),
     path('cockroach/', include('cockroach.urls')),
+    path('metrics/', metrics.view),
 ]
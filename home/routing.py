@@ -1,10 +1,31 @@
 from django.conf.urls import url, include
 from channels.routing import URLRouter
-from channels.http import AsgiHandler
 from channels.auth import AuthMiddlewareStack
 import django_eventstream
+import functools
+from django.core.asgi import get_asgi_application
+from nothanks.consumers import NoThanksConsumer
+from skull.consumers import SkullConsumer
+from cockroach.consumers import CockroachConsumer
+
+# Django's own ASGI handler, so async views run on the event loop
+# (channels' AsgiHandler runs every view in a thread). It speaks ASGI 3,
+# so adapt it to the two-step ASGI 2 interface channels routes with.
+django_application = get_asgi_application()
+
+def django_asgi ( scope ):
+    return functools.partial(django_application, scope)
 
 urlpatterns = [
+    # game page stream: the public game channel plus the session's viewer's own state channel (see games/events.py)
+    url(r'^events/(?P<app>nothanks|skull|cockroach)/(?P<tag>\w+)/', AuthMiddlewareStack(URLRouter(django_eventstream.routing.urlpatterns))),
     url(r'^events/(?P<tag>\w+)/', AuthMiddlewareStack(URLRouter(django_eventstream.routing.urlpatterns)), { 'format-channels' : [ '{tag}' ] }),
-    url(r'', AsgiHandler),
+    url(r'', django_asgi),
+]
+
+# game play over a socket (see games/consumers.py)
+websocket_urlpatterns = [
+    url(r'^ws/nothanks/(?P<tag>\w+)/$', NoThanksConsumer),
+    url(r'^ws/skull/(?P<tag>\w+)/$', SkullConsumer),
+    url(r'^ws/cockroach/(?P<tag>\w+)/$', CockroachConsumer),
 ]
@@ -0,0 +1,80 @@
+// Follow a game from its page (see games/consumers.py): over a socket at
+// /ws/<app>/<tag>/ where one can be opened, else, or once it has closed,
+// over the page's event stream with the moves posted as before.
+//
+// `handlers` has a function for each event the page follows, "state",
+// "patch" and "message", given the event's data, plus "reply", given the
+// state (or message) sent back for a move made over the socket, and
+// "refresh", to fetch the whole state when events may have been missed.
+// Returns the connection, whose send(fields) makes a move over the socket
+// and returns true, or returns false if the page should post it instead.
+function connect_game ( app, tag, handlers )
+{
+    var conn = { socket : null, stream : null };
+
+    function use_stream ()
+    {
+        if ( conn.stream ) return;
+
+        var es = conn.stream = new ReconnectingEventSource('/events/' + app + '/' + tag + '/');
+        ["message", "state", "patch"].forEach( function (type) {
+            es.addEventListener(type, function (e) { handlers[type](JSON.parse(e.data)); }, false);
+        });
+
+        // anything pushed while disconnected is lost, so catch up on reconnecting
+        var connected = false;
+        es.onopen = function (e) {
+            if ( connected )
+            {
+                handlers.refresh();
+            }
+            connected = true;
+        };
+
+        es.addEventListener('stream-reset', function (e) { console.log(e.data); }, false);
+    }
+
+    if ( !window.WebSocket )
+    {
+        use_stream();
+    }
+    else
+    {
+        var scheme = (window.location.protocol == "https:") ? "wss://" : "ws://";
+        var ws = new WebSocket(scheme + window.location.host + '/ws/' + app + '/' + tag + '/');
+
+        ws.onopen = function (e) { conn.socket = ws; };
+
+        // everything comes as {"type": ..., "data": ...}
+        ws.onmessage = function (e) {
+            var event = JSON.parse(e.data);
+            if ( event["type"] in handlers )
+            {
+                handlers[event["type"]](event["data"]);
+            }
+        };
+
+        // never opened, or dropped: go on over the stream, catching up on
+        // whatever happened since the socket's last event
+        ws.onclose = function (e) {
+            var was_open = (conn.socket === ws);
+            conn.socket = null;
+            use_stream();
+            if ( was_open )
+            {
+                handlers.refresh();
+            }
+        };
+    }
+
+    conn.send = function (fields) {
+        if ( !conn.socket || (conn.socket.readyState != WebSocket.OPEN) )
+        {
+            return false;
+        }
+        conn.socket.send(JSON.stringify(fields));
+        return true;
+    };
+
+    return conn;
+}
@@ -0,0 +1,42 @@
+// Apply a state patch pushed by the server (see games/patches.py) to a
+// game state object in place. Each op is [path, value] to set the value at
+// path, or [path] to remove it. Returns false, leaving the state alone, if
+// the patch doesn't follow on from the state's version: the caller should
+// fetch the whole state instead.
+function apply_state_patch ( state, patch )
+{
+    if ( state["version"] != patch["base"] )
+    {
+        return false;
+    }
+    
+    patch["ops"].forEach( function (op) {
+        var path = op[0];
+        
+        if ( path.length == 0 )
+        {
+            // the whole state replaced
+            Object.keys(state).forEach( function (key) { delete state[key]; } );
+            Object.assign(state, op[1]);
+            return;
+        }
+        
+        var target = state;
+        for ( var ii = 0; ii < path.length - 1; ii++ )
+        {
+            target = target[path[ii]];
+        }
+        
+        if ( op.length > 1 )
+        {
+            target[path[path.length - 1]] = op[1];
+        }
+        else
+        {
+            delete target[path[path.length - 1]];
+        }
+    });
+    
+    state["version"] = patch["version"];
+    return true;
+}
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class NothanksConfig(AppConfig):
     name = 'nothanks'
+
+    def ready(self):
+        # register how the turn scheduler plays this game
+        from . import bots
@@ -0,0 +1,41 @@
+'''
+Computer players for No Thanks!: how the turn scheduler (see
+`games.scheduler`) plays an automated or timed out seat, using the
+headless engine's policies (see `nothanks.engine`).
+'''
+from games.loader import player_at
+from games.scheduler import Autoplay, Plan, scheduler
+from .models import Game
+from . import engine
+from . import game_logic as GM
+from . import views
+
+
+class NoThanksAutoplay(Autoplay):
+    Game = Game
+    logic = GM
+    notify = staticmethod(views.send_notification)
+
+    # the engine policy bots play with
+    policy = 'rollout:16'
+
+    def waiting ( self, game, players ):
+        if game.stage == Game.Stage.PLAYING:
+            return [ player_at(game, game.next_player) ]
+        if game.stage == Game.Stage.ROUND_OVER:
+            # anyone may end the round
+            return players
+        return []
+
+    def plan ( self, game, players, player ):
+        if game.stage == Game.Stage.ROUND_OVER:
+            return Plan.just('end_round')
+
+        moves = { 'take' : { 'current_card' : game.card }, 'pay' : { 'wallet' : player.cash } }
+        if player.cash < 1:
+            return Plan.just('take', **moves['take'])
+        return Plan(engine.decide, (engine.Table.from_game(game, players), self.policy),
+                    lambda move: (move, moves[move]), ('take', moves['take']))
+
+
+scheduler.register(NoThanksAutoplay())
@@ -0,0 +1,6 @@
+from games.consumers import GameConsumer
+from . import views
+
+
+class NoThanksConsumer(GameConsumer):
+    pages = views.pages
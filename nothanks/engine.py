@@ -0,0 +1,381 @@
+'''
+Headless No Thanks!: the game's rules on plain ints, for bots and for
+simulating games in bulk.
+
+    python -m nothanks.engine --games 100000 --players 4 --policy greedy --policy rollout:8
+
+A `Table` holds a whole game without touching the database: hands are
+card bitmasks (as `CardSet` packs them) and the deck is a list already
+shuffled into drawing order. Taking, paying, turn passing under
+`house_rules` and scoring follow `nothanks.game_logic`, through the rules
+shared in `nothanks.rules`.
+
+Players are driven by policies, which pick 'take' or 'pay' whenever a
+player has the choice (a player with no tokens just takes):
+
+ * greedy: take when it costs no more than paying would
+ * threshold:N: take when it costs at most N points (6 by default)
+ * rollout:N: play each option out to the end of the round N times, on
+   decks dealt from the cards nobody can see, and pick the better one
+
+`simulate` plays many games across a process pool and reports wins and
+average points per seat's policy, with seats shuffled every game.
+'''
+import argparse, os, random, time
+from concurrent.futures import ProcessPoolExecutor
+from .rules import (MIN_PLAYERS, MAX_PLAYERS, DECK_MIN, DECK_MAX, DECK_SIZE, NUM_ROUNDS,
+                    INITIAL_CASH, hand_score, take_cost)
+
+# every card that can be in a deck, as a bitmask
+ALL_CARDS = ((1 << (DECK_MAX + 1)) - 1) ^ ((1 << DECK_MIN) - 1)
+
+
+class Table:
+    '''
+    One game of No Thanks!, seats numbered in turn order.
+    '''
+    __slots__ = ('hands', 'cash', 'points', 'deck', 'card', 'pool', 'next_player',
+                 'round', 'num_rounds', 'house_rules', 'rng')
+
+    def __init__ ( self, players, num_rounds=NUM_ROUNDS, house_rules=False, rng=None ):
+        self.points = [0] * players
+        self.round = 0
+        self.num_rounds = num_rounds
+        self.house_rules = house_rules
+        self.rng = rng or random.Random()
+        self.round_start()
+
+    @classmethod
+    def from_game ( cls, game, players ):
+        '''
+        A table as a stored game stands, with its players in turn order.
+        The face down cards are shuffled into a fresh drawing order.
+        '''
+        table = cls.__new__(cls)
+        table.hands = [ pp.hand.pack() for pp in players ]
+        table.cash = [ pp.cash for pp in players ]
+        table.points = [ pp.points for pp in players ]
+        table.deck = list(game.deck)
+        table.card = game.card
+        table.pool = game.pool
+        table.next_player = game.next_player
+        table.round = game.round
+        table.num_rounds = game.num_rounds
+        table.house_rules = game.house_rules
+        table.rng = random.Random()
+        table.rng.shuffle(table.deck)
+        return table
+
+    def copy ( self ):
+        table = Table.__new__(Table)
+        table.hands = list(self.hands)
+        table.cash = list(self.cash)
+        table.points = list(self.points)
+        table.deck = list(self.deck)
+        for name in ('card', 'pool', 'next_player', 'round', 'num_rounds', 'house_rules', 'rng'):
+            setattr(table, name, getattr(self, name))
+        return table
+
+    def round_start ( self, next_player=0 ):
+        count = len(self.points)
+        self.hands = [0] * count
+        self.cash = [INITIAL_CASH] * count
+        self.deck = self.rng.sample(range(DECK_MIN, DECK_MAX + 1), DECK_SIZE)
+        self.card = self.deck.pop()
+        self.pool = 0
+        self.next_player = next_player
+
+    @property
+    def round_over ( self ):
+        return not self.card
+
+    @property
+    def game_over ( self ):
+        return self.round >= self.num_rounds
+
+    def moves ( self ):
+        if not self.card:
+            return []
+        return ['take', 'pay'] if self.cash[self.next_player] > 0 else ['take']
+
+    def take ( self ):
+        seat = self.next_player
+        self.hands[seat] |= 1 << self.card
+        self.cash[seat] += self.pool
+        self.pool = 0
+        self.card = self.deck.pop() if self.deck else 0
+        if self.card and self.house_rules:
+            self.next_player = (seat + 1) % len(self.hands)
+
+    def pay ( self ):
+        seat = self.next_player
+        if self.cash[seat] < 1:
+            raise ValueError('seat %i has no tokens so cannot pay' % seat)
+        self.cash[seat] -= 1
+        self.pool += 1
+        self.next_player = (seat + 1) % len(self.hands)
+
+    def play ( self, move ):
+        if move == 'take':
+            self.take()
+        elif move == 'pay':
+            self.pay()
+        else:
+            raise ValueError('unknown move %r' % move)
+
+    def scores ( self ):
+        '''
+        Each seat's score for the round so far.
+        '''
+        return [ hand_score(hand, cash) for hand, cash in zip(self.hands, self.cash) ]
+
+    def end_round ( self ):
+        '''
+        Add the round's scores to the running points and deal the next
+        round, if any. Returns the round's scores.
+        '''
+        scores = self.scores()
+        self.points = [ pp + ss for pp, ss in zip(self.points, scores) ]
+        self.round += 1
+        if not self.game_over:
+            self.round_start(next_player=self.next_player)
+        return scores
+
+    def unseen ( self ):
+        '''
+        The cards nobody can see: those still in the deck, plus those left
+        out of it this round.
+        '''
+        seen = self.card and (1 << self.card)
+        for hand in self.hands:
+            seen |= hand
+        mask = ALL_CARDS & ~seen
+        return [ card for card in range(DECK_MIN, DECK_MAX + 1) if (mask >> card) & 1 ]
+
+    def determinize ( self, rng ):
+        '''
+        A copy with the deck dealt afresh from the unseen cards, so a
+        player's guesses can't peek at the real drawing order.
+        '''
+        table = self.copy()
+        table.deck = rng.sample(self.unseen(), len(self.deck))
+        table.rng = rng
+        return table
+
+    def winners ( self ):
+        best = min(self.points)
+        return [ seat for seat, pp in enumerate(self.points) if pp == best ]
+
+
+class Policy:
+    '''
+    Decides between taking and paying for the player whose turn it is.
+    '''
+    name = None
+
+    def seed ( self, seed ):
+        '''
+        Seed any randomness of the policy's own.
+        '''
+        pass
+
+    def choose ( self, table ):
+        raise NotImplementedError
+
+
+class Greedy(Policy):
+    '''
+    Take when it costs no more than the token paying would.
+    '''
+    name = 'greedy'
+
+    def choose ( self, table ):
+        cost = take_cost(table.hands[table.next_player], table.card, table.pool)
+        return 'take' if cost <= 1 else 'pay'
+
+
+class Threshold(Policy):
+    '''
+    Take when it costs at most `limit` points.
+    '''
+    name = 'threshold'
+
+    def __init__ ( self, limit=6 ):
+        self.limit = limit
+
+    def choose ( self, table ):
+        cost = take_cost(table.hands[table.next_player], table.card, table.pool)
+        return 'take' if cost <= self.limit else 'pay'
+
+
+class Rollout(Policy):
+    '''
+    Try both moves on `samples` guessed decks, playing the rest of the
+    round out with `base` for every seat, and pick the move that leaves
+    the mover furthest ahead of the others' average.
+    '''
+    name = 'rollout'
+
+    def __init__ ( self, samples=16, base=None, seed=None ):
+        self.samples = samples
+        self.base = base or Threshold()
+        self.rng = random.Random(seed)
+
+    def seed ( self, seed ):
+        self.rng.seed(seed)
+
+    def outcome ( self, table, move ):
+        seat = table.next_player
+        others = len(table.hands) - 1
+        total = 0
+        for ii in range(self.samples):
+            guess = table.determinize(self.rng)
+            guess.play(move)
+            play_round(guess, [self.base] * len(guess.hands))
+            scores = guess.scores()
+            total += scores[seat] - (sum(scores) - scores[seat]) / others
+        return total
+
+    def choose ( self, table ):
+        if self.outcome(table, 'take') <= self.outcome(table, 'pay'):
+            return 'take'
+        return 'pay'
+
+
+POLICIES = { pp.name : pp for pp in (Greedy, Threshold, Rollout) }
+
+
+def make_policy ( spec ):
+    '''
+    A policy from a spec such as 'greedy', 'threshold:4' or 'rollout:32'.
+    '''
+    name, _, args = spec.partition(':')
+    if name not in POLICIES:
+        raise ValueError('unknown policy %r (choose from %s)' % (name, ', '.join(sorted(POLICIES))))
+    return POLICIES[name](*[ int(aa) for aa in args.split(',') if aa ])
+
+
+def play_round ( table, policies ):
+    '''
+    Play the current round out, with one policy per seat.
+    '''
+    while table.card:
+        seat = table.next_player
+        if table.cash[seat] < 1:
+            table.take()
+        else:
+            table.play(policies[seat].choose(table))
+
+
+def play_game ( policies, num_rounds=NUM_ROUNDS, house_rules=False, rng=None ):
+    '''
+    Play a whole game, with one policy per seat. Returns the finished table.
+    '''
+    table = Table(len(policies), num_rounds=num_rounds, house_rules=house_rules, rng=rng)
+    while not table.game_over:
+        play_round(table, policies)
+        table.end_round()
+    return table
+
+
+def decide ( table, spec='greedy' ):
+    '''
+    The move a policy would make for whoever is next at a table: 'take',
+    'pay' or None if nobody is to move.
+    '''
+    moves = table.moves()
+    if len(moves) < 2:
+        return moves[0] if moves else None
+    return make_policy(spec).choose(table)
+
+
+def suggest ( game, players, spec='greedy' ):
+    '''
+    The move a policy would make for whoever is next in a stored game,
+    with its players in turn order: 'take', 'pay' or None if nobody is
+    to move.
+    '''
+    return decide(Table.from_game(game, players), spec)
+
+
+def run_batch ( specs, games, num_rounds, house_rules, seed ):
+    '''
+    Play a batch of games in this process, with the policies in `specs`
+    shuffled into new seats every game. Returns the total wins (shared
+    wins split) and points for each spec's place in the list.
+    '''
+    rng = random.Random(seed)
+    policies = [ make_policy(spec) for spec in specs ]
+    for pp in policies:
+        pp.seed(rng.getrandbits(64))
+    wins = [0.0] * len(specs)
+    points = [0] * len(specs)
+    seating = list(range(len(specs)))
+
+    for ii in range(games):
+        rng.shuffle(seating)
+        table = play_game([ policies[pp] for pp in seating ], num_rounds=num_rounds, house_rules=house_rules, rng=rng)
+        winners = table.winners()
+        for seat, pp in enumerate(seating):
+            points[pp] += table.points[seat]
+            if seat in winners:
+                wins[pp] += 1 / len(winners)
+
+    return wins, points
+
+
+def simulate ( specs, games, num_rounds=NUM_ROUNDS, house_rules=False, seed=None, workers=None, batch=1000 ):
+    '''
+    Play `games` games between the policies in `specs` (one per seat),
+    split into batches across a pool of `workers` processes (all CPUs by
+    default; 1 plays them here). Returns a list of (spec, win rate,
+    average points) in the order of `specs`.
+    '''
+    if not (MIN_PLAYERS <= len(specs) <= MAX_PLAYERS):
+        raise ValueError('need %i to %i policies, one per seat' % (MIN_PLAYERS, MAX_PLAYERS))
+
+    seeder = random.Random(seed)
+    sizes = [ min(batch, games - start) for start in range(0, games, batch) ]
+    jobs = [ (specs, size, num_rounds, house_rules, seeder.getrandbits(64)) for size in sizes ]
+
+    workers = workers or os.cpu_count() or 1
+    if (workers == 1) or (len(jobs) == 1):
+        results = [ run_batch(*job) for job in jobs ]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_batch, *zip(*jobs)))
+
+    wins = [ sum(ww) for ww in zip(*[ rr[0] for rr in results ]) ]
+    points = [ sum(pp) for pp in zip(*[ rr[1] for rr in results ]) ]
+    return [ (spec, ww / games, pp / games) for spec, ww, pp in zip(specs, wins, points) ]
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='Simulate games of No Thanks! between bots.')
+    parser.add_argument('--games', type=int, default=10000, help='games to play')
+    parser.add_argument('--players', type=int, default=0, help='players per game (default one per policy)')
+    parser.add_argument('--policy', action='append', help='policy for a seat, e.g. greedy, threshold:4, rollout:16 (repeatable, cycled to fill the seats)')
+    parser.add_argument('--rounds', type=int, default=NUM_ROUNDS, help='rounds per game')
+    parser.add_argument('--house-rules', action='store_true', help='pass the turn on after taking a card')
+    parser.add_argument('--workers', type=int, default=0, help='processes to use (default all CPUs)')
+    parser.add_argument('--batch', type=int, default=1000, help='games per batch handed to a worker')
+    parser.add_argument('--seed', type=int, default=None, help='seed for decks, seating and rollouts')
+    args = parser.parse_args()
+
+    specs = args.policy or ['greedy', 'threshold:3', 'threshold']
+    players = args.players or max(len(specs), MIN_PLAYERS)
+    specs = [ specs[ii % len(specs)] for ii in range(players) ]
+
+    started = time.monotonic()
+    results = simulate(specs, args.games, num_rounds=args.rounds, house_rules=args.house_rules,
+                       seed=args.seed, workers=args.workers or None, batch=args.batch)
+    elapsed = time.monotonic() - started
+
+    print('%i games of %i players in %.1fs (%.0f games/min)%s' % (args.games, players, elapsed, 60 * args.games / elapsed,
+                                                                  ', house rules' if args.house_rules else ''))
+    for spec, win_rate, points in results:
+        print('  %-14s wins %5.1f%%  points %6.1f' % (spec, 100 * win_rate, points))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+from django.db import migrations, models
+import random
+import games.cards
+from games.cards import CardSet
+
+
+def split_cards ( card_str ):
+    return [ int(x) for x in card_str.split(',') ] if card_str else []
+
+def pack_cards ( apps, schema_editor ):
+    '''
+    Convert comma-delimited card strings to bitmasks. The first card of
+    the deck is the one face up.
+    '''
+    Game = apps.get_model('nothanks', 'Game')
+    Player = apps.get_model('nothanks', 'Player')
+    
+    for game in Game.objects.all():
+        deck = split_cards(game.deck)
+        game.card = deck[0] if deck else 0
+        game.deck_packed = CardSet(deck[1:])
+        game.save(update_fields=['card', 'deck_packed'])
+    
+    for player in Player.objects.all():
+        player.hand_packed = CardSet(split_cards(player.hand))
+        player.save(update_fields=['hand_packed'])
+
+def unpack_cards ( apps, schema_editor ):
+    Game = apps.get_model('nothanks', 'Game')
+    Player = apps.get_model('nothanks', 'Player')
+    
+    for game in Game.objects.all():
+        deck = list(game.deck_packed)
+        random.shuffle(deck)
+        if game.card:
+            deck.insert(0, game.card)
+        game.deck = ','.join([ str(x) for x in deck ])
+        game.save(update_fields=['deck'])
+    
+    for player in Player.objects.all():
+        player.hand = ','.join([ str(x) for x in player.hand_packed ])
+        player.save(update_fields=['hand'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nothanks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='card',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='deck_packed',
+            field=games.cards.CardSetField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='hand_packed',
+            field=games.cards.CardSetField(default=0),
+        ),
+        migrations.RunPython(pack_cards, unpack_cards),
+        migrations.RemoveField(
+            model_name='game',
+            name='deck',
+        ),
+        migrations.RemoveField(
+            model_name='player',
+            name='hand',
+        ),
+        migrations.RenameField(
+            model_name='game',
+            old_name='deck_packed',
+            new_name='deck',
+        ),
+        migrations.RenameField(
+            model_name='player',
+            old_name='hand_packed',
+            new_name='hand',
+        ),
+    ]
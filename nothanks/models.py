@@ -1,10 +1,11 @@
 import uuid
 from django.db import models
+from games.store import WriteBehindMixin
+from games.journal import JournalEntry
+from games.cards import CardSet, CardSetField
+from .rules import INITIAL_CASH
 
-# this conceptually belongs in game_logic but is too tiresome to put there
-INITIAL_CASH = 11
-
-class Game(models.Model):
+class Game(WriteBehindMixin, models.Model):
     # games are identified by a user-specified tag, as with Codenames
     tag = models.CharField(max_length=32, primary_key=True)
     
@@ -15,6 +16,9 @@ class Game(models.Model):
     # the most recent game state notification message
     status = models.CharField(max_length=200, default='')
     
+    # bumped whenever the game's visible state changes, to key cached views of it
+    version = models.PositiveIntegerField(default=0)
+    
     # whether we're playing with the proper rules or the incorrect ones
     house_rules = models.BooleanField(default=False)
     
@@ -41,28 +45,33 @@ class Game(models.Model):
     stage = models.IntegerField(choices=Stage.choices, default=Stage.GATHERING)
     next_player = models.IntegerField(default=-1)
     
-    # once again, using strings for this is crappy
-    # but going full relational seems like overkill
-    deck = models.CharField(max_length = 100, default='')
+    # cards still face down, packed as a bitmask; the order they come up in
+    # is decided as each is drawn
+    deck = CardSetField(default=0)
+    
+    # the face up card on offer (0 when there isn't one)
+    card = models.IntegerField(default=0)
     pool = models.IntegerField(default=0)
     
     @classmethod
     def create(cls, tag, owner_nickname, num_rounds=3, house_rules=False):
         game = cls(tag=tag, num_rounds=num_rounds, house_rules=house_rules)
         game.save()
-        game.player_set.create(game=game, nickname=owner_nickname, owner=True)
-        return game
+        owner = game.player_set.create(game=game, nickname=owner_nickname, owner=True)
+        return game, owner
     
-    def round_start (self, deck, next_player=0):
+    def round_start (self, deck, next_player=0, save=True):
         self.stage = Game.Stage.PLAYING            
         self.next_player = next_player            
         self.pool = 0
         self.deck = deck
-        self.save()
+        self.card = self.deck.draw()
+        if save:
+            self.save()
        
     def advance_player (self):
         current = self.next_player
-        players = self.player_set.order_by('turn_order')
+        players = self.player_set.all()
         self.next_player = (current + 1) % len(players)
         self.save()
         
@@ -70,7 +79,7 @@ class Game(models.Model):
         return self.tag
     
 
-class Player(models.Model):
+class Player(WriteBehindMixin, models.Model):
     # each player has a unique token which is passed when moving
     # in order to validate their move
     token = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -84,9 +93,8 @@ class Player(models.Model):
     points = models.IntegerField(default=0)
     cash = models.IntegerField(default=INITIAL_CASH)
     
-    # using strings for this kinda sucks, but it's easier than trying
-    # to do proper data structures in DB tables, and the structs are very simple
-    hand = models.CharField(max_length = 100, default='')
+    # cards taken, packed as a bitmask
+    hand = CardSetField(default=0)
     
     # allocated on game start
     turn_order = models.IntegerField(default=-1)
@@ -94,23 +102,27 @@ class Player(models.Model):
     # first player to join a game gets to start it
     owner = models.BooleanField(default=False)
     
+    # moves for this seat are made by the turn scheduler (see games.scheduler)
+    automated = models.BooleanField(default=False)
+    
     def __str__(self):
         return self.nickname
     
-    def reset (self, turn_order=-1):
+    def reset (self, turn_order=-1, save=True):
         self.points = 0
-        self.hand = ''
+        self.hand = CardSet()
         self.cash = INITIAL_CASH
         self.turn_order = turn_order
-        self.save()
+        if save:
+            self.save()
     
-    def round_start (self):
-        self.hand = ''
+    def round_start (self, save=True):
+        self.hand = CardSet()
         self.cash = INITIAL_CASH
-        self.save()
-    
-    
-        
-    
-    
-    
\ No newline at end of file
+        if save:
+            self.save()
+
+
+class Move(JournalEntry):
+    # the game's append-only move journal (see games.journal)
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
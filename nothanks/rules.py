@@ -0,0 +1,63 @@
+'''
+No Thanks! rules that don't need the database, shared by the game logic
+and the headless engine (see `nothanks.engine`).
+'''
+import random
+from games.cards import CardSet
+
+MIN_PLAYERS = 3
+MAX_PLAYERS = 6
+DECK_MIN = 3
+DECK_MAX = 35
+DECK_SIZE = 24
+NUM_ROUNDS = 3
+INITIAL_CASH = 11
+
+# hand bitmasks are scored twelve bits at a time: LOW, MID and HIGH give
+# the sum of the bit positions set in each twelve bit value, as the lowest,
+# middle and highest twelve bits of a mask, which covers every card of the
+# standard deck in three lookups
+RUN_SUMS = [ [ sum([ ii + offset for ii in range(12) if (bits >> ii) & 1 ]) for bits in range(1 << 12) ]
+             for offset in (0, 12, 24) ]
+LOW, MID, HIGH = RUN_SUMS
+
+def make_deck ( count=DECK_SIZE, lo=DECK_MIN, hi=DECK_MAX ):
+    '''
+    Create the starting deck for a round.
+    '''
+    return CardSet(random.sample(range(lo, hi+1), count))
+
+
+def run_heads ( mask ):
+    '''
+    The lowest card of each continuous run in a hand bitmask, as a bitmask.
+    '''
+    return mask & ~(mask << 1)
+
+
+def hand_score ( mask, cash ):
+    '''
+    Score for a hand bitmask and the cash left with it: sum of the lowest
+    card values in each continuous run, minus remaining cash.
+    '''
+    # run_heads(mask), inline: this is called for every hand the bots weigh
+    heads = mask & ~(mask << 1)
+    if heads >> 36:
+        # cards past the standard deck, for a custom one
+        return sum([ ii for ii in range(heads.bit_length()) if (heads >> ii) & 1 ]) - cash
+    return LOW[heads & 0xfff] + MID[(heads >> 12) & 0xfff] + HIGH[heads >> 24] - cash
+
+
+def calculate_score ( player ):
+    '''
+    Calculate a player's score for a round, as:
+    sum of lowest card values in each continuous run, minus remaining cash.
+    '''
+    return hand_score(player.hand.pack(), player.cash)
+
+
+def take_cost ( mask, card, pool ):
+    '''
+    How much taking `card` and `pool` would change the score of a hand.
+    '''
+    return hand_score(mask | (1 << card), pool) - hand_score(mask, 0)
@@ -0,0 +1,147 @@
+'''
+Batch scoring of No Thanks! hands with array operations, for analysis
+tools that score far more hands than a game ever does.
+
+    python -m nothanks.scoring --hands 1000000
+
+Hands are rows of a boolean matrix with one column per card from
+DECK_MIN to DECK_MAX. A card starts a run when it is held and the card
+below it isn't, so the run starts of every hand come from one shifted
+comparison, and their values sum with one (int32) matrix product. The bitmasks
+the models and the engine keep (see `games.cards.CardSet`) convert to and
+from that form.
+'''
+import argparse, random, time
+import numpy as np
+from .rules import DECK_MIN, DECK_MAX, DECK_SIZE, MIN_PLAYERS, INITIAL_CASH, hand_score
+
+# card value of each column
+CARDS = np.arange(DECK_MIN, DECK_MAX + 1, dtype=np.int64)
+
+# the same for the run sums' product: a bool matrix times an int64 vector
+# misses numpy's fast matrix product, and every sum fits in 32 bits
+CARDS32 = CARDS.astype(np.int32)
+
+
+def from_masks ( masks ):
+    '''
+    Hand matrix from a sequence of hand bitmasks.
+    '''
+    masks = np.asarray(masks, dtype=np.uint64)
+    return ((masks[:, None] >> CARDS.astype(np.uint64)) & np.uint64(1)).astype(bool)
+
+
+def from_hands ( hands ):
+    '''
+    Hand matrix from a sequence of hands as card values.
+    '''
+    matrix = np.zeros((len(hands), len(CARDS)), dtype=bool)
+    for row, hand in enumerate(hands):
+        matrix[row, np.asarray(list(hand), dtype=np.int64) - DECK_MIN] = True
+    return matrix
+
+
+def to_masks ( matrix ):
+    '''
+    Hand bitmasks from a hand matrix.
+    '''
+    weights = np.left_shift(np.uint64(1), CARDS.astype(np.uint64))
+    return [ int(mask) for mask in (matrix.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64) ]
+
+
+def run_starts ( matrix ):
+    '''
+    Which held cards start a run, for each hand.
+    '''
+    starts = matrix.copy()
+    starts[:, 1:] &= ~matrix[:, :-1]
+    return starts
+
+
+def run_sums ( matrix ):
+    '''
+    Sum of the lowest card of each run, for each hand.
+    '''
+    return run_starts(matrix).astype(np.int32) @ CARDS32
+
+
+def scores ( matrix, cash ):
+    '''
+    Net score of each hand: its run sum less the cash left with it.
+    '''
+    return run_sums(matrix) - np.asarray(cash, dtype=np.int64)
+
+
+def loop_score ( cards, cash ):
+    '''
+    The card by card scoring the game logic used to do, on a sorted list
+    of cards, for comparison.
+    '''
+    score = 0
+    prev = -100
+    for card in cards:
+        if card > (prev + 1):
+            score += card
+        prev = card
+    return score - cash
+
+
+def random_hands ( count, players=MIN_PLAYERS, seed=None ):
+    '''
+    `count` hands as bitmasks, each a random share of a dealt deck, and
+    cash to go with them.
+    '''
+    rng = random.Random(seed)
+    size = DECK_SIZE // players
+    masks = []
+    for ii in range(count):
+        mask = 0
+        for card in rng.sample(range(DECK_MIN, DECK_MAX + 1), size):
+            mask |= 1 << card
+        masks.append(mask)
+    cash = [ rng.randint(0, 2 * INITIAL_CASH) for ii in range(count) ]
+    return masks, cash
+
+
+def benchmark ( count, seed=None ):
+    '''
+    Seconds taken to score `count` random hands card by card, by bitmask
+    and as a batch, checking they all agree.
+    '''
+    masks, cash = random_hands(count, seed=seed)
+    lists = [ [ card for card in CARDS.tolist() if (mask >> card) & 1 ] for mask in masks ]
+    # the batch is timed on its arrays alone
+    matrix = from_masks(masks)
+    cash_array = np.asarray(cash, dtype=np.int64)
+
+    timings = {}
+    started = time.perf_counter()
+    looped = [ loop_score(cards, cc) for cards, cc in zip(lists, cash) ]
+    timings['loop'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    masked = [ hand_score(mask, cc) for mask, cc in zip(masks, cash) ]
+    timings['bitmask'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = scores(matrix, cash_array)
+    timings['batch'] = time.perf_counter() - started
+
+    if (looped != masked) or (looped != batched.tolist()):
+        raise AssertionError('scoring methods disagree')
+    return timings
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='Compare ways of scoring No Thanks! hands.')
+    parser.add_argument('--hands', type=int, default=1000000, help='hands to score')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the hands')
+    args = parser.parse_args()
+
+    timings = benchmark(args.hands, seed=args.seed)
+    for name, elapsed in timings.items():
+        print('%-8s %8.3fs  %10.0f hands/sec  (%.1fx loop)' % (name, elapsed, args.hands / elapsed, timings['loop'] / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,72 @@
-from django.test import TestCase
+import random
+from django.test import SimpleTestCase, TestCase
 
-# Create your tests here.
+from games.loader import in_turn_order
+from .models import Game, INITIAL_CASH
+from . import game_logic as GM
+from . import engine, scoring
+from .rules import DECK_SIZE, hand_score
+
+
+class EngineTests(SimpleTestCase):
+    '''
+    The headless engine plays by the same rules as the game logic.
+    '''
+    def test_hand_score ( self ):
+        mask = sum([ 1 << card for card in (3, 4, 5, 10, 12, 13) ])
+        self.assertEqual(hand_score(mask, 2), 3 + 10 + 12 - 2)
+        self.assertEqual(hand_score(0, INITIAL_CASH), -INITIAL_CASH)
+    
+    def test_turn_passing ( self ):
+        for house_rules, after_take in ((False, 1), (True, 2)):
+            table = engine.Table(3, house_rules=house_rules, rng=random.Random(1))
+            table.pay()
+            table.take()
+            self.assertEqual(table.next_player, after_take)
+            self.assertEqual(table.cash[1], INITIAL_CASH + 1)
+            self.assertEqual(table.pool, 0)
+    
+    def test_play_game ( self ):
+        policies = [ engine.make_policy(spec) for spec in ('greedy', 'threshold:3', 'rollout:2') ]
+        table = engine.play_game(policies, num_rounds=1, rng=random.Random(7))
+        self.assertTrue(table.game_over)
+        
+        # every card was taken and every token is still on the table
+        self.assertEqual(sum([ bin(hand).count('1') for hand in table.hands ]), DECK_SIZE)
+        self.assertEqual(sum(table.cash), 3 * INITIAL_CASH)
+        self.assertEqual(table.points, table.scores())
+    
+    def test_simulate ( self ):
+        specs = ['greedy', 'threshold', 'threshold:0', 'threshold:12']
+        results = engine.simulate(specs, 50, seed=3, workers=1, batch=20)
+        self.assertEqual([ spec for spec, _, _ in results ], specs)
+        self.assertAlmostEqual(sum([ win_rate for _, win_rate, _ in results ]), 1.0)
+        self.assertEqual(results, engine.simulate(specs, 50, seed=3, workers=1, batch=20))
+    
+    def test_batch_scores ( self ):
+        masks, cash = scoring.random_hands(500, seed=5)
+        hands = [ [3, 4, 5, 10, 12, 13], [35], list(range(3, 36)), [] ]
+        masks += [ sum([ 1 << card for card in hand ]) for hand in hands ]
+        cash += [2, 0, 1, 11]
+        
+        matrix = scoring.from_masks(masks)
+        self.assertEqual(scoring.to_masks(matrix), masks)
+        self.assertTrue((scoring.from_hands(hands) == matrix[-4:]).all())
+        self.assertEqual(scoring.scores(matrix, cash).tolist(), [ hand_score(mm, cc) for mm, cc in zip(masks, cash) ])
+        self.assertEqual(scoring.run_sums(matrix[-4:]).tolist(), [25, 35, 3, 0])
+
+
+class BotTests(TestCase):
+    def test_suggest ( self ):
+        tokens = [ GM.join('b', 'p%i' % ii)[0] for ii in range(3) ]
+        GM.start('b', tokens[0])
+        game = Game.objects.get(pk='b')
+        players = in_turn_order(game)
+        
+        move = engine.suggest(game, players, 'rollout:2')
+        self.assertIn(move, ('take', 'pay'))
+        leader = str(players[game.next_player].token)
+        if move == 'take':
+            self.assertTrue(GM.take('b', leader, current_card=game.card)[1])
+        else:
+            self.assertTrue(GM.pay('b', leader, wallet=INITIAL_CASH)[1])
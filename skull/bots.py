@@ -0,0 +1,49 @@
+'''
+Computer players for Skull: how the turn scheduler (see
+`games.scheduler`) plays an automated or timed out seat, with the
+headless engine's search bot (see `skull.engine`).
+'''
+import random
+from games.loader import player_at
+from games.scheduler import Autoplay, Plan, scheduler, deadline
+from .models import Game
+from . import engine
+from . import game_logic as GM
+from . import views
+
+
+class SkullAutoplay(Autoplay):
+    Game = Game
+    logic = GM
+    notify = staticmethod(views.send_notification)
+
+    def waiting ( self, game, players ):
+        stage = game.stage
+        if stage == Game.Stage.STARTING:
+            # first cards go down all at once
+            return [ pp for pp in players if pp.alive and not len(pp.stack) ]
+        if stage in (Game.Stage.PLACING, Game.Stage.BIDDING, Game.Stage.FLIPPING):
+            return [ player_at(game, game.next_player) ]
+        if stage in (Game.Stage.FLIPPER_LOST, Game.Stage.FLIPPER_WON):
+            # anyone may end the round
+            return players
+        return []
+
+    def plan ( self, game, players, player ):
+        if game.stage in (Game.Stage.FLIPPER_LOST, Game.Stage.FLIPPER_WON):
+            return Plan.just('end_round')
+
+        table = engine.Table.from_game(game, players)
+        seat = player.turn_order
+        hand = list(player.hand)
+        nicknames = [ pp.nickname for pp in players ]
+
+        def finish ( move ):
+            return engine.move_args(move[0], move[1], hand, nicknames)
+
+        # leave the search time to get back before the deadline
+        return Plan(engine.think, (table.encode(), seat, deadline() / 2), finish,
+                    finish(engine.heuristic(table, seat, random.Random())))
+
+
+scheduler.register(SkullAutoplay())
@@ -0,0 +1,510 @@
+'''
+Headless Skull, and a bot to fill empty seats.
+
+    python -m skull.engine --games 50 --players 4 --budget 0.05
+
+A `Table` plays the rules of `skull.game_logic` on small ints alone: each
+seat's hand is a count of flowers and skulls, and its stack is packed as
+`CardStack` packs it (card i in bit i, below a sentinel bit), so a stored
+game converts straight across. `encode` squeezes a table into a tuple of
+ints, a header plus one 16 bit word per seat, which is what gets sent to
+worker processes.
+
+The bot (`Searcher`) picks moves by determinized Monte Carlo search: it
+deals the cards it can't see (other players' stacks and hands) at random,
+consistent with what it can see, tries each of its legal moves on that
+guess and plays the round out with a quick heuristic policy, and repeats
+until its time budget runs out. The move with the best average outcome
+for the round wins. `suggest_async` runs that search in a process pool,
+so a bot turn never holds up the event loop serving the game pages.
+'''
+import argparse, asyncio, os, random, time
+from concurrent.futures import ProcessPoolExecutor
+from .rules import MIN_PLAYERS, MAX_PLAYERS, WINNING_POINTS, FLOWER, SKULL, STARTING_FLOWERS, STARTING_SKULLS
+
+# game stages, numbered as skull.models.Game.Stage
+GATHERING, STARTING, PLACING, BIDDING, FLIPPING, FLIPPER_LOST, FLIPPER_WON, OVER = range(8)
+
+# the stages in which someone has to move
+ACTIVE = (STARTING, PLACING, BIDDING, FLIPPING)
+
+# the empty stack: just the sentinel bit
+EMPTY = 1
+
+# how good the end of a round is for a searching player
+VALUE_WON = 1.0
+VALUE_LOST = -1.0
+VALUE_OTHER_WON = -0.5
+VALUE_OTHER_LOST = 0.25
+VALUE_GAME = 2.0
+
+# seats packed into 16 bits: field name, shift, width
+SEAT_FIELDS = (('flowers', 0, 2), ('skulls', 2, 1), ('stacks', 3, 6), ('flips', 9, 3),
+               ('points', 12, 2), ('alive', 14, 1), ('passed', 15, 1))
+HEADER = ('stage', 'next_player', 'placed', 'bidder', 'bid', 'flipped', 'skuller', 'winner')
+
+
+def stack_size ( stack ):
+    return stack.bit_length() - 1
+
+
+def stack_push ( stack, card ):
+    size = stack.bit_length() - 1
+    return (stack ^ (1 << size)) | (card << size) | (1 << (size + 1))
+
+
+def stack_skulls ( stack ):
+    return bin(stack).count('1') - 1
+
+
+class Table:
+    '''
+    One game of Skull, seats numbered in turn order.
+    '''
+    __slots__ = HEADER + tuple([ name for name, _, _ in SEAT_FIELDS ])
+
+    def __init__ ( self, players ):
+        self.flowers = [STARTING_FLOWERS] * players
+        self.skulls = [STARTING_SKULLS] * players
+        self.stacks = [EMPTY] * players
+        self.flips = [0] * players
+        self.points = [0] * players
+        self.alive = [1] * players
+        self.passed = [0] * players
+        self.winner = -1
+        self.round_start(0)
+
+    @classmethod
+    def from_game ( cls, game, players ):
+        '''
+        A table as a stored game stands, with its players in turn order.
+        '''
+        table = cls.__new__(cls)
+        for name in HEADER:
+            setattr(table, name, int(getattr(game, name)))
+        hands = [ list(pp.hand) for pp in players ]
+        table.flowers = [ hand.count(FLOWER) for hand in hands ]
+        table.skulls = [ hand.count(SKULL) for hand in hands ]
+        table.stacks = [ pp.stack.pack() for pp in players ]
+        table.flips = [ pp.flipped for pp in players ]
+        table.points = [ pp.points for pp in players ]
+        table.alive = [ int(pp.alive) for pp in players ]
+        table.passed = [ int(pp.passed) for pp in players ]
+        return table
+
+    def encode ( self ):
+        '''
+        The table as a tuple of ints: the header, then a word per seat.
+        '''
+        seats = [0] * len(self.stacks)
+        for name, shift, _ in SEAT_FIELDS:
+            for seat, value in enumerate(getattr(self, name)):
+                seats[seat] |= value << shift
+        return tuple([ getattr(self, name) for name in HEADER ] + seats)
+
+    @classmethod
+    def decode ( cls, encoded ):
+        table = cls.__new__(cls)
+        for name, value in zip(HEADER, encoded):
+            setattr(table, name, value)
+        seats = encoded[len(HEADER):]
+        for name, shift, width in SEAT_FIELDS:
+            mask = (1 << width) - 1
+            setattr(table, name, [ (word >> shift) & mask for word in seats ])
+        return table
+
+    def copy ( self ):
+        table = Table.__new__(Table)
+        for name in HEADER:
+            setattr(table, name, getattr(self, name))
+        for name, _, _ in SEAT_FIELDS:
+            setattr(table, name, list(getattr(self, name)))
+        return table
+
+    def round_start ( self, next_player ):
+        self.stage = STARTING
+        self.next_player = next_player
+        self.placed = 0
+        self.bidder = -1
+        self.bid = 0
+        self.flipped = 0
+        self.skuller = -1
+        for seat, stack in enumerate(self.stacks):
+            skulls = stack_skulls(stack)
+            self.skulls[seat] += skulls
+            self.flowers[seat] += stack_size(stack) - skulls
+            self.stacks[seat] = EMPTY
+            self.flips[seat] = 0
+            self.passed[seat] = 0
+
+    def advance ( self ):
+        '''
+        Pass the turn to the next player still alive and bidding.
+        '''
+        count = len(self.stacks)
+        current = self.next_player
+        candidate = (current + 1) % count
+        while candidate != current:
+            if self.alive[candidate] and not self.passed[candidate]:
+                self.next_player = candidate
+                return True
+            candidate = (candidate + 1) % count
+        return False
+
+    def to_move ( self ):
+        '''
+        The seat that should move next, or -1 if nobody is to.
+        '''
+        if self.stage == STARTING:
+            # first cards go down all at once, so take them in turn order
+            count = len(self.stacks)
+            for ii in range(count):
+                seat = (self.next_player + ii) % count
+                if self.alive[seat] and (self.stacks[seat] == EMPTY):
+                    return seat
+            return -1
+        return self.next_player if self.stage in ACTIVE else -1
+
+    def legal ( self, seat ):
+        '''
+        The moves open to a seat, as (move, argument) pairs: ('place', card),
+        ('bid', count), ('decline', None) or ('flip', target seat).
+        '''
+        moves = []
+        if self.stage == STARTING:
+            if self.alive[seat] and (self.stacks[seat] == EMPTY):
+                moves = self.placings(seat)
+        elif seat != self.next_player:
+            pass
+        elif self.stage == PLACING:
+            moves = self.placings(seat) + [ ('bid', count) for count in range(1, self.placed + 1) ]
+        elif self.stage == BIDDING:
+            moves = [ ('bid', count) for count in range(self.bid + 1, self.placed + 1) ] + [('decline', None)]
+        elif self.stage == FLIPPING:
+            if self.flips[seat] < stack_size(self.stacks[seat]):
+                moves = [('flip', seat)]
+            else:
+                moves = [ ('flip', target) for target, stack in enumerate(self.stacks)
+                          if (target != seat) and (self.flips[target] < stack_size(stack)) ]
+        return moves
+
+    def placings ( self, seat ):
+        moves = []
+        if self.flowers[seat]:
+            moves.append(('place', FLOWER))
+        if self.skulls[seat]:
+            moves.append(('place', SKULL))
+        return moves
+
+    def play ( self, seat, move, arg ):
+        getattr(self, 'move_' + move)(seat, arg)
+
+    def move_place ( self, seat, card ):
+        if card == SKULL:
+            self.skulls[seat] -= 1
+        else:
+            self.flowers[seat] -= 1
+        self.stacks[seat] = stack_push(self.stacks[seat], card)
+        self.placed += 1
+
+        if self.stage == STARTING:
+            if not [ ss for ss, stack in enumerate(self.stacks) if self.alive[ss] and (stack == EMPTY) ]:
+                self.stage = PLACING
+        else:
+            self.advance()
+
+    def move_bid ( self, seat, count ):
+        self.bidder = seat
+        self.bid = count
+        if count < self.placed:
+            self.stage = BIDDING
+            self.advance()
+        else:
+            self.stage = FLIPPING
+
+    def move_decline ( self, seat, arg=None ):
+        self.passed[seat] = 1
+        self.advance()
+        if self.bidder == self.next_player:
+            self.stage = FLIPPING
+
+    def move_flip ( self, seat, target ):
+        if self.flips[seat] < stack_size(self.stacks[seat]):
+            # flippers turn over their own stack first
+            target = seat
+        self.flips[target] += 1
+        self.flipped += 1
+        stack = self.stacks[target]
+        if (stack >> (stack_size(stack) - self.flips[target])) & 1:
+            self.stage = FLIPPER_LOST
+            self.skuller = target
+        elif self.flipped == self.bid:
+            self.stage = FLIPPER_WON
+
+    def end_round ( self, rng ):
+        '''
+        Settle a finished round as the game logic does, the loser of a
+        flip giving up a card at random.
+        '''
+        flipper = self.next_player
+        if self.stage == FLIPPER_LOST:
+            stack = self.stacks[flipper]
+            skulls = self.skulls[flipper] + stack_skulls(stack)
+            cards = self.flowers[flipper] + stack_size(stack) + self.skulls[flipper]
+            self.flowers[flipper] = cards - skulls
+            self.skulls[flipper] = skulls
+            self.stacks[flipper] = EMPTY
+            if rng.randrange(cards) < skulls:
+                self.skulls[flipper] -= 1
+            else:
+                self.flowers[flipper] -= 1
+
+            if not (self.flowers[flipper] + self.skulls[flipper]):
+                self.alive[flipper] = 0
+                if sum(self.alive) == 1:
+                    self.stage = OVER
+                    self.winner = self.skuller
+                    return
+                self.round_start(self.skuller)
+                if not self.alive[self.next_player]:
+                    self.advance()
+            else:
+                self.round_start(self.skuller)
+
+        elif self.stage == FLIPPER_WON:
+            self.points[flipper] += 1
+            if self.points[flipper] >= WINNING_POINTS:
+                self.stage = OVER
+                self.winner = flipper
+            else:
+                self.round_start(flipper)
+
+    def determinize ( self, seat, rng ):
+        '''
+        A copy with every other player's hidden cards dealt at random,
+        consistent with what `seat` can see: how many cards each holds and
+        has stacked, and which of their stack have been turned over (all
+        flowers, while the round goes on). A player who has lost cards may
+        or may not have lost their skull; one who still has it may have it
+        anywhere unseen.
+        '''
+        table = self.copy()
+        for other in range(len(self.stacks)):
+            if (other == seat) or not self.alive[other]:
+                continue
+            stack = self.stacks[other]
+            size = stack_size(stack)
+            hand = self.flowers[other] + self.skulls[other]
+            unseen = size - self.flips[other]
+            cards = hand + size
+
+            skull = -1
+            if (hand + unseen) and ((cards >= STARTING_FLOWERS + STARTING_SKULLS)
+                                    or (rng.randrange(STARTING_FLOWERS + STARTING_SKULLS) < cards)):
+                skull = rng.randrange(hand + unseen)
+
+            # keep any skull already turned over, else deal flowers around the skull
+            shown = stack & ~((1 << unseen) - 1)
+            if skull < 0 or (shown ^ (1 << size)):
+                table.stacks[other] = shown
+                table.skulls[other] = 0
+            elif skull < unseen:
+                table.stacks[other] = shown | (1 << skull)
+                table.skulls[other] = 0
+            else:
+                table.stacks[other] = shown
+                table.skulls[other] = 1
+            table.flowers[other] = hand - table.skulls[other]
+        return table
+
+
+def heuristic ( table, seat, rng ):
+    '''
+    A quick policy for playouts and for easy bots: place at random, bid
+    about what its own stack can cover, flip others at random.
+    '''
+    moves = table.legal(seat)
+    stage = table.stage
+    if stage == FLIPPING:
+        return rng.choice(moves)
+
+    # flowers in its own stack are flips it can count on
+    stack = table.stacks[seat]
+    safe = 0 if stack_skulls(stack) else stack_size(stack)
+    placings = [ mm for mm in moves if mm[0] == 'place' ]
+
+    if stage == STARTING:
+        return rng.choice(placings)
+
+    if stage == PLACING:
+        if placings and (rng.random() < 0.6):
+            return rng.choice(placings)
+        return ('bid', max(1, min(safe, table.placed)))
+
+    if (table.bid < max(safe, 1)) or (rng.random() < 0.25):
+        return moves[0]
+    return ('decline', None)
+
+
+def playout ( table, seat, rng ):
+    '''
+    Play a round out with the heuristic policy, and say how it went for
+    `seat`.
+    '''
+    while table.stage in ACTIVE:
+        mover = table.to_move()
+        table.play(mover, *heuristic(table, mover, rng))
+
+    flipper = table.next_player
+    if table.stage == FLIPPER_WON:
+        value = VALUE_WON if flipper == seat else VALUE_OTHER_WON
+        if table.points[flipper] + 1 >= WINNING_POINTS:
+            value *= VALUE_GAME
+        return value
+    if table.stage == FLIPPER_LOST:
+        return VALUE_LOST if flipper == seat else VALUE_OTHER_LOST
+    return 0.0
+
+
+class Searcher:
+    '''
+    Chooses moves by determinized Monte Carlo search within a time budget.
+    '''
+    def __init__ ( self, budget=0.5, max_playouts=5000, seed=None ):
+        self.budget = budget
+        self.max_playouts = max_playouts
+        self.rng = random.Random(seed)
+
+    def choose ( self, table, seat ):
+        moves = table.legal(seat)
+        if len(moves) < 2:
+            return moves[0] if moves else None
+
+        totals = [0.0] * len(moves)
+        counts = [0] * len(moves)
+        deadline = time.perf_counter() + self.budget
+        playouts = 0
+        while (playouts < self.max_playouts) and ((playouts < len(moves)) or (time.perf_counter() < deadline)):
+            ii = playouts % len(moves)
+            guess = table.determinize(seat, self.rng)
+            guess.play(seat, *moves[ii])
+            totals[ii] += playout(guess, seat, self.rng)
+            counts[ii] += 1
+            playouts += 1
+
+        best = max(range(len(moves)), key=lambda ii: totals[ii] / counts[ii])
+        return moves[best]
+
+
+def think ( encoded, seat, budget, seed=None ):
+    '''
+    Search from an encoded table, for running in a worker process.
+    '''
+    return Searcher(budget=budget, seed=seed).choose(Table.decode(encoded), seat)
+
+
+def move_args ( move, arg, hand, nicknames ):
+    '''
+    A chosen move as the game logic wants it: its name and keyword
+    arguments, given the mover's hand as a list of cards and everyone's
+    nicknames in turn order.
+    '''
+    if move == 'place':
+        return 'place', { 'card' : hand.index(arg) }
+    if move == 'bid':
+        return 'bid', { 'count' : arg }
+    if move == 'flip':
+        return 'flip', { 'nickname' : nicknames[arg] }
+    return move, {}
+
+
+_pool = None
+
+def pool ( workers=None ):
+    '''
+    The worker processes bots think in, started on first use.
+    '''
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+    return _pool
+
+
+async def suggest_async ( game, players, seat, budget=0.5 ):
+    '''
+    The move the bot would make for a seat of a stored game, with its
+    players in turn order, thought out in the worker pool. Returns the
+    move's name and keyword arguments, or None if the seat has no move.
+    '''
+    table = Table.from_game(game, players)
+    if not table.legal(seat):
+        return None
+    loop = asyncio.get_running_loop()
+    move, arg = await loop.run_in_executor(pool(), think, table.encode(), seat, budget)
+    return move_args(move, arg, list(players[seat].hand), [ pp.nickname for pp in players ])
+
+
+def play_game ( players, searchers, rng ):
+    '''
+    Play a whole game, with a `Searcher` in the seats given in `searchers`
+    and the heuristic policy in the rest. Returns the winning seat.
+    '''
+    table = Table(players)
+    while table.stage != OVER:
+        if table.stage in ACTIVE:
+            seat = table.to_move()
+            if seat in searchers:
+                move = searchers[seat].choose(table, seat)
+            else:
+                move = heuristic(table, seat, rng)
+            table.play(seat, *move)
+        else:
+            table.end_round(rng)
+    return table.winner
+
+
+def run_games ( players, games, budget, seed ):
+    '''
+    Play games with one searching bot in a random seat. Returns how many
+    the bot won.
+    '''
+    rng = random.Random(seed)
+    searcher = Searcher(budget=budget, seed=rng.getrandbits(64))
+    wins = 0
+    for ii in range(games):
+        seat = rng.randrange(players)
+        wins += play_game(players, { seat : searcher }, rng) == seat
+    return wins
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='Play the Skull bot against heuristic players.')
+    parser.add_argument('--games', type=int, default=50, help='games to play')
+    parser.add_argument('--players', type=int, default=4, help='players per game')
+    parser.add_argument('--budget', type=float, default=0.05, help='seconds the bot thinks per move')
+    parser.add_argument('--workers', type=int, default=0, help='processes to use (default all CPUs)')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the games')
+    args = parser.parse_args()
+
+    if not (MIN_PLAYERS <= args.players <= MAX_PLAYERS):
+        parser.error('players must be from %i to %i' % (MIN_PLAYERS, MAX_PLAYERS))
+
+    workers = args.workers or os.cpu_count() or 1
+    seeder = random.Random(args.seed)
+    sizes = [ args.games // workers + (ii < args.games % workers) for ii in range(workers) ]
+    jobs = [ (args.players, size, args.budget, seeder.getrandbits(64)) for size in sizes if size ]
+
+    started = time.monotonic()
+    if len(jobs) == 1:
+        wins = run_games(*jobs[0])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            wins = sum(executor.map(run_games, *zip(*jobs)))
+    elapsed = time.monotonic() - started
+
+    print('%i games of %i players in %.1fs' % (args.games, args.players, elapsed))
+    print('  bot won %i (%.1f%%, %.1f%% for an even share)' % (wins, 100 * wins / args.games, 100 / args.players))
+
+
+if __name__ == '__main__':
+    main()
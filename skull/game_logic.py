@@ -1,109 +1,39 @@
 # -*- coding: utf-8 -*-
-from .models import Game, Player
-import random, uuid
-
-MIN_PLAYERS = 3
-MAX_PLAYERS = 10
-WINNING_POINTS = 2
+from .models import Game, Player, SKULL
+from games.core import Rules, Engine
+from games.loader import find_player, player_at, player_named, in_turn_order
+from games.store import store, save_all
+from games import aio
+from games.cards import CardStack
+from .rules import MIN_PLAYERS, MAX_PLAYERS, WINNING_POINTS
+import random
 
 EMOJIS = { '0' : '🌸', '1' : '💀', 'X' : '☣️', 'NEXT' : '▶️', 'PASSED' : '👎', 'DEAD' : '☠️', 'WINNER' : '🏆', 'BID: 0': '&nbsp;' }
 
-def join ( tag, nickname ):
-    '''
-    Attempt to add a player to a game. If the game is in progress, this fails.
-    If the game already has a player with the same nickname, reconnects that player.
-    If the game doesn't exist, it is created and the player becomes its owner.
-    '''
-    try:
-        game = Game.objects.get(pk=tag)
-
-        try:
-            existing = game.player_set.get(nickname=nickname)
-            return str(existing.token), 'Rejoining game %s as existing player %s' % (tag, nickname), False
-        except Player.DoesNotExist:
-            pass
+class SkullRules(Rules):
+    Game = Game
+    min_players = MIN_PLAYERS
+    max_players = MAX_PLAYERS
+    over = Game.Stage.OVER
 
-        if game.stage != Game.Stage.GATHERING:
-            return None, 'Game %s already in progress' % tag, False
-                
-        if len(game.player_set.all()) >= MAX_PLAYERS:
-            return None, 'Game %s already has the maximum number of players (%i)' % (tag, MAX_PLAYERS), False
-            
-        game.player_set.create(nickname=nickname)
-        token = str(game.player_set.get(nickname=nickname).token)
-        
-        return token, 'Player %s joined game %s' % (nickname, tag), True
-        
-    except Game.DoesNotExist:
-        game = Game.create(tag, nickname)
-        token = str(game.player_set.get(nickname=nickname).token)
-        return token, 'Game %s created, owned by %s' % (tag, nickname), True
-
-
-def get_game_and_player ( tag, token ):
-    '''
-    Map game and player PKs to their model objects, if possible.
-    '''
-    try:
-        game = Game.objects.get(pk=tag)
-        
-        try:
-            valid = uuid.UUID(token)
-        except Exception:
-            return game, None, 'Invalid player token %s' % token
-        
-        player = Player.objects.get(pk=token)
-        
-        if player.game != game:
-            return game, player, 'Player %s is not in game %s' % (player.nickname, tag)
-        
-        return game, player, None
-        
-    except Game.DoesNotExist:
-        return None, None, 'Game %s does not exist' % tag
-    except Player.DoesNotExist:
-        return game, None, 'Player %s does not exist' % token
+    def deal ( self, game, players, seats ):
+        for pp, seat in zip(players, seats):
+            pp.reset(turn_order=seat, save=False)
+        game.round_start(save=False)
 
+    def started ( self, game, players ):
+        turn_order = ', '.join([p.nickname for p in in_turn_order(game)])
+        return 'Started game %s, turn order is [%s], %s to lead, all players must place their first card' % (game.tag, turn_order, player_at(game, game.next_player).nickname)
 
-def start ( tag, token ):
-    '''
-    Attempt to launch a game.
-    '''
-    game, player, err = get_game_and_player( tag, token )
-    if err is not None:
-        return err, False
-    
-    if game.stage not in (Game.Stage.GATHERING, Game.Stage.OVER):
-        return 'Game %s is already in progress' % tag, False
-    
-    players = game.player_set.all()
-    count = len(players)
-    if count < MIN_PLAYERS:
-        return 'Not enough players to start game %s (%i)' % (tag, count), False
-            
-    seq = random.sample(range(count), count)
-    for ii in range(count):
-        players[ii].reset(turn_order=seq[ii])
-        
-    players = game.player_set.all().order_by('turn_order')
-    turn_order = ', '.join([p.nickname for p in players])
 
-    game.round_start()
-    
-    return 'Started game %s, turn order is [%s], %s to lead, all players must place their first card' % (tag, turn_order, game.player_set.get(turn_order=game.next_player).nickname), True
-
-
-def pop_string ( ss, ii ):
-    '''
-    Similar functionality to `pop()` but for strings.
-    Extracts a character by index, returns the rest of the string and the character
-    separately.
-    '''
-    remainder = ss[:ii] + ss[(ii+1):]
-    popped = ss[ii]
-    return remainder, popped
+# joining, starting and destroying are the same for every game (see games.core)
+engine = Engine(SkullRules())
+move, view = engine.move, engine.view
+join, start, destroy, purge = engine.join, engine.start, engine.destroy, engine.purge
+get_game_and_player = engine.get_game_and_player
 
 
+@move
 def place ( tag, token, card ):
     '''
     Take a card from a player's hand by index and put it on their stack.
@@ -123,39 +53,39 @@ def place ( tag, token, card ):
         if (ii < 0) or (ii >= len(player.hand)):
             return "selected card is out of range for %s’s hand (%i)" % (player.nickname, ii), False
         
-        hand, card = pop_string(player.hand, ii)       
-        player.hand = hand
-        player.stack = card
+        card = player.hand.pop(ii)
+        player.stack = CardStack([card])
         player.save()
         
         game.placed += 1
         
-        if len(game.player_set.filter(stack='', alive=True))==0:
+        awaited = [ pp for pp in game.player_set.all() if (len(pp.stack) == 0) and pp.alive ]
+        
+        if len(awaited)==0:
             game.stage = Game.Stage.PLACING
             game.save()
-            next_player = game.player_set.get(turn_order=game.next_player)
+            next_player = player_at(game, game.next_player)
             action = 'place or bid' if len(next_player.hand) else 'bid'
             return 'all players have placed their first card, %s must %s' % (next_player.nickname, action), True
         else:
             game.save()
-            awaited = ', '.join([str(x.nickname) for x in game.player_set.filter(stack='', alive=True)])
+            awaited = ', '.join([str(x.nickname) for x in awaited])
             return '%s has placed their first card, waiting for %s' % (player.nickname, awaited), True
     
     elif game.stage == Game.Stage.PLACING:
         if player.turn_order != game.next_player:
             return "it is not player %s’s turn to place now" % player.nickname, False
         
-        if ii > len(player.hand):
+        if (ii < 0) or (ii >= len(player.hand)):
             return "selected card is not in %s’s hand (%i)" % (player.nickname, ii), False
        
-        hand, card = pop_string(player.hand, ii)       
-        player.hand = hand
-        player.stack += card
+        card = player.hand.pop(ii)
+        player.stack.push(card)
         player.save()
         
         game.placed += 1
         game.advance_player()
-        next_player = game.player_set.get(turn_order=game.next_player)
+        next_player = player_at(game, game.next_player)
         action = 'place or bid' if len(next_player.hand) else 'bid'
         return '%s has placed, %s must %s' % (player.nickname, next_player.nickname, action), True
         
@@ -163,6 +93,7 @@ def place ( tag, token, card ):
         return 'placing a card is not allowed at this game stage', False
 
 
+@move
 def bid ( tag, token, count ):
     '''
     Bid to turn over a certain number of cards.
@@ -190,7 +121,7 @@ def bid ( tag, token, count ):
             game.stage = Game.Stage.BIDDING
             game.advance_player()
             
-            return '%s started the bidding at %i, %s must bid higher or pass' % (player.nickname, count, game.player_set.get(turn_order=game.next_player).nickname), True
+            return '%s started the bidding at %i, %s must bid higher or pass' % (player.nickname, count, player_at(game, game.next_player).nickname), True
         else:
             game.stage = Game.Stage.FLIPPING
             game.save()
@@ -209,7 +140,7 @@ def bid ( tag, token, count ):
         
         if count < game.placed:
             game.advance_player()
-            return '%s raised bid to %i, %s must bid higher or pass' % (player.nickname, count, game.player_set.get(turn_order=game.next_player).nickname), True
+            return '%s raised bid to %i, %s must bid higher or pass' % (player.nickname, count, player_at(game, game.next_player).nickname), True
         else:
             game.stage = Game.Stage.FLIPPING
             game.save()
@@ -218,6 +149,7 @@ def bid ( tag, token, count ):
     else:
         return 'bidding is not allowed at this game stage', False
        
+@move
 def decline ( tag, token ):
     '''
     Surrender bidding for the rest of the round.
@@ -237,12 +169,13 @@ def decline ( tag, token ):
         if game.bidder == game.next_player:
             game.stage = Game.Stage.FLIPPING
             game.save()
-            return '%s passed, %s wins the bid and must now flip %i' % (player.nickname, game.player_set.get(turn_order=game.next_player).nickname, game.bid), True
+            return '%s passed, %s wins the bid and must now flip %i' % (player.nickname, player_at(game, game.next_player).nickname, game.bid), True
         else:
-            return '%s passed, %s must bid or pass' % (player.nickname,  game.player_set.get(turn_order=game.next_player).nickname), True
+            return '%s passed, %s must bid or pass' % (player.nickname,  player_at(game, game.next_player).nickname), True
     else:
         return 'passing is not a valid move at this game stage', False
 
+@move
 def flip ( tag, token, nickname ):
     '''
     Flip the top unflipped card of the target's pile. Target is identified by nickname
@@ -267,7 +200,7 @@ def flip ( tag, token, nickname ):
             
             flipped_card = player.stack[-player.flipped]
             
-            if flipped_card == '1':
+            if flipped_card == SKULL:
                 # player loses round
                 game.stage = Game.Stage.FLIPPER_LOST
                 game.skuller = game.next_player
@@ -288,7 +221,7 @@ def flip ( tag, token, nickname ):
         else:
             # ok, we care who the target is
             try:
-                target = game.player_set.get(nickname=nickname)
+                target = player_named(game, nickname)
                 
                 if len(target.stack) <= target.flipped:
                     return "no cards available to flip in %s’s stack" % target.nickname, False
@@ -300,7 +233,7 @@ def flip ( tag, token, nickname ):
                 
                 flipped_card = target.stack[-target.flipped]
                 
-                if flipped_card == '1':
+                if flipped_card == SKULL:
                     # player loses round
                     game.stage = Game.Stage.FLIPPER_LOST
                     game.skuller = target.turn_order
@@ -326,6 +259,19 @@ def flip ( tag, token, nickname ):
     else:
         return 'flipping is not a valid action at this game stage', False
 
+
+def next_round ( game, next_player ):
+    '''
+    Reset the game and every player for a new round, written together.
+    '''
+    game.round_start(next_player=next_player, save=False)
+    players = game.player_set.all()
+    for pp in players:
+        pp.round_start(save=False)
+    save_all([ game ] + list(players))
+
+
+@move
 def end_round ( tag, token ):
     '''
     Finalise the round, allocate a point or discard a card, kill player if appropriate,
@@ -335,91 +281,83 @@ def end_round ( tag, token ):
     if err is not None:
         return err, False
     
-    flipper = game.player_set.get(turn_order=game.next_player)
+    flipper = player_at(game, game.next_player)
     
     if game.stage == Game.Stage.FLIPPER_LOST:
-        flipper.hand += flipper.stack
-        flipper.stack = ''
-        flipper.hand, lost = pop_string(flipper.hand, random.randrange(len(flipper.hand)))
+        flipper.hand.extend(flipper.stack)
+        flipper.stack = CardStack()
+        lost = flipper.hand.pop(random.randrange(len(flipper.hand)))
         print('lost: %s, remaining: %s' % (lost, flipper.hand))
-        flipper.save()
         
         if len(flipper.hand) == 0:
             flipper.alive = False
-            flipper.save()
             
-            survivors = game.player_set.filter(alive=True)
+            survivors = [ pp for pp in game.player_set.all() if pp.alive ]
             if len(survivors) == 1:
                 game.stage = Game.Stage.OVER
                 game.winner = game.skuller
-                game.save()
+                save_all([ game, flipper ])
                 
-                return '%s loses their last card, leaving %s as the winner!' % (flipper.nickname, game.player_set.get(turn_order=game.skuller).nickname), True
+                store.checkpoint(game)
+                return '%s loses their last card, leaving %s as the winner!' % (flipper.nickname, player_at(game, game.skuller).nickname), True
             else:
-                game.round_start(next_player=game.skuller)
-                for pp in game.player_set.all():
-                    pp.round_start()
+                next_round(game, game.skuller)
                 
                 # catch case of dying on own skull
-                if not game.player_set.get(turn_order=game.next_player).alive:
+                if not player_at(game, game.next_player).alive:
                     game.advance_player()
                                 
-                return '%s loses their last card, %s starts the next round, all surviving players must place their first card' % (flipper.nickname, game.player_set.get(turn_order=game.next_player).nickname), True
+                store.checkpoint(game)
+                return '%s loses their last card, %s starts the next round, all surviving players must place their first card' % (flipper.nickname, player_at(game, game.next_player).nickname), True
         else:
-            game.round_start(next_player=game.skuller)
-            for pp in game.player_set.all():
-                pp.round_start()
+            next_round(game, game.skuller)
                 
-            return '%s loses a card, %s starts the next round, all surviving players must place their first card' % (flipper.nickname, game.player_set.get(turn_order=game.next_player).nickname), True
+            store.checkpoint(game)
+            return '%s loses a card, %s starts the next round, all surviving players must place their first card' % (flipper.nickname, player_at(game, game.next_player).nickname), True
                  
     elif game.stage == Game.Stage.FLIPPER_WON:
         flipper.points += 1
-        flipper.save()
         
         if flipper.points >= WINNING_POINTS:
             game.stage = Game.Stage.OVER
             game.winner = game.next_player
-            game.save()
+            save_all([ game, flipper ])
             
+            store.checkpoint(game)
             return '%s wins the game with %i points' % (flipper.nickname, flipper.points), True
         else:
-            game.round_start(next_player=game.next_player)
-            for pp in game.player_set.all():
-                pp.round_start()
+            next_round(game, game.next_player)
             
+            store.checkpoint(game)
             return '%s starts the next round, all surviving players must place their first card' % flipper.nickname, True
     else:
         return 'round is not ready to end', False
 
-def destroy ( tag, token ):
-    '''
-    Delete a game and all its players.
-    '''
-    game, player, err = get_game_and_player( tag, token )
-    if err is not None:
-        return False, err
-        
-    game.delete()
-    return True, 'game %s deleted' % tag
-
-
-def visible_state ( tag, token, emojify=False, emojify_status=True, hide_own_miniview=True ):
+@view
+def visible_state ( tag, token, emojify=False, emojify_status=True, hide_own_miniview=True, game=None ):
     '''
     Return a dict defining the game state as visible to the specified
     player. (Unrecognised players see only public state.)
+    An already loaded `game` may be passed in to build several players'
+    views from the same snapshot.
     '''
-    game, player, err = get_game_and_player( tag, token )
+    if game is None:
+        game, player, err = get_game_and_player( tag, token )
+    else:
+        player, err = find_player( game, token )
+    
     if game is None:
         return { 'tag' : tag, 'token' : token, 'err' : err }
     
     result = { 'tag' : tag, 'token' : token }
+    players = in_turn_order(game)
     
     # stage seems to come out as an int, failing comparisons
     stage = Game.Stage(game.stage)
     
     if player:
         result['nickname'] = player.nickname
-        if (stage==Game.Stage.STARTING) and (player.stack == '') and player.alive:
+        if (stage==Game.Stage.STARTING) and (len(player.stack) == 0) and player.alive:
             result['actions'] = ['place']
         elif (stage == Game.Stage.PLACING) and (player.turn_order == game.next_player):
             result['actions'] = ['place', 'bid']
@@ -431,7 +369,7 @@ def visible_state ( tag, token, emojify=False, emojify_status=True, hide_own_min
             result['actions'] = ['end_round']
         elif (stage == Game.Stage.OVER):
             result['actions'] = ['start', 'destroy']            
-        elif (stage == Game.Stage.GATHERING) and (len(game.player_set.all()) >= MIN_PLAYERS):
+        elif (stage == Game.Stage.GATHERING) and (len(players) >= MIN_PLAYERS):
             result['actions'] = ['start']            
         else:
             result['actions'] = []            
@@ -450,16 +388,17 @@ def visible_state ( tag, token, emojify=False, emojify_status=True, hide_own_min
     result['skuller'] = game.skuller
     result['winner'] = game.winner
     result['status'] = game.status
+    result['version'] = game.version
     
     result['players'] = []
     
-    for pp in game.player_set.all().order_by('turn_order'):
+    for pp in players:
         desc = { 'nickname' : pp.nickname,  'you' : (token == str(pp.token)),
                  'points' : pp.points, 'alive' : pp.alive,
                  'is_next' : (game.next_player != -1) and (pp.turn_order == game.next_player),
                  'passed' : pp.passed, 'owner' : pp.owner,
                  'turn_order' : pp.turn_order, 'flipped' : pp.flipped,
-                 'hand' : list(pp.hand), 'stack' : list(pp.stack) }
+                 'hand' : list(str(pp.hand)), 'stack' : list(str(pp.stack)) }
         
         desc['status'] = ('WINNER' if ((game.stage == Game.Stage.OVER) and (pp.turn_order == game.winner))
                           else 'DEAD' if (not pp.alive)
@@ -487,11 +426,11 @@ def visible_state ( tag, token, emojify=False, emojify_status=True, hide_own_min
             result['your_nickname'] = pp.nickname
             
             if emojify:
-                result['your_hand'] = [EMOJIS.get(x, x) for x in list(pp.hand)]
-                result['your_stack'] = [EMOJIS.get(x, x) for x in list(pp.stack)]
+                result['your_hand'] = [EMOJIS.get(x, x) for x in list(str(pp.hand))]
+                result['your_stack'] = [EMOJIS.get(x, x) for x in list(str(pp.stack))]
             else:
-                result['your_hand'] = list(pp.hand)
-                result['your_stack'] = list(pp.stack)
+                result['your_hand'] = list(str(pp.hand))
+                result['your_stack'] = list(str(pp.stack))
         
         if emojify:
             desc['hand'] = [EMOJIS.get(x, x) for x in desc['hand']]
@@ -506,12 +445,17 @@ def visible_state ( tag, token, emojify=False, emojify_status=True, hide_own_min
     return result
     
 
-def purge ():
-    '''
-    Destroy all games. For testing only, not to be exposed to outside world!
-    '''
-    Game.objects.all().delete()
-    
+# async versions of the entry points for the async views (see games.aio):
+# joining and destroying always touch the database, the rest can run
+# straight on the event loop when the game is resident in memory
+async_join, async_start, async_destroy = engine.async_join, engine.async_start, engine.async_destroy
+async_place = aio.move(Game, place)
+async_bid = aio.move(Game, bid)
+async_decline = aio.move(Game, decline)
+async_flip = aio.move(Game, flip)
+async_end_round = aio.move(Game, end_round)
+async_visible_state = aio.entry(Game, visible_state)
+
 
 def make_test ( tag='g' ):
     '''
@@ -0,0 +1,62 @@
+from django.db import migrations
+import games.cards
+from games.cards import CardStack
+
+
+def pack_cards ( apps, schema_editor ):
+    '''
+    Convert '0001'-style card strings to bit stacks.
+    '''
+    Player = apps.get_model('skull', 'Player')
+    
+    for player in Player.objects.all():
+        player.hand_packed = CardStack(player.hand)
+        player.stack_packed = CardStack(player.stack)
+        player.save(update_fields=['hand_packed', 'stack_packed'])
+
+def unpack_cards ( apps, schema_editor ):
+    Player = apps.get_model('skull', 'Player')
+    
+    for player in Player.objects.all():
+        player.hand = str(player.hand_packed)
+        player.stack = str(player.stack_packed)
+        player.save(update_fields=['hand', 'stack'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skull', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='hand_packed',
+            field=games.cards.CardStackField(default=24),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='stack_packed',
+            field=games.cards.CardStackField(default=1),
+        ),
+        migrations.RunPython(pack_cards, unpack_cards),
+        migrations.RemoveField(
+            model_name='player',
+            name='hand',
+        ),
+        migrations.RemoveField(
+            model_name='player',
+            name='stack',
+        ),
+        migrations.RenameField(
+            model_name='player',
+            old_name='hand_packed',
+            new_name='hand',
+        ),
+        migrations.RenameField(
+            model_name='player',
+            old_name='stack_packed',
+            new_name='stack',
+        ),
+    ]
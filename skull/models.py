@@ -2,8 +2,15 @@ import uuid
 import datetime
 from django.utils import timezone
 from django.db import models
+from games.store import WriteBehindMixin
+from games.journal import JournalEntry
+from games.cards import CardStack, CardStackField
+from .rules import FLOWER, SKULL, STARTING_FLOWERS, STARTING_SKULLS
 
-class Game(models.Model):
+# every player starts with three flowers and a skull
+STARTING_HAND = CardStack([FLOWER] * STARTING_FLOWERS + [SKULL] * STARTING_SKULLS).pack()
+
+class Game(WriteBehindMixin, models.Model):
     # games are identified by a user-specified tag, as with Codenames
     tag = models.CharField(max_length=32, primary_key=True)
     
@@ -14,6 +21,9 @@ class Game(models.Model):
     # the most recent game state notification message
     status = models.CharField(max_length=200, default='')
     
+    # bumped whenever the game's visible state changes, to key cached views of it
+    version = models.PositiveIntegerField(default=0)
+    
     # game phase
     class Stage(models.IntegerChoices):
         # waiting for players
@@ -52,10 +62,10 @@ class Game(models.Model):
     def create(cls, tag, owner_nickname):
         game = cls(tag=tag)
         game.save()
-        game.player_set.create(game=game, nickname=owner_nickname, owner=True)
-        return game
+        owner = game.player_set.create(game=game, nickname=owner_nickname, owner=True)
+        return game, owner
     
-    def round_start (self, next_player=0):
+    def round_start (self, next_player=0, save=True):
         self.stage = Game.Stage.STARTING            
         self.next_player = next_player            
         self.placed = 0
@@ -64,12 +74,13 @@ class Game(models.Model):
         self.flipped = 0
         self.skuller = -1
         self.winner = -1
-        self.save()
+        if save:
+            self.save()
 
         
     def advance_player (self):
         current = self.next_player
-        players = self.player_set.order_by('turn_order')
+        players = sorted(self.player_set.all(), key=lambda pp: pp.turn_order)
         
         candidate = (current + 1) % len(players)
         
@@ -86,7 +97,7 @@ class Game(models.Model):
         return self.tag
     
 
-class Player(models.Model):
+class Player(WriteBehindMixin, models.Model):
     # each player has a unique token which is passed when moving
     # in order to validate their move
     token = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -101,10 +112,9 @@ class Player(models.Model):
     alive = models.BooleanField(default=True)
     passed = models.BooleanField(default=False)
     
-    # using strings for this kinda sucks, but it's easier than trying
-    # to do proper data structures in DB tables, and the structs are very simple
-    hand = models.CharField(max_length=4, default='0001')
-    stack = models.CharField(max_length=4, default='')
+    # cards packed as bit stacks, stack is bottom first so the top is stack[-1]
+    hand = CardStackField(default=STARTING_HAND)
+    stack = CardStackField(default=CardStack().pack())
     flipped = models.IntegerField(default=0)
     
     # allocated on game start
@@ -113,28 +123,32 @@ class Player(models.Model):
     # first player to join a game gets to start it
     owner = models.BooleanField(default=False)
     
+    # moves for this seat are made by the turn scheduler (see games.scheduler)
+    automated = models.BooleanField(default=False)
+    
     def __str__(self):
         return self.nickname
     
-    def reset (self, turn_order=-1):
+    def reset (self, turn_order=-1, save=True):
         self.points = 0
         self.alive = True
         self.passed = False
-        self.hand = '0001'
-        self.stack = ''
+        self.hand = STARTING_HAND
+        self.stack = CardStack()
         self.flipped = 0
         self.turn_order = turn_order
-        self.save()
+        if save:
+            self.save()
     
-    def round_start (self):
+    def round_start (self, save=True):
         self.passed = False
-        self.hand += self.stack
-        self.stack = ''
+        self.hand.extend(self.stack)
+        self.stack = CardStack()
         self.flipped = 0
-        self.save()
-    
-    
-        
-    
-    
-    
\ No newline at end of file
+        if save:
+            self.save()
+
+
+class Move(JournalEntry):
+    # the game's append-only move journal (see games.journal)
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
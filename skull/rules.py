@@ -0,0 +1,14 @@
+'''
+Skull rules that don't need the database, shared by the game logic and
+the headless engine (see `skull.engine`).
+'''
+MIN_PLAYERS = 3
+MAX_PLAYERS = 10
+WINNING_POINTS = 2
+
+FLOWER = 0
+SKULL = 1
+
+# every player starts with three flowers and a skull
+STARTING_FLOWERS = 3
+STARTING_SKULLS = 1
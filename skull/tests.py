@@ -1,3 +1,183 @@
-from django.test import TestCase
+import asyncio, json, random
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from games import events, patches
+from games.snapshots import cache
+from games.loader import in_turn_order
+from games.journal import journal, capture
+
+from . import game_logic as GM
+from . import engine
+from .bots import SkullAutoplay
+
+
+class QueryCountTests(TestCase):
+    '''
+    Changing rounds writes every player at once.
+    '''
+    def test_round_reset ( self ):
+        counts = []
+        for count in (GM.MIN_PLAYERS, GM.MAX_PLAYERS):
+            tag = 'e%i' % count
+            tokens = [ GM.join(tag, 'p%i' % ii)[0] for ii in range(count) ]
+            with CaptureQueriesContext(connection) as started:
+                GM.start(tag, tokens[0])
+            
+            GM.Game.objects.filter(pk=tag).update(stage=GM.Game.Stage.FLIPPER_WON, next_player=0)
+            with CaptureQueriesContext(connection) as ended:
+                msg, ok = GM.end_round(tag, tokens[0])
+            self.assertTrue(ok, msg)
+            counts.append((len(started.captured_queries), len(ended.captured_queries)))
+        
+        # every player is reset at once, however many there are
+        self.assertEqual(counts[0], counts[1])
+
+
+@override_settings(GAME_EVENT_COALESCE=0)
+class PatchTests(TestCase):
+    '''
+    After the first push, moves go out to each viewer as small patches
+    that turn their previous state into the new one.
+    '''
+    def tearDown ( self ):
+        cache.clear()
+    
+    def move ( self, token, **kwargs ):
+        with mock.patch('games.events.send_event') as send, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/skull/p/', dict(kwargs, token=token, how='json'))
+        self.assertEqual(response.status_code, 200)
+        return { call.args[0] : (call.args[1], call.args[2]) for call in send.call_args_list }
+    
+    def test_patches ( self ):
+        tokens = [ GM.join('p', 'p%i' % ii)[0] for ii in range(GM.MAX_PLAYERS) ]
+        
+        # nothing pushed before, so everyone gets the whole state
+        pushed = self.move(tokens[0], move='start')
+        self.assertEqual(len(pushed), GM.MAX_PLAYERS + 1)
+        self.assertEqual(set([ kind for kind, _ in pushed.values() ]), { 'state' })
+        states = { channel : state for channel, (_, state) in pushed.items() }
+        
+        pushed = self.move(tokens[3], move='place', card='0')
+        self.assertEqual(set([ kind for kind, _ in pushed.values() ]), { 'patch' })
+        
+        for channel, (_, patch) in pushed.items():
+            full = cache.at(GM.Game.objects.get(pk='p'), patch['version'], channel.split('-', 1)[1])[1]
+            self.assertEqual(patch['base'], states[channel]['version'])
+            self.assertEqual(patches.apply(states[channel], patch), full)
+            self.assertLess(len(json.dumps(patch)) * 5, len(json.dumps(full)))
+
+    
+    @override_settings(GAME_EVENT_COALESCE=60)
+    def test_burst ( self ):
+        tokens = [ GM.join('b', 'p%i' % ii)[0] for ii in range(GM.MIN_PLAYERS) ]
+        
+        # starting, then everyone placing their first card at once
+        with mock.patch('games.events.send_event') as send:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/skull/b/', { 'token' : tokens[0], 'how' : 'json', 'move' : 'start' })
+                for token in tokens:
+                    response = self.client.post('/skull/b/', { 'token' : token, 'how' : 'json', 'move' : 'place', 'card' : '0' })
+                    self.assertEqual(response.json()['msg'], '')
+            self.assertFalse(send.called)
+            events.coalescer.flush()
+        
+        # one push per viewer, of where the burst ended up
+        game = GM.Game.objects.get(pk='b')
+        self.assertEqual(game.stage, GM.Game.Stage.PLACING)
+        self.assertEqual(sorted([ call.args[0] for call in send.call_args_list ]),
+                         sorted([ 'b-%s' % tt for tt in tokens ] + [ 'b-nobody' ]))
+        self.assertEqual(set([ call.args[2]['version'] for call in send.call_args_list ]), { game.version })
+
+
+class EngineTests(TestCase):
+    '''
+    The headless engine follows the game logic move for move, and its bot
+    only ever picks legal moves.
+    '''
+    def load ( self, tag ):
+        game, _, _ = GM.get_game_and_player(tag, None)
+        return game, in_turn_order(game)
+    
+    def test_follows_game_logic ( self ):
+        tokens = { nick : GM.join('e', nick)[0] for nick in ('p0', 'p1', 'p2', 'p3') }
+        GM.start('e', tokens['p0'])
+        rng = random.Random(4)
+        
+        for ii in range(400):
+            game, players = self.load('e')
+            table = engine.Table.from_game(game, players)
+            self.assertEqual(engine.Table.decode(table.encode()).encode(), table.encode())
+            
+            if table.stage == engine.OVER:
+                break
+            if table.stage not in engine.ACTIVE:
+                msg, ok = GM.end_round('e', tokens['p0'])
+                self.assertTrue(ok, msg)
+                continue
+            
+            seat = table.to_move()
+            move = engine.heuristic(table, seat, rng)
+            name, kwargs = engine.move_args(move[0], move[1], list(players[seat].hand), [ pp.nickname for pp in players ])
+            msg, ok = getattr(GM, name)('e', str(players[seat].token), **kwargs)
+            self.assertTrue(ok, msg)
+            
+            table.play(seat, *move)
+            game, players = self.load('e')
+            self.assertEqual(engine.Table.from_game(game, players).encode(), table.encode())
+        
+        self.assertEqual(table.stage, engine.OVER)
+    
+    def test_searcher ( self ):
+        rng = random.Random(2)
+        searcher = engine.Searcher(budget=0, max_playouts=50, seed=2)
+        table = engine.Table(5)
+        while table.stage != engine.OVER:
+            if table.stage in engine.ACTIVE:
+                seat = table.to_move()
+                move = searcher.choose(table, seat)
+                self.assertIn(move, table.legal(seat))
+                
+                # the search mustn't depend on cards the seat can't see
+                guess = table.determinize(seat, rng)
+                self.assertEqual(guess.legal(seat), table.legal(seat))
+                table.play(seat, *move)
+            else:
+                table.end_round(rng)
+    
+    @override_settings(GAME_BOT_DEADLINE=0.01)
+    def test_autoplay ( self ):
+        tokens = [ GM.join('a', 'p%i' % ii)[0] for ii in range(3) ]
+        GM.start('a', tokens[0])
+        autoplay = SkullAutoplay()
+        
+        with mock.patch('games.events.send_event'):
+            for ii in range(400):
+                game, players = self.load('a')
+                waiting = autoplay.waiting(game, players)
+                if not waiting:
+                    break
+                
+                # think as the scheduler would, only here and now
+                plan = autoplay.plan(game, players, waiting[0])
+                name, kwargs = plan.finish(plan.fn(*plan.args)) if plan.fn else plan.fallback
+                msg, ok = getattr(GM, name)('a', str(waiting[0].token), **kwargs)
+                self.assertTrue(ok, msg)
+        
+        self.assertEqual(game.stage, GM.Game.Stage.OVER)
+        
+        # the whole game is in the journal
+        game, players = self.load('a')
+        self.assertEqual(journal.replay(GM.Game, 'a')[0], capture(game, players))
+    
+    def test_suggest_async ( self ):
+        tokens = [ GM.join('w', 'p%i' % ii)[0] for ii in range(3) ]
+        GM.start('w', tokens[0])
+        game, players = self.load('w')
+        
+        name, kwargs = asyncio.run(engine.suggest_async(game, players, 1, budget=0.01))
+        self.assertEqual(name, 'place')
+        msg, ok = GM.place('w', str(players[1].token), **kwargs)
+        self.assertTrue(ok, msg)
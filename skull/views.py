@@ -1,83 +1,43 @@
-from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponseRedirect, HttpResponse, JsonResponse
-from django.urls import reverse
-
-from django_eventstream import send_event
+from games.pages import GamePages
 
 from .models import Game
 from . import game_logic as GM
 
-import json
-
-# send messages to game clients to notify of state changes
-# no idea how this is going to work yet,
-# for now it's a placeholder
-def send_notification (request, tag, msg, action='refresh'):
-    try:
-        game = Game.objects.get(pk=tag)
-        game.status = msg
-        game.save()
-        
-    except Game.DoesNotExist:
-        pass
-
-    # send message irrespective of game existence, to notify destruction
-    send_event(tag, 'message', {'text':action})
-
-# index page: join a game
-def index(request):
-    return render(request, 'skull/index.html', {})
-
-# game page: view game state, optionally performing an action
-def game(request, tag):
-    action = request.POST.get('move', None)
-    token = request.session.get('token', request.POST.get('token', 'nobody'))
-    how = request.POST.get('how', None)
-    notify = False
-    
-    if action=='join':
-        nick = request.POST.get('nick', None)
-        if nick is None:
-            return render(request, 'skull/index.html', { 'msg' : 'you must provide a valid nickname to join a game' })
-        token, msg, notify = GM.join(tag, nick)
-        if token is not None:
-            request.session['token'] = token
-        
-    elif action=='start':
-        msg, notify = GM.start(tag, token)
-    elif action=='place': 
-        card = request.POST['card']
-        msg, notify = GM.place(tag, token, card)
-    elif action=='bid':
-        bid = request.POST['bid']
-        msg, notify = GM.bid(tag, token, bid)
-    elif action=='decline':
-        msg, notify = GM.decline(tag, token)
-    elif action=='flip':
-        target = request.POST['target']   
-        msg, notify = GM.flip(tag, token, target)
-    elif action=='end_round': 
-        msg, notify = GM.end_round(tag, token)
-    elif action=='destroy':
-        success, msg = GM.destroy(tag, token)
-        if success:
-            send_notification(request, tag, msg, action='index')
-            return render(request, 'skull/index.html', { 'msg' : msg })
-    else:
-        msg = 'You are viewing this game as non-player.' if token=='nobody' else ''
-        notify = False
-    
-    if notify:
-        send_notification(request, tag, msg)
-        msg = ''
-    
-    msg = msg or ''
 
-    state = GM.visible_state(tag, token)
-    state['msg'] = msg
+class SkullPages(GamePages):
+    Game = Game
+    logic = GM
+    session_key = 'token'
+    plays = ('place', 'bid', 'decline', 'flip', 'end_round')
     
-    if how == 'json':
-        return JsonResponse(state)
-    else:
-        state['json_state'] = json.dumps(state)
-        return render(request, 'skull/game.html', state)
+    async def play ( self, tag, token, action, data ):
+        if action=='place': 
+            try:
+                card = int(data.get('card', '-1'))
+            except Exception:
+                card = -1
+            
+            return await GM.async_place(tag, token, card)
+        elif action=='bid':
+            try:
+                bid = int(data.get('bid', '0'))
+            except Exception:
+                bid = 0
+            
+            return await GM.async_bid(tag, token, bid)
+        elif action=='decline':
+            return await GM.async_decline(tag, token)
+        elif action=='flip':
+            # players are flipped by nickname
+            target = str(data.get('target', ''))
+            return await GM.async_flip(tag, token, target)
+        elif action=='end_round': 
+            return await GM.async_end_round(tag, token)
+
+
+pages = SkullPages()
+
+# the app's urls, bots and sockets use these
+index, game = pages.index, pages.game
+send_notification = pages.send_notification
+act, MOVES = pages.act, pages.moves